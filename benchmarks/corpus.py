@@ -0,0 +1,364 @@
+import json
+import random
+import argparse
+import itertools
+
+# Детерминированный генератор синтетических книг для нагрузочных прогонов.
+# Для одного seed получаются одни и те же поля книги во всех форматах пайплайна:
+#   text_by_chapters / _simplified                       — ChapterStructure
+#   ..._sentence_translation                             — ChapterStructureTranslatedSentences
+#   ..._sentence_translation_words                       — ChapterStructureWithSentences (WordItem)
+#   tasks_true_or_false / tasks_truefalse_howto / ..._words — задания по абзацам
+#   chapters_titles / chapters_titles_translations
+# Частоты слов распределены по Ципфу, так что задания и словари ведут себя как на живом тексте.
+#
+#   python -m benchmarks.corpus --size novel --seed 7 --output novel.json
+
+# Готовые размеры (в словах исходного текста)
+SIZES = {
+    "story": 3_000,
+    "novella": 30_000,
+    "novel": 100_000,
+    "epic": 1_000_000,
+}
+
+SYLLABLES = (
+    "ka", "lo", "mi", "ren", "sa", "tor", "vel", "an", "dor", "is", "mar", "el",
+    "qu", "bra", "sil", "ont", "ve", "ra", "th", "wen", "gal", "op", "ur", "hes",
+)
+
+SUFFIXES = ("", "s", "ed", "ing")
+
+# Короткие служебные слова стоят в начале словаря и получают самые высокие частоты
+FUNCTION_WORDS = (
+    "the", "a", "and", "of", "to", "in", "he", "she", "it", "was", "his", "her",
+    "that", "with", "on", "as", "at", "by", "but", "not", "they", "from", "had", "for",
+)
+
+QUESTION_WORDS = ("Is", "Was", "Did", "Does", "Has")
+
+
+def _pseudo_word(rng: random.Random, min_syllables: int = 1, max_syllables: int = 4) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(min_syllables, max_syllables)))
+
+
+class Vocabulary:
+    """
+    Синтетический словарь: лемма, её формы и переводы; выборка слов по закону Ципфа.
+    """
+
+    def __init__(self, rng: random.Random, size: int = 6000, zipf_s: float = 1.07):
+        lemmas = list(FUNCTION_WORDS)
+        seen = set(lemmas)
+        while len(lemmas) < size:
+            word = _pseudo_word(rng)
+            if word not in seen:
+                seen.add(word)
+                lemmas.append(word)
+
+        self.lemmas = lemmas
+        self.translations = {lemma: "~" + _pseudo_word(rng, 2, 5) for lemma in lemmas}
+
+        cumulative = 0.0
+        self.cum_weights = []
+        for rank in range(1, len(lemmas) + 1):
+            cumulative += 1.0 / (rank ** zipf_s)
+            self.cum_weights.append(cumulative)
+
+    def sample(self, rng: random.Random, k: int) -> list[str]:
+        return rng.choices(self.lemmas, cum_weights=self.cum_weights, k=k)
+
+    def inflect(self, rng: random.Random, lemma: str) -> str:
+        if lemma in FUNCTION_WORDS:
+            return lemma
+        return lemma + rng.choice(SUFFIXES)
+
+    def word_item(self, form: str, lemma: str) -> dict:
+        lemma_t = self.translations[lemma]
+        suffix = form[len(lemma):]
+        return {
+            "o": form,
+            "o_t": lemma_t + suffix,
+            "l": lemma if form != lemma else "",
+            "l_t": lemma_t if form != lemma else "",
+        }
+
+
+def _sentence(rng: random.Random, vocab: Vocabulary, min_words: int, max_words: int) -> list[tuple[str, str]]:
+    lemmas = vocab.sample(rng, rng.randint(min_words, max_words))
+    return [(vocab.inflect(rng, lemma), lemma) for lemma in lemmas]
+
+
+def _join(tokens: list[str]) -> str:
+    text = " ".join(tokens)
+    return text[:1].upper() + text[1:] + "."
+
+
+def _sentence_entries(number: int, pairs: list[tuple[str, str]], vocab: Vocabulary) -> tuple[dict, dict]:
+    original = _join([form for form, _ in pairs])
+    translation = _join([vocab.word_item(form, lemma)["o_t"] for form, lemma in pairs])
+    translated = {
+        "sentence_number": number,
+        "sentence_original": original,
+        "sentence_translation": translation,
+    }
+    with_words = dict(translated)
+    with_words["words"] = [vocab.word_item(form, lemma) for form, lemma in pairs]
+    return translated, with_words
+
+
+def _paragraph_tasks(rng: random.Random, chapter_number: int, paragraph: dict, vocab: Vocabulary) -> dict:
+    candidates = []
+    for sentence in paragraph["sentences"]:
+        sid = sentence["sentence_number"]
+        for wid, word in enumerate(sentence["words"]):
+            if len(word["o"]) <= 22 and len(word["o_t"]) <= 22:
+                candidates.append(f"{chapter_number}_{paragraph['paragraph_number']}_{sid}_{wid + 1}")
+
+    subject = " ".join(vocab.sample(rng, rng.randint(3, 6)))
+    true_or_false = {
+        "question": f"{rng.choice(QUESTION_WORDS)} {subject}",
+        "answer": "true" if rng.random() < 0.6 else "false",
+    }
+
+    how_to_translate = None
+    two_words = None
+    if len(candidates) >= 3:
+        c, i1, i2 = rng.sample(candidates, 3)
+        how_to_translate = {"c": c, "i1": i1, "i2": i2}
+        id1, id2 = rng.sample(candidates, 2)
+        two_words = {"id1": id1, "id2": id2, "invented": vocab.translations[rng.choice(vocab.lemmas)]}
+
+    return {
+        "true_or_false": true_or_false,
+        "how_to_translate": how_to_translate,
+        "two_words": two_words,
+    }
+
+
+def iter_chapters(words: int, seed: int = 42, words_per_chapter: int = 3000, simplified: bool = True):
+    """
+    Генерирует главы по одной: на каждую главу словарь с фрагментами всех полей книги.
+    Держать в памяти роман на 1M слов целиком при этом не нужно.
+    """
+    rng = random.Random(seed)
+    vocab = Vocabulary(random.Random(seed))
+
+    remaining = words
+    for chapter_number in itertools.count(1):
+        if remaining <= 0:
+            return
+
+        chapter_budget = min(remaining, int(words_per_chapter * rng.uniform(0.7, 1.3)) or 1)
+        remaining -= chapter_budget
+
+        fields = {
+            "text_by_chapters": [],
+            "text_by_chapters_sentence_translation": [],
+            "text_by_chapters_sentence_translation_words": [],
+            "text_by_chapters_simplified": [],
+            "text_by_chapters_simplified_sentence_translation": [],
+            "text_by_chapters_simplified_sentence_translation_words": [],
+            "tasks_true_or_false": [],
+            "tasks_truefalse_howto": [],
+            "tasks_truefalse_howto_words": [],
+            "tasks_true_or_false_simplified": [],
+            "tasks_truefalse_howto_simplified": [],
+            "tasks_truefalse_howto_words_simplified": [],
+        }
+
+        paragraph_number = 0
+        while chapter_budget > 0:
+            paragraph_number += 1
+            sentences = [_sentence(rng, vocab, 6, 20) for _ in range(rng.randint(1, 6))]
+            chapter_budget -= sum(len(s) for s in sentences)
+
+            variants = [("", sentences)]
+            if simplified:
+                # Упрощённый текст: те же абзацы, но короче предложения
+                variants.append(("_simplified", [_sentence(rng, vocab, 4, 9) for _ in sentences]))
+
+            for suffix, variant in variants:
+                translated, with_words = [], []
+                for number, pairs in enumerate(variant, start=1):
+                    t, w = _sentence_entries(number, pairs, vocab)
+                    translated.append(t)
+                    with_words.append(w)
+
+                fields[f"text_by_chapters{suffix}"].append({
+                    "paragraph_number": paragraph_number,
+                    "paragraph_content": " ".join(s["sentence_original"] for s in translated),
+                })
+                fields[f"text_by_chapters{suffix}_sentence_translation"].append({
+                    "paragraph_number": paragraph_number,
+                    "sentences": translated,
+                })
+                words_paragraph = {"paragraph_number": paragraph_number, "sentences": with_words}
+                fields[f"text_by_chapters{suffix}_sentence_translation_words"].append(words_paragraph)
+
+                tasks = _paragraph_tasks(rng, chapter_number, words_paragraph, vocab)
+                fields[f"tasks_true_or_false{suffix}"].append(
+                    {"paragraph_number": paragraph_number, "true_or_false": tasks["true_or_false"]})
+                fields[f"tasks_truefalse_howto{suffix}"].append(
+                    {"paragraph_number": paragraph_number, "how_to_translate": tasks["how_to_translate"]})
+                fields[f"tasks_truefalse_howto_words{suffix}"].append(
+                    {"paragraph_number": paragraph_number, "two_words": tasks["two_words"]})
+
+        title = _join(vocab.sample(rng, rng.randint(2, 4)))[:-1]
+        yield {
+            "chapter_number": chapter_number,
+            "title": title,
+            "title_translation": " ".join(vocab.translations[w] for w in title.lower().split()),
+            "fields": {name: value for name, value in fields.items() if value},
+        }
+
+
+def generate_book(words: int, seed: int = 42, words_per_chapter: int = 3000, simplified: bool = True) -> dict:
+    """
+    Собирает все поля книги в виде JSON-строк, как они лежат в Supabase.
+    """
+    chunks: dict[str, list[str]] = {}
+    titles, titles_translated = [], []
+    paragraphs_total = 0
+
+    for chapter in iter_chapters(words, seed, words_per_chapter, simplified):
+        number = chapter["chapter_number"]
+        paragraphs_total += len(chapter["fields"]["text_by_chapters"])
+        for name, paragraphs in chapter["fields"].items():
+            chunks.setdefault(name, []).append(json.dumps(
+                {"chapter_number": number, "paragraphs": paragraphs}, ensure_ascii=False, indent=2))
+        titles.append({"chapter_number": number, "title": chapter["title"], "summary": ""})
+        titles_translated.append({"chapter_number": number, "title": chapter["title_translation"]})
+
+    # Склеиваем главы без повторной сериализации всей книги
+    book = {name: '{"chapters": [' + ",\n".join(parts) + "]}" for name, parts in chunks.items()}
+    book["chapters_titles"] = json.dumps({"chapters": titles}, ensure_ascii=False, indent=2)
+    book["chapters_titles_translations"] = json.dumps(
+        {"chapters": titles_translated}, ensure_ascii=False, indent=2)
+    book["words"] = words
+    book["paragraphs"] = paragraphs_total
+    return book
+
+
+# Какие поля книги заполнять в стенде в зависимости от того, что замеряется
+STAGES = {
+    # только исходный текст: замер перевода и всех последующих шагов
+    "raw": ("text_by_chapters", "text_by_chapters_simplified", "chapters_titles"),
+    # готовые переводы: замер разбора слов и заданий
+    "translated": (
+        "text_by_chapters_sentence_translation",
+        "text_by_chapters_simplified_sentence_translation",
+        "chapters_titles_translations",
+    ),
+    # всё готово: замер экспорта
+    "full": (
+        "text_by_chapters_sentence_translation_words",
+        "text_by_chapters_simplified_sentence_translation_words",
+        "tasks_true_or_false",
+        "tasks_true_or_false_simplified",
+        "tasks_truefalse_howto",
+        "tasks_truefalse_howto_simplified",
+        "tasks_truefalse_howto_words",
+        "tasks_truefalse_howto_words_simplified",
+    ),
+}
+
+BOOK_FIELDS = ("text_by_chapters", "text_by_chapters_simplified", "chapters_titles")
+
+
+def stage_fields(stage: str) -> list[str]:
+    order = list(STAGES)
+    if stage not in STAGES:
+        raise ValueError(f"Неизвестная стадия {stage}, доступны: {', '.join(order)}")
+    return [name for s in order[:order.index(stage) + 1] for name in STAGES[s]]
+
+
+def load_into(services, book_id: int, book: dict, target_langs: list[str], stage: str = "raw",
+              source_lang: str = "en"):
+    """
+    Кладёт сгенерированную книгу в локальный стенд (benchmarks.mock_services.MockServices).
+    """
+    fields = [name for name in stage_fields(stage) if name in book]
+
+    services.seed_rows("elevenlabs_voices", [
+        {"id": book_id, "voice_id": f"voice-{book_id}", "name": "Mock"}])
+
+    book_row = {
+        "id": book_id,
+        "title": f"Synthetic book {book_id}",
+        "author": "Bench Author",
+        "year": 1900,
+        "voice": book_id,
+        "source_lang": source_lang,
+    }
+    book_row.update({name: book[name] for name in fields if name in BOOK_FIELDS})
+    services.seed_rows("books", [book_row])
+
+    for lang in target_langs:
+        services.seed_rows("book_export_view", [{
+            "book_id": book_id, "language": lang, "year": 1900, "words": book["words"],
+            "genre": "fiction", "set": "bench", "author": "Bench Author",
+        }])
+        translation_row = {
+            "book_id": book_id,
+            "language": lang,
+            "title": f"Synthetic book {book_id} ({lang})",
+            "author": "Bench Author",
+            # без переведённых заголовков экспорт падает, поэтому они есть на любой стадии
+            "chapters_titles_translations": book["chapters_titles_translations"],
+        }
+        translation_row.update({name: book[name] for name in fields if name not in BOOK_FIELDS})
+        services.seed_rows("books_translations", [translation_row])
+
+
+def validate_book(book: dict):
+    """
+    Проверяет поля книги схемами пайплайна. Для больших книг занимает заметное время.
+    """
+    from schemas.chapter_schema import ChapterStructure
+    from schemas.translation_schema import (
+        ChapterStructureTranslatedSentences,
+        ChapterStructureWithSentences,
+    )
+
+    for name, text in book.items():
+        if not isinstance(text, str):
+            continue
+        if name.startswith(("tasks_", "chapters_titles")):
+            json.loads(text)
+        elif name.endswith("_words"):
+            ChapterStructureWithSentences.model_validate_json(text)
+        elif name.endswith("_sentence_translation"):
+            ChapterStructureTranslatedSentences.model_validate_json(text)
+        else:
+            ChapterStructure.model_validate_json(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генератор синтетических книг для бенчмарков")
+    parser.add_argument("--size", default="story",
+                        help=f"{', '.join(SIZES)} или число слов")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--words-per-chapter", type=int, default=3000)
+    parser.add_argument("--validate", action="store_true", help="проверить поля схемами пайплайна")
+    parser.add_argument("--output", default=None, help="куда сохранить книгу (JSON с полями)")
+    args = parser.parse_args()
+
+    words = SIZES.get(args.size) or int(args.size)
+    book = generate_book(words, args.seed, args.words_per_chapter)
+    chapters = json.loads(book["chapters_titles"])["chapters"]
+    size_mb = sum(len(v) for v in book.values() if isinstance(v, str)) / 1024 / 1024
+    print(f"📚 Книга на {words} слов: глав {len(chapters)}, абзацев {book['paragraphs']}, {size_mb:.1f} МБ JSON")
+
+    if args.validate:
+        validate_book(book)
+        print("✅ Все поля проходят схемы пайплайна")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(book, f, ensure_ascii=False)
+        print(f"💾 Книга сохранена в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import re
+import json
+import random
+import hashlib
+
+# Правдоподобные ответы OpenAI для локального стенда.
+# Structured output выбирается по имени схемы (response_format.json_schema.name),
+# остальное генерируется по JSON Schema — так шаги пайплайна проходят свои проверки.
+
+LOREM = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+    "incididunt ut labore et dolore magna aliqua enim ad minim veniam quis nostrud"
+).split()
+
+ID_PATTERN = re.compile(r'"id\d?"\s*:\s*"([^"]+)"')
+WORD_PATTERN = re.compile(r"[\w'’-]+", re.UNICODE)
+
+
+def _rng(text: str) -> random.Random:
+    seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+    return random.Random(seed)
+
+
+def _phrase(rng: random.Random, words: int = 5) -> str:
+    return " ".join(rng.choice(LOREM) for _ in range(words))
+
+
+def _load_json(text: str):
+    try:
+        return json.loads(text)
+    except Exception:
+        return None
+
+
+def instance_from_schema(schema: dict, rng: random.Random, defs: dict = None):
+    defs = defs if defs is not None else schema.get("$defs", {})
+
+    if "$ref" in schema:
+        return instance_from_schema(defs[schema["$ref"].split("/")[-1]], rng, defs)
+    if "anyOf" in schema:
+        options = [s for s in schema["anyOf"] if s.get("type") != "null"]
+        return instance_from_schema(options[0], rng, defs) if options else None
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    if "const" in schema:
+        return schema["const"]
+
+    schema_type = schema.get("type")
+    if schema_type == "object":
+        return {
+            name: instance_from_schema(prop, rng, defs)
+            for name, prop in schema.get("properties", {}).items()
+        }
+    if schema_type == "array":
+        return [instance_from_schema(schema.get("items", {}), rng, defs) for _ in range(2)]
+    if schema_type == "integer":
+        return rng.randint(1, 10)
+    if schema_type == "number":
+        return round(rng.random(), 3)
+    if schema_type == "boolean":
+        return rng.random() < 0.5
+    return _phrase(rng, 3)
+
+
+# === Ответы для конкретных схем ===
+
+def _translated_paragraph(user_text, schema, rng):
+    data = _load_json(user_text) or {"paragraph_number": 1, "sentences": []}
+    return {
+        "paragraph_number": data.get("paragraph_number", 1),
+        "sentences": [
+            {
+                "sentence_number": s["sentence_number"],
+                "sentence_original": s["sentence_original"],
+                "sentence_translation": "~" + s["sentence_original"],
+            }
+            for s in data.get("sentences", [])
+        ],
+    }
+
+
+def _word_analysis(user_text, schema, rng):
+    data = _load_json(user_text) or []
+    sentences = []
+    for s in data:
+        words = [
+            {"o": w, "o_t": w.upper(), "l": "", "l_t": ""}
+            for w in WORD_PATTERN.findall(s.get("sentence_original", ""))
+        ]
+        sentences.append(
+            {"sentence_number": s["sentence_number"], "words": words})
+    return {"sentences": sentences}
+
+
+def _segmentation(user_text, schema, rng):
+    data = _load_json(user_text) or []
+    return {"sentences": [
+        {"sentence_number": s["sentence_number"],
+         "words": [{"o": w, "l": ""} for w in WORD_PATTERN.findall(s.get("sentence_original", ""))]}
+        for s in data
+    ]}
+
+
+def _word_translations(user_text, schema, rng):
+    data = _load_json(user_text) or []
+    return {"words": [
+        {"id": w["id"], "o_t": w["o"].upper(), "l_t": ""}
+        for s in data for w in s.get("words", [])
+    ]}
+
+
+def _how_to_translate(user_text, schema, rng):
+    ids = ID_PATTERN.findall(user_text) or ["1_1_1_1"]
+    picked = rng.sample(ids, 3) if len(ids) >= 3 else (ids * 3)[:3]
+    return {"correct_id": picked[0], "incorrect1_id": picked[1], "incorrect2_id": picked[2]}
+
+
+def _two_words(user_text, schema, rng):
+    ids = ID_PATTERN.findall(user_text) or ["1_1_1_1"]
+    picked = rng.sample(ids, 2) if len(ids) >= 2 else (ids * 2)[:2]
+    return {"id1": picked[0], "id2": picked[1], "invented": rng.choice(LOREM)}
+
+
+def _paragraph_tasks(user_text, schema, rng):
+    return {
+        "true_or_false_question": _phrase(rng, 5).capitalize(),
+        "how_to_translate": _how_to_translate(user_text, schema, rng),
+        "two_words": _two_words(user_text, schema, rng),
+    }
+
+
+RESPONDERS = {
+    "ChapterParagraphSentenceTranslated": _translated_paragraph,
+    "ParagraphWordAnalysis": _word_analysis,
+    "ParagraphSegmentation": _segmentation,
+    "ParagraphWordTranslations": _word_translations,
+    "HowToTranslateTask": _how_to_translate,
+    "TwoWordsTask": _two_words,
+    "ParagraphTasks": _paragraph_tasks,
+}
+
+
+def _message_text(message: dict) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return "\n".join(part.get("text", "") for part in content if part.get("type") == "text")
+    return content
+
+
+def _has_image(messages: list) -> bool:
+    return any(
+        isinstance(m.get("content"), list)
+        and any(part.get("type") == "image_url" for part in m["content"])
+        for m in messages
+    )
+
+
+def fake_chat_content(body: dict) -> str:
+    messages = body.get("messages", [])
+    user_messages = [m for m in messages if m.get("role") == "user"]
+    user_text = _message_text(user_messages[-1]) if user_messages else ""
+    system_text = "\n".join(_message_text(m)
+                            for m in messages if m.get("role") == "system")
+    rng = _rng(system_text + user_text)
+
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        json_schema = response_format["json_schema"]
+        responder = RESPONDERS.get(json_schema.get("name"))
+        if responder:
+            return json.dumps(responder(user_text, json_schema["schema"], rng), ensure_ascii=False)
+        return json.dumps(instance_from_schema(json_schema["schema"], rng), ensure_ascii=False)
+
+    # Текстовые ответы: оценки изображений, сравнение стиля, заголовки и summary
+    if _has_image(messages):
+        return str(rng.randint(6, 9))
+    if "TRUE" in system_text and "FALSE" in system_text:
+        return "TRUE"
+    return _phrase(rng, 8).capitalize()
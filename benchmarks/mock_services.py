@@ -0,0 +1,438 @@
+import re
+import json
+import time
+import zlib
+import base64
+import random
+import struct
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit, parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.fake_llm import fake_chat_content
+
+# Локальный стенд внешних сервисов для бенчмарков:
+#   OpenAI      — /v1/chat/completions, /v1/images/generations|edits, /v1/embeddings
+#   ElevenLabs  — /v1/text-to-speech/<voice>/with-timestamps, /v1/voices
+#   Supabase    — /rest/v1/<table> (подмножество PostgREST в памяти)
+# Для каждого сервиса настраиваются задержка, доля ответов 429 и доля ошибок 500.
+
+SERVICES = ("openai", "elevenlabs", "supabase")
+
+
+@dataclass
+class FaultProfile:
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    rate_limit_rate: float = 0.0
+    error_rate: float = 0.0
+    retry_after_s: float = 1.0
+
+
+@dataclass
+class MockState:
+    tables: dict = field(default_factory=dict)
+    faults: dict = field(default_factory=dict)
+    stats: Counter = field(default_factory=Counter)
+    next_ids: Counter = field(default_factory=Counter)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    rng: random.Random = field(default_factory=lambda: random.Random(0))
+    image_size: int = 1024
+
+    def count(self, key: str):
+        with self.lock:
+            self.stats[key] += 1
+
+    def fault(self, service: str) -> FaultProfile:
+        return self.faults.get(service) or FaultProfile()
+
+    def insert_row(self, table: str, row: dict) -> dict:
+        row = dict(row)
+        with self.lock:
+            if row.get("id") is None:
+                self.next_ids[table] += 1
+                row["id"] = self.next_ids[table]
+            else:
+                self.next_ids[table] = max(self.next_ids[table], int(row["id"]))
+            self.tables.setdefault(table, []).append(row)
+        return row
+
+
+_png_cache: dict[int, bytes] = {}
+
+
+def _png(size: int) -> bytes:
+    """Градиентный PNG без сторонних библиотек — ответ генерации изображений."""
+    if size in _png_cache:
+        return _png_cache[size]
+
+    rows = bytearray()
+    for y in range(size):
+        rows.append(0)
+        shade = y * 255 // max(1, size - 1)
+        for x in range(size):
+            rows += bytes((x * 255 // max(1, size - 1), shade, 128))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    png = b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + \
+        chunk(b"IDAT", zlib.compress(bytes(rows), 6)) + chunk(b"IEND", b"")
+    _png_cache[size] = png
+    return png
+
+
+# === PostgREST ===
+
+def _parse_value(raw: str):
+    raw = raw.strip()
+    if len(raw) >= 2 and raw[0] == raw[-1] == '"':
+        return raw[1:-1]
+    return raw
+
+
+def _matches(row: dict, column: str, expr: str) -> bool:
+    op, _, raw = expr.partition(".")
+    value = row.get(column)
+    if op == "eq":
+        return str(value) == _parse_value(raw) if value is not None else False
+    if op == "neq":
+        return str(value) != _parse_value(raw)
+    if op == "in":
+        options = {_parse_value(v) for v in raw.strip("()").split(",") if v}
+        return str(value) in options
+    if op == "is":
+        return value is None if raw == "null" else str(value).lower() == raw
+    if op in ("gt", "gte", "lt", "lte"):
+        try:
+            left, right = float(value), float(raw)
+        except (TypeError, ValueError):
+            return False
+        return {"gt": left > right, "gte": left >= right, "lt": left < right, "lte": left <= right}[op]
+    return True
+
+
+RESERVED_PARAMS = {"select", "order", "limit",
+                   "offset", "columns", "on_conflict"}
+
+
+def _filter_rows(rows: list, params: list) -> list:
+    filters = [(k, v) for k, v in params if k not in RESERVED_PARAMS]
+    return [r for r in rows if all(_matches(r, k, v) for k, v in filters)]
+
+
+def _project(row: dict, select: str) -> dict:
+    if not select or select == "*":
+        return dict(row)
+    columns = [c.strip().strip('"') for c in select.split(",") if c.strip()]
+    return {c: row.get(c) for c in columns}
+
+
+class MockServicesHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: MockState = None
+
+    # --- Общая обвязка ---
+
+    def _service(self, path: str) -> str:
+        if path.startswith("/rest/v1/"):
+            return "supabase"
+        if path.startswith("/v1/text-to-speech") or path.startswith("/v1/voices"):
+            return "elevenlabs"
+        return "openai"
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send_json(self, status: int, payload, headers: dict = None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _inject_faults(self, service: str) -> bool:
+        fault = self.state.fault(service)
+        with self.state.lock:
+            delay = max(0.0, fault.latency_ms +
+                        self.state.rng.uniform(-fault.jitter_ms, fault.jitter_ms))
+            roll = self.state.rng.random()
+
+        if delay:
+            time.sleep(delay / 1000)
+
+        if roll < fault.rate_limit_rate:
+            self.state.count(f"{service}:429")
+            self._send_json(429, {"error": {"message": "Rate limit reached (mock)", "type": "requests",
+                                            "code": "rate_limit_exceeded"}},
+                            headers={"retry-after": str(fault.retry_after_s)})
+            return True
+        if roll < fault.rate_limit_rate + fault.error_rate:
+            self.state.count(f"{service}:500")
+            self._send_json(500, {"error": {"message": "Internal error (mock)", "type": "server_error"},
+                                  "code": "500", "message": "Internal error (mock)", "details": None, "hint": None})
+            return True
+        return False
+
+    def _handle(self, method: str):
+        url = urlsplit(self.path)
+        body = self._read_body()
+        service = self._service(url.path)
+        self.state.count(f"{service}:{method} {self._route_name(url.path)}")
+
+        if self._inject_faults(service):
+            return
+
+        if service == "supabase":
+            return self._postgrest(method, url, body)
+        if service == "elevenlabs":
+            return self._elevenlabs(url, body)
+        return self._openai(url, body)
+
+    def _route_name(self, path: str) -> str:
+        if path.startswith("/rest/v1/"):
+            return path
+        if path.startswith("/v1/text-to-speech"):
+            return "/v1/text-to-speech"
+        return path
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def do_HEAD(self):
+        self._handle("HEAD")
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- OpenAI ---
+
+    def _openai(self, url, body: bytes):
+        created = int(time.time())
+        if url.path.endswith("/chat/completions"):
+            payload = json.loads(body or b"{}")
+            content = fake_chat_content(payload)
+            prompt_tokens = len(body) // 4
+            return self._send_json(200, {
+                "id": f"chatcmpl-mock-{created}",
+                "object": "chat.completion",
+                "created": created,
+                "model": payload.get("model", "gpt-4.1"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content, "refusal": None},
+                    "finish_reason": "stop",
+                    "logprobs": None,
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(content) // 4,
+                    "total_tokens": prompt_tokens + len(content) // 4,
+                    "prompt_tokens_details": {"cached_tokens": 0},
+                },
+            })
+        if url.path.endswith("/images/generations") or url.path.endswith("/images/edits"):
+            image_b64 = base64.b64encode(
+                _png(self.state.image_size)).decode("ascii")
+            return self._send_json(200, {"created": created, "data": [{"b64_json": image_b64}]})
+        if url.path.endswith("/embeddings"):
+            payload = json.loads(body or b"{}")
+            inputs = payload.get("input")
+            inputs = inputs if isinstance(inputs, list) else [inputs]
+            rng = random.Random(len(body))
+            return self._send_json(200, {
+                "object": "list",
+                "data": [
+                    {"object": "embedding", "index": i,
+                     "embedding": [round(rng.uniform(-1, 1), 6) for _ in range(1536)]}
+                    for i in range(len(inputs))
+                ],
+                "model": payload.get("model", "text-embedding-3-small"),
+                "usage": {"prompt_tokens": 8, "total_tokens": 8},
+            })
+        return self._send_json(404, {"error": {"message": f"Unknown path {url.path}"}})
+
+    # --- ElevenLabs ---
+
+    def _elevenlabs(self, url, body: bytes):
+        if url.path.startswith("/v1/voices"):
+            return self._send_json(200, {"voices": []})
+
+        payload = json.loads(body or b"{}")
+        text = payload.get("text", "")
+        starts = [round(i * 0.06, 3) for i in range(len(text))]
+        return self._send_json(200, {
+            # ~1 КБ «аудио» на 100 символов, как у mp3 44.1кГц/128кбит по порядку величины
+            "audio_base64": base64.b64encode(b"\xff\xfb" * (5 * len(text) + 1)).decode("ascii"),
+            "alignment": {
+                "characters": list(text),
+                "character_start_times_seconds": starts,
+                "character_end_times_seconds": [s + 0.06 for s in starts],
+            },
+        })
+
+    # --- Supabase PostgREST ---
+
+    def _postgrest(self, method: str, url, body: bytes):
+        table = url.path[len("/rest/v1/"):]
+        params = parse_qsl(url.query, keep_blank_values=True)
+        query = dict(params)
+        prefer = self.headers.get("Prefer", "")
+        wants_object = "application/vnd.pgrst.object+json" in (
+            self.headers.get("Accept") or "")
+
+        with self.state.lock:
+            rows = self.state.tables.setdefault(table, [])
+
+            if method in ("GET", "HEAD"):
+                result = _filter_rows(rows, params)
+                order = query.get("order")
+                if order:
+                    for part in reversed(order.split(",")):
+                        column, _, direction = part.partition(".")
+                        result = sorted(result, key=lambda r: (r.get(column) is None, r.get(column)),
+                                        reverse=direction.startswith("desc"))
+                if "offset" in query:
+                    result = result[int(query["offset"]):]
+                if "limit" in query:
+                    result = result[:int(query["limit"])]
+                result = [_project(r, query.get("select", "*"))
+                          for r in result]
+
+            elif method == "PATCH":
+                changes = json.loads(body or b"{}")
+                result = _filter_rows(rows, params)
+                for row in result:
+                    row.update(changes)
+                result = [dict(r) for r in result]
+
+            elif method == "DELETE":
+                doomed = _filter_rows(rows, params)
+                doomed_ids = {id(r) for r in doomed}
+                self.state.tables[table] = [
+                    r for r in rows if id(r) not in doomed_ids]
+                result = [dict(r) for r in doomed]
+
+            else:
+                result = None
+
+        if method == "POST":
+            payload = json.loads(body or b"[]")
+            payload = payload if isinstance(payload, list) else [payload]
+            upsert = "resolution=merge-duplicates" in prefer
+            conflict_columns = [c for c in query.get(
+                "on_conflict", "id").split(",") if c]
+            result = []
+            for incoming in payload:
+                existing = None
+                if upsert:
+                    with self.state.lock:
+                        existing = next((r for r in self.state.tables.setdefault(table, [])
+                                         if all(c in incoming and str(r.get(c)) == str(incoming[c])
+                                                for c in conflict_columns)), None)
+                        if existing is not None:
+                            existing.update(incoming)
+                            result.append(dict(existing))
+                if existing is None:
+                    result.append(self.state.insert_row(table, incoming))
+            if "return=representation" not in prefer:
+                self.send_response(201)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            return self._send_json(201, result)
+
+        if wants_object:
+            if len(result) != 1:
+                return self._send_json(406, {
+                    "code": "PGRST116",
+                    "details": f"The result contains {len(result)} rows",
+                    "hint": None,
+                    "message": "JSON object requested, multiple (or no) rows returned",
+                })
+            return self._send_json(200, result[0])
+        return self._send_json(200, result)
+
+
+class MockServices:
+    def __init__(self, faults: dict = None, port: int = 0, seed: int = 0, image_size: int = 1024):
+        self.state = MockState(faults=faults or {}, rng=random.Random(seed),
+                               image_size=image_size)
+        handler = type("BoundMockServicesHandler",
+                       (MockServicesHandler,), {"state": self.state})
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="mock-services", daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self) -> dict:
+        """Переменные окружения, перенаправляющие клиентов пайплайна на стенд."""
+        return {
+            "OPENAI_API_KEY": "sk-mock",
+            "OPENAI_BASE_URL": f"{self.url}/v1",
+            "SUPABASE_URL": self.url,
+            # create_client проверяет, что ключ похож на JWT
+            "SUPABASE_KEY": "mock.mock.mock",
+            "ELEVENLABS_API_KEY": "mock",
+            "ELEVENLABS_BASE_URL": self.url,
+        }
+
+    def seed_rows(self, table: str, rows: list):
+        for row in rows:
+            self.state.insert_row(table, row)
+
+    def table(self, table: str) -> list:
+        with self.state.lock:
+            return [dict(r) for r in self.state.tables.get(table, [])]
+
+    def reset_stats(self):
+        with self.state.lock:
+            self.state.stats.clear()
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def parse_fault(spec: str) -> FaultProfile:
+    """'latency=300,jitter=100,429=0.02,500=0.01' → FaultProfile."""
+    names = {"latency": "latency_ms", "jitter": "jitter_ms", "429": "rate_limit_rate",
+             "500": "error_rate", "retry_after": "retry_after_s"}
+    profile = FaultProfile()
+    for part in re.split(r"[,\s]+", spec.strip()):
+        if not part:
+            continue
+        key, _, value = part.partition("=")
+        setattr(profile, names[key], float(value))
+    return profile
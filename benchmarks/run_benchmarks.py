@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+import yaml
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.mock_services import MockServices, parse_fault  # noqa: E402
+from benchmarks.corpus import SIZES, STAGES, generate_book, load_into  # noqa: E402
+
+# Сквозной бенчмарк пайплайна на локальном стенде:
+#   python -m benchmarks.run_benchmarks --words story,novella --openai "latency=300,jitter=100,429=0.02"
+# Для каждой синтетической книги замеряется process_book_id и export_book_json.
+
+DEFAULT_STEPS = [
+    "translate_sentences",
+    "translate_words",
+    "tasks_true_or_false",
+    "tasks_how_to_translate",
+    "tasks_two_words",
+]
+
+def parse_sizes(value: str) -> list[int]:
+    return [SIZES.get(x.strip()) or int(x) for x in value.split(",") if x.strip()]
+
+
+def write_config(workdir: Path, steps: list[str], source_lang: str, target_langs: list[str]):
+    with open(REPO_ROOT / "config.yaml", "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+
+    config["source_lang"] = source_lang
+    config["target_lang"] = ", ".join(target_langs)
+    config["steps"] = {name: name in steps for name in config["steps"]}
+    config.setdefault("options", {})["workers"] = 1
+    config.setdefault("metrics", {})["enabled"] = False
+
+    with open(workdir / "config.yaml", "w", encoding="utf-8") as f:
+        yaml.safe_dump(config, f, allow_unicode=True, sort_keys=False)
+
+
+def summarize_stats(stats: dict) -> dict:
+    summary = {"openai": 0, "elevenlabs": 0, "supabase": 0, "429": 0, "500": 0}
+    for key, count in stats.items():
+        service, _, route = key.partition(":")
+        if route in ("429", "500"):
+            summary[route] += count
+        else:
+            summary[service] += count
+    return summary
+
+
+def run(args) -> list[dict]:
+    sizes = parse_sizes(args.words)
+    target_langs = [x.strip() for x in args.langs.split(",") if x.strip()]
+    steps = [x.strip() for x in args.steps.split(",") if x.strip()]
+    faults = {
+        "openai": parse_fault(args.openai),
+        "elevenlabs": parse_fault(args.elevenlabs),
+        "supabase": parse_fault(args.supabase),
+    }
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="clew-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    write_config(workdir, steps, args.source_lang, target_langs)
+
+    results = []
+    with MockServices(faults=faults, seed=args.seed, image_size=args.image_size) as services:
+        os.environ.update(services.env())
+        previous_cwd = os.getcwd()
+        os.chdir(workdir)
+        if args.profile:
+            from utils import profiling
+            profiling.enable(str(workdir / "profiles"))
+        try:
+            from utils.run_book_pipeline import process_book_id
+            from steps.export import export_book_json
+            from utils.profiling import profile_step
+
+            paragraphs_by_book = {}
+            for book_id, words in enumerate(sizes, start=1):
+                book = generate_book(words, seed=args.seed + book_id)
+                load_into(services, book_id, book, target_langs,
+                          stage=args.stage, source_lang=args.source_lang)
+                paragraphs_by_book[book_id] = book["paragraphs"]
+
+            for book_id, words in enumerate(sizes, start=1):
+                paragraphs = paragraphs_by_book[book_id]
+                print(
+                    f"\n⏱ Бенчмарк: книга {book_id}, слов {words}, абзацев {paragraphs}, языки {', '.join(target_langs)}")
+
+                services.reset_stats()
+                started = time.perf_counter()
+                process_book_id(book_id)
+                pipeline_seconds = time.perf_counter() - started
+                pipeline_requests = summarize_stats(dict(services.state.stats))
+
+                services.reset_stats()
+                started = time.perf_counter()
+                with profile_step("export", book_id):
+                    export_book_json(book_id_start=book_id, book_id_end=book_id,
+                                     source_lang=args.source_lang, target_langs=target_langs)
+                export_seconds = time.perf_counter() - started
+                export_requests = summarize_stats(dict(services.state.stats))
+
+                total = paragraphs * len(target_langs)
+                results.append({
+                    "book_id": book_id,
+                    "words": words,
+                    "paragraphs": paragraphs,
+                    "stage": args.stage,
+                    "languages": len(target_langs),
+                    "steps": steps,
+                    "pipeline_seconds": round(pipeline_seconds, 3),
+                    "pipeline_paragraphs_per_s": round(total / pipeline_seconds, 2) if pipeline_seconds else None,
+                    "pipeline_requests": pipeline_requests,
+                    "export_seconds": round(export_seconds, 3),
+                    "export_paragraphs_per_s": round(total / export_seconds, 2) if export_seconds else None,
+                    "export_requests": export_requests,
+                })
+        finally:
+            if args.profile:
+                profiling.merge_collapsed()
+            os.chdir(previous_cwd)
+
+    return results
+
+
+def print_results(results: list[dict]):
+    print("\n📊 Результаты бенчмарка")
+    header = f"{'книга':>5} {'абзацев':>8} {'пайплайн, с':>12} {'абз/с':>8} {'OpenAI':>7} {'429':>5} {'экспорт, с':>11} {'абз/с':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['book_id']:>5} {r['paragraphs']:>8} {r['pipeline_seconds']:>12.2f} "
+            f"{r['pipeline_paragraphs_per_s'] or 0:>8.2f} {r['pipeline_requests']['openai']:>7} "
+            f"{r['pipeline_requests']['429']:>5} {r['export_seconds']:>11.2f} {r['export_paragraphs_per_s'] or 0:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Бенчмарк пайплайна Clew на локальных заглушках OpenAI/ElevenLabs/Supabase")
+    parser.add_argument("--words", default="3000",
+                        help=f"размеры синтетических книг в словах через запятую ({', '.join(SIZES)} или число)")
+    parser.add_argument("--stage", default="raw", choices=list(STAGES),
+                        help="какие поля книги уже готовы: raw — только текст, translated — переводы, full — всё для экспорта")
+    parser.add_argument("--langs", default="ru", help="целевые языки")
+    parser.add_argument("--source-lang", default="en")
+    parser.add_argument("--steps", default=",".join(DEFAULT_STEPS),
+                        help="шаги config.yaml, включаемые в прогоне")
+    parser.add_argument("--openai", default="latency=0",
+                        help="профиль задержек/ошибок: latency=300,jitter=100,429=0.02,500=0.01,retry_after=1")
+    parser.add_argument("--elevenlabs", default="latency=0")
+    parser.add_argument("--supabase", default="latency=0")
+    parser.add_argument("--image-size", type=int, default=1024)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--profile", action="store_true",
+                        help="профили шагов и flamegraph.collapsed в <workdir>/profiles")
+    parser.add_argument("--workdir", default=None,
+                        help="рабочая папка (config.yaml, export/, logs/)")
+    parser.add_argument("--output", default=None,
+                        help="куда сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    results = run(args)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"💾 Результаты сохранены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ import multiprocessing
 import yaml
 import sys
 from utils.run_book_pipeline import process_book_id
+from utils import metrics, profiling
 from steps import export
 
 # Загружаем конфиг
@@ -19,13 +20,29 @@ num_workers = config.get("options", {}).get("workers", 1)
 
 if __name__ == "__main__":
 
+    metrics_queue = metrics.setup_from_config(config)
+
+    # python main.py --profile — cProfile и flamegraph-стеки по каждому шагу
+    if "--profile" in sys.argv:
+        profiling_config = config.get("profiling", {}) or {}
+        profiling.enable(profiling_config.get("output_dir", "profiles"),
+                         profiling_config.get("interval_ms", profiling.DEFAULT_INTERVAL_MS))
+
     if steps_enabled.get("export"):
         from dotenv import load_dotenv
         load_dotenv()
-        export.export_book_json(book_id_start=book_id_start, book_id_end=book_id_end,
-                                source_lang=source_lang, target_langs=target_langs)
+        with profiling.profile_step("export"):
+            export.export_book_json(book_id_start=book_id_start, book_id_end=book_id_end,
+                                    source_lang=source_lang, target_langs=target_langs)
+        profiling.merge_collapsed()
         sys.exit(0)
 
     print(f"✅ Начинаем обработку {len(book_ids)} книг в {num_workers} потоков")
-    with multiprocessing.Pool(processes=num_workers) as pool:
+    pool_kwargs = {}
+    if metrics_queue is not None:
+        pool_kwargs = {"initializer": metrics.init_worker,
+                       "initargs": (metrics_queue,)}
+    with multiprocessing.Pool(processes=num_workers, **pool_kwargs) as pool:
         pool.map(process_book_id, book_ids, chunksize=1)
+
+    profiling.merge_collapsed()
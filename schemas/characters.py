@@ -82,6 +82,10 @@ class CharacterMentions(BaseModel):
     mentions: List[CharacterMention]
 
 
+class MentionedCharacters(BaseModel):
+    ids: List[int]
+
+
 class ImageVerification(BaseModel):
     verification: int  # оценка 1-10
     comment: str       # короткий комментарий
\ No newline at end of file
@@ -0,0 +1,10 @@
+from pydantic import BaseModel
+from schemas.paragraph_translate import HowToTranslateTask
+from schemas.paragraph_two_words import TwoWordsTask
+
+
+# --- Все задания по абзацу одним ответом ---
+class ParagraphTasks(BaseModel):
+    true_or_false_question: str         # утверждение (верное или ложное — задаётся в промпте)
+    how_to_translate: HowToTranslateTask
+    two_words: TwoWordsTask
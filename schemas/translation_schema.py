@@ -45,6 +45,31 @@ class ParagraphWordAnalysis(BaseModel):
     sentences: List[SentenceWordList]
 
 
+# --- Двухфазный разбор: сначала группы слов и леммы (один раз на книгу), затем переводы на каждый язык ---
+class SegmentItem(BaseModel):
+    o: str            # original
+    l: Optional[str]  # lemma
+
+
+class SentenceSegments(BaseModel):
+    sentence_number: int
+    words: List[SegmentItem]
+
+
+class ParagraphSegmentation(BaseModel):
+    sentences: List[SentenceSegments]
+
+
+class WordTranslationItem(BaseModel):
+    id: str             # <sentence_number>_<номер группы>
+    o_t: str            # original translation
+    l_t: Optional[str]  # lemma translation
+
+
+class ParagraphWordTranslations(BaseModel):
+    words: List[WordTranslationItem]
+
+
 class SentenceOriginal(BaseModel):
     sentence_number: int
     sentence_original: str
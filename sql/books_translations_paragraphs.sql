@@ -0,0 +1,82 @@
+-- Нормализованное хранение полей books_translations по абзацам (storage.layout: paragraphs).
+-- Одна строка — один абзац поля (перевод, разбор слов, задания); paragraph_number = 0 — заголовок главы,
+-- чтобы при сборке сохранялись и пустые главы. В самой колонке books_translations остаётся метка
+-- {"storage": "books_translations_paragraphs"}: поле заполнено, содержимое — в строках этой таблицы.
+-- content — json, а не jsonb: порядок ключей остаётся тем, в котором его записал пайплайн.
+
+CREATE TABLE IF NOT EXISTS books_translations_paragraphs (
+    book_id bigint NOT NULL,
+    language text NOT NULL,
+    field text NOT NULL,
+    chapter_number integer NOT NULL,
+    paragraph_number integer NOT NULL,
+    content json NOT NULL,
+    updated_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (book_id, language, field, chapter_number, paragraph_number)
+);
+
+-- Старая форма поля {"chapters": [{"chapter_number": .., "paragraphs": [..]}]} из строк таблицы.
+-- NULL, если строк нет.
+CREATE OR REPLACE FUNCTION books_translations_field_json(p_book_id bigint, p_language text, p_field text)
+RETURNS text
+LANGUAGE sql STABLE
+AS $$
+    SELECT json_build_object('chapters', json_agg(chapter ORDER BY chapter_number))::text
+    FROM (
+        SELECT h.chapter_number,
+               json_build_object(
+                   'chapter_number', h.chapter_number,
+                   'paragraphs', COALESCE((
+                       SELECT json_agg(p.content ORDER BY p.paragraph_number)
+                       FROM books_translations_paragraphs p
+                       WHERE p.book_id = h.book_id AND p.language = h.language AND p.field = h.field
+                         AND p.chapter_number = h.chapter_number AND p.paragraph_number > 0
+                   ), '[]'::json)) AS chapter
+        FROM books_translations_paragraphs h
+        WHERE h.book_id = p_book_id AND h.language = p_language AND h.field = p_field
+          AND h.paragraph_number = 0
+    ) chapters
+    HAVING count(*) > 0
+$$;
+
+-- Совместимость для потребителей, которые читают поля целиком (приложение, отчёты, ручные запросы):
+-- те же имена колонок, что у books_translations; поле с меткой собирается из строк по абзацам.
+CREATE OR REPLACE VIEW books_translations_assembled AS
+SELECT
+    t.id,
+    t.book_id,
+    t.language,
+    t.title,
+    t.author,
+    t.chapters_titles_translations,
+    CASE WHEN t.text_by_chapters_sentence_translation = '{"storage": "books_translations_paragraphs"}'
+         THEN books_translations_field_json(t.book_id, t.language, 'text_by_chapters_sentence_translation')
+         ELSE t.text_by_chapters_sentence_translation END AS text_by_chapters_sentence_translation,
+    CASE WHEN t.text_by_chapters_simplified_sentence_translation = '{"storage": "books_translations_paragraphs"}'
+         THEN books_translations_field_json(t.book_id, t.language, 'text_by_chapters_simplified_sentence_translation')
+         ELSE t.text_by_chapters_simplified_sentence_translation END AS text_by_chapters_simplified_sentence_translation,
+    CASE WHEN t.text_by_chapters_sentence_translation_words = '{"storage": "books_translations_paragraphs"}'
+         THEN books_translations_field_json(t.book_id, t.language, 'text_by_chapters_sentence_translation_words')
+         ELSE t.text_by_chapters_sentence_translation_words END AS text_by_chapters_sentence_translation_words,
+    CASE WHEN t.text_by_chapters_simplified_sentence_translation_words = '{"storage": "books_translations_paragraphs"}'
+         THEN books_translations_field_json(t.book_id, t.language, 'text_by_chapters_simplified_sentence_translation_words')
+         ELSE t.text_by_chapters_simplified_sentence_translation_words END AS text_by_chapters_simplified_sentence_translation_words,
+    CASE WHEN t.tasks_true_or_false = '{"storage": "books_translations_paragraphs"}'
+         THEN books_translations_field_json(t.book_id, t.language, 'tasks_true_or_false')
+         ELSE t.tasks_true_or_false END AS tasks_true_or_false,
+    CASE WHEN t.tasks_true_or_false_simplified = '{"storage": "books_translations_paragraphs"}'
+         THEN books_translations_field_json(t.book_id, t.language, 'tasks_true_or_false_simplified')
+         ELSE t.tasks_true_or_false_simplified END AS tasks_true_or_false_simplified,
+    CASE WHEN t.tasks_truefalse_howto = '{"storage": "books_translations_paragraphs"}'
+         THEN books_translations_field_json(t.book_id, t.language, 'tasks_truefalse_howto')
+         ELSE t.tasks_truefalse_howto END AS tasks_truefalse_howto,
+    CASE WHEN t.tasks_truefalse_howto_simplified = '{"storage": "books_translations_paragraphs"}'
+         THEN books_translations_field_json(t.book_id, t.language, 'tasks_truefalse_howto_simplified')
+         ELSE t.tasks_truefalse_howto_simplified END AS tasks_truefalse_howto_simplified,
+    CASE WHEN t.tasks_truefalse_howto_words = '{"storage": "books_translations_paragraphs"}'
+         THEN books_translations_field_json(t.book_id, t.language, 'tasks_truefalse_howto_words')
+         ELSE t.tasks_truefalse_howto_words END AS tasks_truefalse_howto_words,
+    CASE WHEN t.tasks_truefalse_howto_words_simplified = '{"storage": "books_translations_paragraphs"}'
+         THEN books_translations_field_json(t.book_id, t.language, 'tasks_truefalse_howto_words_simplified')
+         ELSE t.tasks_truefalse_howto_words_simplified END AS tasks_truefalse_howto_words_simplified
+FROM books_translations t;
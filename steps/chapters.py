@@ -6,9 +6,8 @@ import base64
 import google.generativeai as genai
 from openai import OpenAI
 from utils.supabase_client import get_supabase_client
+from utils import model_router, image_jobs, image_postprocess, image_similarity
 from PIL import Image
-from PIL import ImageEnhance
-from io import BytesIO
 
 ICON_STYLE_PAOLINI = "Cheerful, storybook illustration style with playful ink lines and bright, soft watercolors; friendly, round-faced characters in simple, expressive poses; light, sunny palette with creamy whites, warm yellows, and cheerful greens; scenes filled with animals, flowers, and handcrafted details; evokes joy, innocence, and a gentle sense of adventure — perfect for light-hearted fantasy or cozy rural tales."
 ICON_STYLE = "Bold, optimized for high visual clarity at small sizes illustration; characters shown in close-up or bust format with simplified, expressive forms and thick, readable silhouettes; flat or slightly gradient shading with minimal texture for sharp edge definition; strong contrast between character and background — clean color blocking and focused rim lighting for instant legibility; color palette tuned for recognizability: vibrant key tones (warm reds, cool cyans, bright yellows) over muted or monochrome backdrops; minimalistic composition with centered framing and balanced negative space; no visual noise or fine details that blur when downscaled; illustration rendered on a solid, non-transparent background for consistent appearance across all platforms; evokes personality and clarity in a format designed for avatars, buttons, app icons, and UI thumbnails."
@@ -77,7 +76,7 @@ def generate_titles(book_id: int, book_title: str, book_author: str):
         for attempt in range(2):
             try:
                 completion = client.beta.chat.completions.parse(
-                    model="gpt-4.1",
+                    model=model_router.model_for("chapters_title"),
                     messages=[
                         {"role": "system", "content": system_prompt},
                         {"role": "user", "content": user_prompt}
@@ -125,7 +124,7 @@ def generate_titles(book_id: int, book_title: str, book_author: str):
         for attempt in range(2):
             try:
                 completion = client.beta.chat.completions.parse(
-                    model="gpt-4.1",
+                    model=model_router.model_for("chapters_title"),
                     messages=[
                         {"role": "system", "content": system_prompt},
                         {"role": "user", "content": user_prompt}
@@ -174,7 +173,8 @@ def generate_image_icon(user_ref, title, author, content, style, model="gpt-imag
 
     client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-    response = client.images.generate(
+    response = image_jobs.generate(
+        client, "chapters_icons",
         model=model,
         prompt=prompt,
         n=1,
@@ -222,7 +222,7 @@ def generate_scene_description(summary, chapter_number, title, author, prev_scen
     for attempt in range(2):
         try:
             completion = client.beta.chat.completions.parse(
-                model="gpt-4.1",
+                model=model_router.model_for("chapters_icons"),
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt}
@@ -240,11 +240,19 @@ def generate_scene_description(summary, chapter_number, title, author, prev_scen
 
 def check_icons_style_similarity(prev_image: Image.Image, curr_image: Image.Image) -> bool:
     """
-    Сравнивает стилистическое и техническое сходство двух иконок через OpenAI.
+    Сравнивает стилистическое и техническое сходство двух иконок локально (utils/image_similarity.py):
+    палитра, тон и фактура; пограничные случаи — через OpenAI, если включено icon_similarity.llm_tiebreak.
     prev_image — PIL.Image.Image предыдущей главы (уже 256x256 или 512x512)
     curr_image — PIL.Image.Image текущей главы (уже 256x256 или 512x512)
     Возвращает True если всё ок, иначе False.
     """
+    return image_similarity.check_style(prev_image, curr_image, tiebreak=check_icons_style_similarity_llm)
+
+
+def check_icons_style_similarity_llm(prev_image: Image.Image, curr_image: Image.Image) -> bool:
+    """
+    Та же проверка через OpenAI: обе иконки уходят в модель изображениями.
+    """
     import base64
     import io
     from openai import OpenAI
@@ -268,17 +276,19 @@ def check_icons_style_similarity(prev_image: Image.Image, curr_image: Image.Imag
     try:
         client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
         completion = client.chat.completions.create(
-            model="gpt-4.1",
+            model=model_router.model_for("icons_style_check"),
             messages=[
                 {"role": "system", "content": compare_prompt},
-                {"role": "user",
-                    "content": "Первая иконка (base64): " + prev_b64},
-                {"role": "user",
-                    "content": "Вторая иконка (base64): " + curr_b64},
+                {"role": "user", "content": [
+                    {"type": "text", "text": "Первая иконка:"},
+                    {"type": "image_url", "image_url": {"url": f"data:image/webp;base64,{prev_b64}"}},
+                    {"type": "text", "text": "Вторая иконка:"},
+                    {"type": "image_url", "image_url": {"url": f"data:image/webp;base64,{curr_b64}"}},
+                ]},
             ]
         )
         result = completion.choices[0].message.content.strip().upper()
-        print(f"🔎 Сравнение иконок: {result}")
+        print(f"🔎 Сравнение иконок (LLM): {result}")
         return result == "TRUE"
     except Exception as e:
         print(f"❗ Ошибка сравнения стиля: {e}")
@@ -324,19 +334,17 @@ def generate_icons(book_id: int, title: str, author: str):
         for f in glob.glob(pattern_all):
             os.remove(f)
 
-    prev_scenes = []  # Описания предыдущих сцен
-    prev_image_small = None  # Сжатое изображение предыдущей главы (PIL.Image)
-
-    for chapter in chapters:
-        chapter_number = chapter.get("chapter_number")
-        summary = chapter.get("summary", "").strip()
-        if not summary:
-            print(
-                f"ICONS[{book_id}] ⚠️ Нет summary для главы {chapter_number}. Пропускаем.")
-            errors.append(f"Глава {chapter_number}")
-            continue
-
-        # --- Контекст всех предыдущих сцен
+    # 1. Описания сцен — последовательно: каждое опирается на описания предыдущих глав.
+    # Одна попытка главы — новое описание сцены и иконка по нему, всего попыток 5, как и раньше.
+    summaries = {}
+    scenes = {}  # глава → текущее описание сцены (принятое или ещё рисуемое)
+    attempts = {}  # глава → сколько описаний сцены уже запрошено
+
+    def describe(chapter_number):
+        """
+        Новое описание сцены главы; контекст — сцены предыдущих глав, которые не отброшены.
+        """
+        prev_scenes = [scenes[n] for n in sorted(scenes) if n < chapter_number]
         if prev_scenes:
             prev_scene_text = "Описание сцен предыдущих глав:\n" + \
                 "\n".join(
@@ -345,76 +353,100 @@ def generate_icons(book_id: int, title: str, author: str):
         else:
             prev_scene_text = ""
 
-        file_big = os.path.join(
-            outdir, f"book_{book_id}_{chapter_number}_big.webp")
-        file_small = os.path.join(
-            outdir, f"book_{book_id}_{chapter_number}.webp")
-
-        success = False
-        for attempt in range(5):
+        while attempts[chapter_number] < 5:
+            attempts[chapter_number] += 1
             print(
-                f"\nICONS[{book_id}] 📝 Глава {chapter_number}: Генерируем описание сцены для иллюстрации... (попытка {attempt+1})")
+                f"\nICONS[{book_id}] 📝 Глава {chapter_number}: Генерируем описание сцены для иллюстрации... (попытка {attempts[chapter_number]})")
             scene_description = generate_scene_description(
-                summary, chapter_number, title, author, prev_scene_text
+                summaries[chapter_number], chapter_number, title, author, prev_scene_text
             )
-            if not scene_description:
-                print(
-                    f"ICONS[{book_id}] ❌ Не удалось сгенерировать описание сцены для главы {chapter_number}.")
-                continue
+            if scene_description:
+                scenes[chapter_number] = scene_description
+                return True
+            print(
+                f"ICONS[{book_id}] ❌ Не удалось сгенерировать описание сцены для главы {chapter_number}.")
+            time.sleep(1)
+        scenes.pop(chapter_number, None)
+        return False
+
+    for chapter in chapters:
+        chapter_number = chapter.get("chapter_number")
+        summary = chapter.get("summary", "").strip()
+        if not summary:
+            print(
+                f"ICONS[{book_id}] ⚠️ Нет summary для главы {chapter_number}. Пропускаем.")
+            errors.append(f"Глава {chapter_number}")
+            continue
+        summaries[chapter_number] = summary
+        attempts[chapter_number] = 0
+        describe(chapter_number)
 
+    def draw(chapter_number):
+        try:
+            icon_bytes = generate_image_icon(
+                user_ref=user_ref,
+                title=title,
+                author=author,
+                content=scenes[chapter_number],
+                style=ICON_STYLE
+            )
+            print(f"ICONS[{book_id}] ✅ Глава {chapter_number}: изображение получено.")
+            # --- Экспозиция и сжатие — в пуле постобработки, поток генерации свободен для следующей главы
+            return image_postprocess.submit(image_postprocess.expose_icon, icon_bytes)
+        except Exception as e:
             print(
-                f"ICONS[{book_id}] 🎨 Глава {chapter_number}: Генерируем иконку...")
+                f"ICONS[{book_id}] ❌ Ошибка генерации иконки главы {chapter_number}: {e}")
+            return None
+
+    # 2. Иконки — раундами: все незавершённые главы рисуются параллельно, затем по порядку глав
+    # стиль сравнивается с ближайшей принятой предыдущей иконкой. Не прошедшие получают новое описание
+    # сцены и идут в следующий раунд, пока у главы остаются попытки.
+    accepted = {}  # глава → сжатое изображение (PIL.Image)
+    pending = sorted(scenes)
+    while pending:
+        print(
+            f"\nICONS[{book_id}] 🎨 Генерируем иконки: {len(pending)} глав...")
+        rejected = []
+        for chapter_number, processing in zip(pending, image_jobs.run_ordered(draw, pending)):
             try:
-                icon_bytes = generate_image_icon(
-                    user_ref=user_ref,
-                    title=title,
-                    author=author,
-                    content=scene_description,
-                    style=ICON_STYLE
-                )
-                print(f"ICONS[{book_id}] ✅ Изображение получено.")
+                image_small = processing.result() if processing is not None else None
             except Exception as e:
-                print(
-                    f"ICONS[{book_id}] ❌ Ошибка генерации иконки (попытка {attempt+1}): {e}")
-                time.sleep(1)
+                print(f"ICONS[{book_id}] ❌ Ошибка обработки иконки главы {chapter_number}: {e}")
+                image_small = None
+            if image_small is None:
+                rejected.append(chapter_number)
                 continue
 
-            # --- Экспозиция, сжатие и сравнение стиля ---
-            try:
-                image = Image.open(BytesIO(icon_bytes)).convert("RGBA")
-                enhancer = ImageEnhance.Brightness(image)
-                image_exposed = enhancer.enhance(1.10)
-                image_small = image_exposed.resize((512, 512), Image.LANCZOS)
-
-                need_regenerate = False
-                if prev_image_small is not None:
+            earlier = [n for n in accepted if n < chapter_number]
+            if earlier:
+                print(
+                    f"ICONS[{book_id}] 🧐 Глава {chapter_number}: сравниваем стиль с предыдущей главой...")
+                if not check_icons_style_similarity(accepted[max(earlier)], image_small):
                     print(
-                        f"ICONS[{book_id}] 🧐 Сравниваем стиль с предыдущей главой...")
-                    is_similar = check_icons_style_similarity(
-                        prev_image_small, image_small)
-                    if not is_similar:
-                        print(
-                            f"ICONS[{book_id}] ❌ Стиль отличается — перегенерируем, попытка {attempt+1}...")
-                        need_regenerate = True
-
-                if need_regenerate:
-                    time.sleep(1)
-                    continue  # Переходим к следующей попытке
-                else:
-                    # Сохраняем только если всё хорошо
-                    image_small.save(file_small, "WEBP")
-                    print(f"ICONS[{book_id}] 💾 Сохранено: {file_small}")
-                    prev_image_small = image_small
-                    prev_scenes.append(scene_description)
-                    success = True
-                    break
+                        f"ICONS[{book_id}] ❌ Стиль отличается — перегенерируем, попытка {attempts[chapter_number]}...")
+                    rejected.append(chapter_number)
+                    continue
+
+            # Сохраняем только если всё хорошо
+            try:
+                file_small = os.path.join(
+                    outdir, f"book_{book_id}_{chapter_number}.webp")
+                image_jobs.write_atomic(file_small, image_small, format="WEBP")
+                print(f"ICONS[{book_id}] 💾 Сохранено: {file_small}")
+                accepted[chapter_number] = image_small
             except Exception as e:
                 print(f"ICONS[{book_id}] ❌ Ошибка при сохранении файлов: {e}")
-                time.sleep(1)
+                rejected.append(chapter_number)
+
+        # Отклонённая сцена не должна попадать в контекст следующих: описание пишется заново
+        for chapter_number in rejected:
+            scenes.pop(chapter_number)
+        pending = [n for n in rejected if describe(n)]
 
-        if not success:
+    for chapter_number in summaries:
+        if chapter_number not in accepted:
             print(
-                f"ICONS[{book_id}] ❌ Не удалось сгенерировать иконку для главы {chapter_number} за 2 попытки.")
+                f"ICONS[{book_id}] ❌ Не удалось сгенерировать иконку для главы {chapter_number} за 5 попыток.")
             errors.append(f"Глава {chapter_number}")
 
     # Итог: список ошибок
@@ -514,7 +546,7 @@ def translate_titles(
         for attempt in range(3):
             try:
                 completion = client.beta.chat.completions.parse(
-                    model="gpt-4.1",
+                    model=model_router.model_for("chapters_title_translate"),
                     messages=[
                         {"role": "system", "content": prompt},
                     ]
@@ -556,7 +588,7 @@ def translate_titles(
             )
             try:
                 completion = client.beta.chat.completions.parse(
-                    model="gpt-4.1",
+                    model=model_router.model_for("chapters_title_translate"),
                     messages=[
                         {"role": "system", "content": shorten_prompt_reprase},
                     ]
@@ -9,13 +9,20 @@ from PIL import Image
 from pathlib import Path
 import io
 from datetime import datetime, timezone
+from concurrent.futures import as_completed
 from openai import OpenAI
 from utils.supabase_client import get_supabase_client
+from utils import model_router, image_jobs, image_cache, image_quality, concurrency, metrics
+from utils.batch_writer import BatchWriter, select_in
+from utils import alias_matcher, prompts
 from schemas.characters import (
     Names, Appearance, CharacterAppearanceSummary, CharactersInParagraph,
-    AppearanceItem, CharacterRoles, CharacterMention, CharacterMentions, ImageVerification
+    AppearanceItem, CharacterRoles, CharacterMention, CharacterMentions, ImageVerification,
+    MentionedCharacters
 )
 
+MAX_MENTION_DISAMBIGUATIONS = 50
+
 
 def load_config(config_path: str = "config.yaml") -> dict:
     with open(config_path, "r", encoding="utf-8") as f:
@@ -40,11 +47,27 @@ def clean_roles(supabase, book_id):
         "book_id", book_id).execute()
 
 
-def step_find_characters_and_appearance(book_id, data, paragraphs_with_id, supabase, client):
+def _character_messages(data, para_text, known_characters_for_prompt):
+    # инструкции — общий префикс всех абзацев, список персонажей меняется редко, абзац — в конце (utils/prompts.py)
+    return prompts.messages(
+        prompts.CHARACTERS_IN_PARAGRAPH,
+        prompts.context(**{
+            "Книга": data["title"],
+            "Автор": data["author"],
+            "Текущий список персонажей": json.dumps(known_characters_for_prompt, ensure_ascii=False),
+        }),
+        f"Абзац: {para_text}"
+    )
+
+
+def _find_characters_sequential(book_id, data, paragraphs_with_id, supabase, client) -> int:
     characters_by_id = {}
     character_names_by_id = {}
     total_paragraphs = len(paragraphs_with_id)
     processed = 0
+    # Новые персонажи вставляются сразу (их id нужен следующему промпту), переименования и внешность — пачками
+    characters_writer = BatchWriter(supabase, "books_characters")
+    appearance_writer = BatchWriter(supabase, "characters_appearance")
 
     for idx, para in enumerate(paragraphs_with_id, start=1):
         paragraph_num = idx
@@ -76,26 +99,16 @@ def step_find_characters_and_appearance(book_id, data, paragraphs_with_id, supab
             "Если персонаж новый, верни id=0. Вернуть список объектов, строго по схеме CharactersInParagraph."
         )
 
-        prompt = (
-            f"Книга: {data['title']}\n"
-            f"Автор: {data['author']}\n"
-            f"Абзац: {para_text}\n"
-            f"Текущий список персонажей: {json.dumps(known_characters_for_prompt, ensure_ascii=False)}\n"
-            "Найди в абзаце персонажей, которые являются ключевыми для сюжета книги. Малозначимых второстепенных персонажей пропускай."
-            "Если таких персонажей нет, верни пустой список по схеме CharactersInParagraph.\n"
-            "Не учитывай описание, если оно носит субъективный характер, например, если кто-то называет персонажа глупым или умницей."
-            "Для каждого найденного персонажа верни:\n"
-            "1. Объект Names с основным именем и всеми известными прозвищами/именами (измени основное имя и добавь дополнительные, если в абзаце появилось уточнение, или персонаж преобразился в нового персонаж).\n"
-            "2. Appearance с цитатой, касающейся внешности в этом абзаце. Пиши только выжимку из оригинального текста (например, желтое платье, красивый, высокий). Не возвращай деталей, которые не упоминаются в абзаце.\n"
-            "Если персонаж новый, верни id=0. Вернуть список объектов, строго по схеме CharactersInParagraph."
-        )
+        messages = _character_messages(data, para_text, known_characters_for_prompt)
 
         try:
+            model = model_router.model_for("collect_characters")
             completion = client.beta.chat.completions.parse(
-                model="gpt-4.1",
-                messages=[{"role": "user", "content": prompt}],
+                model=model,
+                messages=messages,
                 response_format=CharactersInParagraph
             )
+            prompts.record_usage("collect_characters", model, completion)
             response_obj = completion.choices[0].message.parsed
         except Exception as e:
             print(f"❌ Ошибка OpenAI на абзаце {idx}: {e}")
@@ -114,6 +127,7 @@ def step_find_characters_and_appearance(book_id, data, paragraphs_with_id, supab
                     "name": names_json
                 }).execute()
                 char_id = insert_result.data[0]["id"]
+                characters_writer.remember(insert_result.data)
                 summary = CharacterAppearanceSummary(
                     appearances=[AppearanceItem(
                         paragraph=paragraph_num, appearance=appearance)]
@@ -128,14 +142,13 @@ def step_find_characters_and_appearance(book_id, data, paragraphs_with_id, supab
                     prev_names = character_names_by_id[char_id]
                     if set(names.additional_names) != set(prev_names.additional_names) or names.main != prev_names.main:
                         character_names_by_id[char_id] = names
-                        supabase.table("books_characters").update({
-                            "name": names_json
-                        }).eq("id", char_id).execute()
+                        characters_writer.update(char_id, {"name": names_json})
                     summary.appearances.append(AppearanceItem(
                         paragraph=paragraph_num, appearance=appearance))
                 else:
                     char_row = supabase.table("books_characters").select(
                         "*").eq("id", char_id).single().execute().data
+                    characters_writer.remember([char_row])
                     char_names = Names.parse_raw(char_row["name"])
                     summary = CharacterAppearanceSummary(
                         appearances=[AppearanceItem(
@@ -145,25 +158,277 @@ def step_find_characters_and_appearance(book_id, data, paragraphs_with_id, supab
                     character_names_by_id[char_id] = char_names
 
             if any([appearance.basic, appearance.face, appearance.body, appearance.hair, appearance.clothes]):
-                supabase.table("characters_appearance").insert({
+                appearance_writer.insert({
                     "character_id": char_id,
                     "paragraph": paragraph_num,
                     "appearance": appearance_json
-                }).execute()
+                })
 
         print(
             f"    ✅ {len(response_obj.characters)} персонажей обработано, новых: {new_person_count}")
         processed += 1
 
+    characters_writer.flush()
+    appearance_writer.flush()
+    return processed
+
+
+def _name_keys(names: Names) -> set:
+    keys = set()
+    for name in [names.main, *names.additional_names]:
+        key = " ".join(re.sub(r"[^\w\s]", " ", name.casefold()).split())
+        if key:
+            keys.add(key)
+    return keys
+
+
+def _extract_window(data, window, client, progress):
+    """
+    Абзацы окна по порядку, со своим списком известных персонажей (локальные id с 1), без записи в базу.
+    Возвращает ([{"names": Names, "appearances": [AppearanceItem]}], число разобранных абзацев).
+    """
+    found = {}
+    processed = 0
+    for paragraph_num, para_text in window:
+        known_characters_for_prompt = [
+            {
+                "id": local_id,
+                "main": char["names"].main,
+                "additional_names": char["names"].additional_names
+            }
+            for local_id, char in found.items()
+        ]
+        messages = _character_messages(data, para_text, known_characters_for_prompt)
+
+        response_obj = None
+        for attempt in range(1, 3):
+            model = model_router.model_for("collect_characters")
+            try:
+                concurrency.openai_limiter().acquire()
+                with metrics.track_request("openai", model, "collect_characters"):
+                    completion = client.beta.chat.completions.parse(
+                        model=model,
+                        messages=messages,
+                        response_format=CharactersInParagraph
+                    )
+                prompts.record_usage("collect_characters", model, completion)
+                response_obj = completion.choices[0].message.parsed
+                break
+            except Exception as e:
+                print(f"❌ Ошибка OpenAI на абзаце {paragraph_num} (попытка {attempt}): {e}")
+                concurrency.pause_after_error(e, concurrency.openai_limiter())
+
+        percent = progress.tick()
+        if response_obj is None:
+            continue
+        for char_obj in response_obj.characters:
+            char = found.get(char_obj.id) if char_obj.id else None
+            if char is None:
+                char = found[len(found) + 1] = {"names": char_obj.names, "appearances": []}
+            else:
+                char["names"] = char_obj.names
+            char["appearances"].append(AppearanceItem(
+                paragraph=paragraph_num, appearance=char_obj.appearance))
+        processed += 1
+        print(f"    ✅ ({percent}%) Абзац {paragraph_num}: персонажей {len(response_obj.characters)}")
+    return list(found.values()), processed
+
+
+def _merge_window_characters(windows: list) -> list:
+    """
+    Склейка персонажей из разных окон: общий вариант имени (без регистра и пунктуации) — один персонаж.
+    Основное имя — то, под которым персонаж найден в большем числе абзацев, остальные — в additional_names.
+    """
+    entries = [char for window in windows for char in window]
+    parent = list(range(len(entries)))
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    owner = {}
+    for i, entry in enumerate(entries):
+        for key in _name_keys(entry["names"]):
+            if key not in owner:
+                owner[key] = i
+                continue
+            a, b = root(owner[key]), root(i)
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+
+    groups = {}
+    for i in range(len(entries)):
+        groups.setdefault(root(i), []).append(entries[i])
+
+    merged = []
+    for first in sorted(groups):
+        members = groups[first]
+        weights = {}
+        for member in members:
+            weights[member["names"].main] = weights.get(member["names"].main, 0) + len(member["appearances"])
+        # больше всего упоминаний; при равенстве — более позднее уточнение
+        main = max(reversed([member["names"].main for member in members]), key=lambda name: weights[name])
+        seen = _name_keys(Names(main=main, additional_names=[]))
+        additional = []
+        for member in members:
+            for name in [member["names"].main, *member["names"].additional_names]:
+                keys = _name_keys(Names(main=name, additional_names=[]))
+                if keys and not keys <= seen:
+                    additional.append(name)
+                    seen |= keys
+        merged.append({
+            "names": Names(main=main, additional_names=additional),
+            "appearances": sorted((item for member in members for item in member["appearances"]),
+                                  key=lambda item: item.paragraph),
+        })
+    return merged
+
+
+def _find_characters_windowed(book_id, data, paragraphs_with_id, supabase, client) -> int:
+    """
+    Окна по characters.find_window абзацев разбираются параллельно, персонажи окон склеиваются по именам,
+    books_characters и characters_appearance записываются пачками в конце.
+    """
+    window_size = max(1, int(load_config().get("characters", {}).get("find_window", 20)))
+    numbered = [(idx, para["text"]) for idx, para in enumerate(paragraphs_with_id, start=1)]
+    windows = [numbered[start:start + window_size] for start in range(0, len(numbered), window_size)]
+    workers = concurrency.workers_for("collect_characters")
+    print(f"🪟 Окна: {len(windows)} по {window_size} абзацев, потоков: {workers}")
+
+    progress = concurrency.Progress(len(numbered))
+    results = concurrency.run_ordered(
+        lambda window: _extract_window(data, window, client, progress), windows, workers, name="characters")
+    processed = sum(count for _, count in results)
+    merged = _merge_window_characters([found for found, _ in results])
+    print(f"🧩 Персонажей после склейки окон: {len(merged)} "
+          f"(до склейки: {sum(len(found) for found, _ in results)})")
+
+    characters_writer = BatchWriter(supabase, "books_characters")
+    for char in merged:
+        characters_writer.insert({"book_id": book_id, "name": char["names"].json()})
+    rows = characters_writer.flush()
+
+    appearance_writer = BatchWriter(supabase, "characters_appearance")
+    for char, row in zip(merged, rows):
+        for item in char["appearances"]:
+            appearance = item.appearance
+            if any([appearance.basic, appearance.face, appearance.body, appearance.hair, appearance.clothes]):
+                appearance_writer.insert({
+                    "character_id": row["id"],
+                    "paragraph": item.paragraph,
+                    "appearance": appearance.json()
+                })
+    appearances_written = len(appearance_writer.flush())
+    print(f"💾 Записано персонажей: {len(rows)}, описаний внешности: {appearances_written}")
+    return processed
+
+
+def _disambiguate_mention(data, paragraph_text, candidates, client) -> list[int]:
+    """
+    Кто из персонажей с общим именем упомянут в абзаце — небольшой запрос на один абзац.
+    """
+    messages = prompts.messages(
+        prompts.MENTION_DISAMBIGUATION,
+        prompts.context(**{
+            "Книга": data["title"],
+            "Автор": data["author"],
+            "Персонажи с общим именем": json.dumps(candidates, ensure_ascii=False),
+        }),
+        f"Абзац: {paragraph_text}"
+    )
+    model = model_router.model_for("collect_characters")
+    try:
+        concurrency.openai_limiter().acquire()
+        with metrics.track_request("openai", model, "collect_characters"):
+            completion = client.beta.chat.completions.parse(
+                model=model,
+                messages=messages,
+                response_format=MentionedCharacters
+            )
+        prompts.record_usage("collect_characters", model, completion)
+        return completion.choices[0].message.parsed.ids
+    except Exception as e:
+        print(f"❌ Ошибка OpenAI при уточнении упоминания: {e}")
+        return []
+
+
+def _paragraph_text(paragraph) -> str:
+    # абзац из text_by_chapters — {"paragraph_number", "paragraph_content"}
+    if isinstance(paragraph, dict):
+        return paragraph.get("paragraph_content", "")
+    return str(paragraph)
+
+
+def _first_mentions(data, paragraphs_with_id, characters, client, appearances_by_char=None) -> list:
+    """
+    Абзац первого упоминания каждого персонажа (нумерация с 1) — локально по именам и прозвищам (utils/alias_matcher.py).
+    LLM уточняет только имена, общие у нескольких персонажей; не найденные по имени — по первому описанию внешности.
+    characters: [{"id": ..., "names": {"main": ..., "additional_names": [...]}}]
+    """
+    texts = [_paragraph_text(para["text"]) for para in paragraphs_with_id]
+    names_by_id = {c["id"]: c["names"] for c in characters}
+    aliases = {c["id"]: [c["names"]["main"], *c["names"]["additional_names"]] for c in characters}
+    first, ambiguous = alias_matcher.first_mentions(aliases, texts)
+    found_by_name = len(first)
+
+    asked = 0
+    for paragraph_num, ids in ambiguous:
+        candidates = [char_id for char_id in sorted(ids) if first.get(char_id, paragraph_num + 1) > paragraph_num]
+        if not candidates:
+            continue
+        if asked >= MAX_MENTION_DISAMBIGUATIONS:
+            break
+        asked += 1
+        mentioned = _disambiguate_mention(
+            data, texts[paragraph_num - 1],
+            [{"id": char_id, "names": names_by_id[char_id]} for char_id in candidates], client)
+        for char_id in mentioned:
+            if char_id in candidates:
+                first[char_id] = paragraph_num
+
+    missing = []
+    by_appearance = 0
+    for char_id in names_by_id:
+        if char_id in first:
+            continue
+        rows = (appearances_by_char or {}).get(char_id)
+        if rows:
+            first[char_id] = min(int(row["paragraph"]) for row in rows)
+            by_appearance += 1
+        else:
+            missing.append(names_by_id[char_id]["main"])
+
+    print(f"    🔎 По именам: {found_by_name}, запросов LLM для общих имён: {asked}, "
+          f"по описанию внешности: {by_appearance}")
+    if missing:
+        print(f"    ⚠️ Не найдены в тексте: {', '.join(missing)}")
+    return [CharacterMention(id=char_id, first_paragraph=paragraph) for char_id, paragraph in first.items()]
+
+
+def step_find_characters_and_appearance(book_id, data, paragraphs_with_id, supabase, client):
+    mode = load_config().get("characters", {}).get("find_mode", "sequential")
+    if mode == "windowed":
+        processed = _find_characters_windowed(book_id, data, paragraphs_with_id, supabase, client)
+    else:
+        processed = _find_characters_sequential(book_id, data, paragraphs_with_id, supabase, client)
+
     # Анализ истории изменений внешности
     print("\n🔍 Анализ истории изменений внешности для каждого персонажа...")
     all_chars = supabase.table("books_characters").select(
         "id", "name").eq("book_id", book_id).execute().data or []
+    characters_writer = BatchWriter(supabase, "books_characters")
+    characters_writer.remember([{**c, "book_id": book_id} for c in all_chars])
+    # Вся история внешности — одним запросом на пачку персонажей, а не запросом на каждого
+    appearances_by_char = {}
+    for row in select_in(supabase, "characters_appearance", "character_id, paragraph, appearance",
+                         "character_id", [c["id"] for c in all_chars], order="paragraph"):
+        appearances_by_char.setdefault(row["character_id"], []).append(row)
     for i, char in enumerate(all_chars, 1):
         char_id = char["id"]
         names = Names.parse_raw(char["name"])
-        appearances_rows = supabase.table("characters_appearance").select(
-            "paragraph, appearance").eq("character_id", char_id).order("paragraph").execute().data or []
+        appearances_rows = appearances_by_char.get(char_id, [])
         appearances = [
             AppearanceItem(paragraph=int(
                 row["paragraph"]), appearance=Appearance.parse_raw(row["appearance"]))
@@ -189,7 +454,7 @@ def step_find_characters_and_appearance(book_id, data, paragraphs_with_id, supab
 
         try:
             completion = client.beta.chat.completions.parse(
-                model="gpt-4.1",
+                model=model_router.model_for("collect_characters"),
                 messages=[{"role": "user", "content": prompt}],
                 response_format=CharacterAppearanceSummary
             )
@@ -201,11 +466,10 @@ def step_find_characters_and_appearance(book_id, data, paragraphs_with_id, supab
 
         summary_dict = summary.model_dump()
         summary_json = json.dumps(summary_dict, indent=2, ensure_ascii=False)
-        supabase.table("books_characters").update({
-            "appearance": summary_json
-        }).eq("id", char_id).execute()
+        characters_writer.update(char_id, {"appearance": summary_json})
         print(
-            f"    🧑‍🔬 [{i}/{len(all_chars)}] Итоговое описание для '{names.main}' сохранено.")
+            f"    🧑‍🔬 [{i}/{len(all_chars)}] Итоговое описание для '{names.main}' готово.")
+    characters_writer.flush()
 
     print(
         f"\n🏁 Готово! Проанализировано {processed} абзацев и {len(all_chars)} персонажей книги '{data['title']}'.")
@@ -213,37 +477,13 @@ def step_find_characters_and_appearance(book_id, data, paragraphs_with_id, supab
     # === Определяем первый уникальный абзац появления каждого персонажа ===
     print("🔎 Определяем абзацы первого упоминания персонажей...")
 
-    # Загружаем всех персонажей с именами
-    all_chars_for_mentions = supabase.table("books_characters").select(
-        "id", "name").eq("book_id", book_id).execute().data or []
+    # Все персонажи с именами — те же строки, что и для анализа внешности
     characters_with_names = [
         {"id": c["id"], "names": Names.parse_raw(c["name"]).dict()}
-        for c in all_chars_for_mentions
+        for c in all_chars
     ]
 
-    book_text = ""
-    for idx, para in enumerate(paragraphs_with_id, start=1):
-        book_text += f"{idx}. {para['text']}\n"
-
-    mentions_prompt = (
-        f"Книга: {data['title']}\n"
-        f"Автор: {data['author']}\n"
-        f"Текст книги с номерами абзацев:\n{book_text}\n"
-        f"Список персонажей: {json.dumps(characters_with_names, ensure_ascii=False)}\n"
-        "Для каждого персонажа укажи номер абзаца, в котором он впервые появляется в тексте (как число). "
-        "Верни объект mentions — список из CharacterMention с полями id и first_paragraph."
-    )
-
-    try:
-        completion = client.beta.chat.completions.parse(
-            model="gpt-4.1",
-            messages=[{"role": "user", "content": mentions_prompt}],
-            response_format=CharacterMentions
-        )
-        mentions_obj = completion.choices[0].message.parsed
-    except Exception as e:
-        print(f"❌ Ошибка OpenAI при поиске первого упоминания: {e}")
-        return
+    mentions = _first_mentions(data, paragraphs_with_id, characters_with_names, client, appearances_by_char)
 
     print("📥 Сохраняем уникальные номера первых абзацев в таблицу books_characters...")
 
@@ -251,7 +491,7 @@ def step_find_characters_and_appearance(book_id, data, paragraphs_with_id, supab
     used_paragraphs = set()
     updates = []
     # Сортируем чтобы обработка шла в одном порядке всегда
-    mentions_sorted = sorted(mentions_obj.mentions, key=lambda x: x.id)
+    mentions_sorted = sorted(mentions, key=lambda x: x.id)
     for mention in mentions_sorted:
         first_para = mention.first_paragraph
         # Если первый параграф == 1, увеличиваем на 1
@@ -264,9 +504,8 @@ def step_find_characters_and_appearance(book_id, data, paragraphs_with_id, supab
         updates.append((mention.id, first_para))
 
     for char_id, para in updates:
-        supabase.table("books_characters").update({
-            "first_paragraph": para
-        }).eq("id", char_id).execute()
+        characters_writer.update(char_id, {"first_paragraph": para})
+    characters_writer.flush()
 
     print("✅ Уникальные первые упоминания сохранены в books_characters!")
 
@@ -289,7 +528,7 @@ def step_roles(book_id, data, paragraphs_with_id, supabase, client):
 
     try:
         completion = client.beta.chat.completions.parse(
-            model="gpt-4.1",
+            model=model_router.model_for("collect_characters"),
             messages=[{"role": "user", "content": roles_prompt}],
             response_format=CharacterRoles
         )
@@ -317,11 +556,10 @@ def step_roles(book_id, data, paragraphs_with_id, supabase, client):
     # все персонажи без целевых ролей -> роль "other"
     other_ids = all_ids - assigned_ids
 
-    # Сохраняем целевые роли
+    # Значения ролей по персонажам: если одному персонажу досталось несколько ролей, остаётся последняя
+    values_by_char = {}
     for role, char_id in roles_map.items():
         if char_id is not None:
-            exists = supabase.table("characters_roles").select("id").eq(
-                "book_id", book_id).eq("character_id", char_id).execute().data
             role_values = {
                 "hero": False,
                 "ally": False,
@@ -331,22 +569,9 @@ def step_roles(book_id, data, paragraphs_with_id, supabase, client):
                 "other": False
             }
             role_values[role] = True
-
-            if exists:
-                supabase.table("characters_roles").update(role_values).eq(
-                    "book_id", book_id).eq("character_id", char_id).execute()
-            else:
-                supabase.table("characters_roles").insert({
-                    "book_id": book_id,
-                    "character_id": char_id,
-                    **role_values
-                }).execute()
-
-    # Сохраняем "other" роль для всех остальных
+            values_by_char[char_id] = role_values
     for char_id in other_ids:
-        exists = supabase.table("characters_roles").select("id").eq(
-            "book_id", book_id).eq("character_id", char_id).execute().data
-        role_values = {
+        values_by_char[char_id] = {
             "hero": False,
             "ally": False,
             "antagonist": False,
@@ -354,15 +579,24 @@ def step_roles(book_id, data, paragraphs_with_id, supabase, client):
             "victim": False,
             "other": True
         }
-        if exists:
-            supabase.table("characters_roles").update(role_values).eq(
-                "book_id", book_id).eq("character_id", char_id).execute()
+
+    # Уже существующие строки ролей книги — одним запросом; дальше update / insert пачками
+    roles_writer = BatchWriter(supabase, "characters_roles")
+    existing_roles = supabase.table("characters_roles").select(
+        "id, book_id, character_id").eq("book_id", book_id).execute().data or []
+    roles_writer.remember(existing_roles)
+    role_ids = {row["character_id"]: row["id"] for row in existing_roles}
+    for char_id, role_values in values_by_char.items():
+        if char_id in role_ids:
+            roles_writer.update(role_ids[char_id], role_values)
         else:
-            supabase.table("characters_roles").insert({
+            roles_writer.insert({
                 "book_id": book_id,
                 "character_id": char_id,
                 **role_values
-            }).execute()
+            })
+    for row in roles_writer.flush():
+        role_ids[row["character_id"]] = row["id"]
 
     print("🔎 Определяем абзацы первого упоминания персонажей...")
 
@@ -372,29 +606,11 @@ def step_roles(book_id, data, paragraphs_with_id, supabase, client):
         for c in characters_list
     ]
 
-    book_text = ""
-    for idx, para in enumerate(paragraphs_with_id, start=1):
-        book_text += f"{idx}. {para['text']}\n"
-
-    mentions_prompt = (
-        f"Книга: {data['title']}\n"
-        f"Автор: {data['author']}\n"
-        f"Текст книги с номерами абзацев:\n{book_text}\n"
-        f"Список персонажей: {json.dumps(characters_with_roles, ensure_ascii=False)}\n"
-        "Для каждого персонажа укажи номер абзаца, в котором он впервые появляется в тексте (как число). "
-        "Верни объект mentions — список из CharacterMention с полями id и first_paragraph."
-    )
-
-    try:
-        completion = client.beta.chat.completions.parse(
-            model="gpt-4.1",
-            messages=[{"role": "user", "content": mentions_prompt}],
-            response_format=CharacterMentions
-        )
-        mentions_obj = completion.choices[0].message.parsed
-    except Exception as e:
-        print(f"❌ Ошибка OpenAI при поиске первого упоминания: {e}")
-        return
+    appearances_by_char = {}
+    for row in select_in(supabase, "characters_appearance", "character_id, paragraph",
+                         "character_id", [c["id"] for c in characters_with_roles]):
+        appearances_by_char.setdefault(row["character_id"], []).append(row)
+    mentions = _first_mentions(data, paragraphs_with_id, characters_with_roles, client, appearances_by_char)
 
     print("📥 Сохраняем уникальные номера первых абзацев в таблицу characters_roles...")
 
@@ -402,7 +618,7 @@ def step_roles(book_id, data, paragraphs_with_id, supabase, client):
     used_paragraphs = set()
     updates = []
     # Сортируем чтобы обработка шла в одном порядке всегда
-    mentions_sorted = sorted(mentions_obj.mentions, key=lambda x: x.id)
+    mentions_sorted = sorted(mentions, key=lambda x: x.id)
     for mention in mentions_sorted:
         first_para = mention.first_paragraph
         # Если первый параграф == 1, увеличиваем на 1
@@ -415,26 +631,36 @@ def step_roles(book_id, data, paragraphs_with_id, supabase, client):
         updates.append((mention.id, first_para))
 
     for char_id, para in updates:
-        supabase.table("characters_roles").update({
-            "first_paragraph": para
-        }).eq("book_id", book_id).eq("character_id", char_id).execute()
+        if char_id in role_ids:
+            roles_writer.update(role_ids[char_id], {"first_paragraph": para})
+        else:
+            supabase.table("characters_roles").update({
+                "first_paragraph": para
+            }).eq("book_id", book_id).eq("character_id", char_id).execute()
+    roles_writer.flush()
 
     print("✅ Роли и уникальные первые упоминания успешно сохранены!")
 
 
+def _next_versions(out_dir: Path) -> dict:
+    """
+    Следующая версия иллюстраций по персонажам — один проход по папке вместо glob на каждого персонажа.
+    {id персонажа: последняя версия}
+    """
+    versions = {}
+    for fname in out_dir.glob("*_p*_v*_*.webp"):
+        stem = fname.stem
+        try:
+            char_id = int(stem.split("_p")[0])
+            v = int(stem.split("_v")[1].split("_")[0])
+        except Exception:
+            continue
+        versions[char_id] = max(versions.get(char_id, 0), v)
+    return versions
+
+
 def create_resized_buffer(image_path):
-    img = Image.open(image_path)
-    w, h = img.size
-    if w >= h:
-        new_w, new_h = 512, int(h * (512 / w))
-    else:
-        new_h, new_w = 512, int(w * (512 / w))
-    img = img.resize((new_w, new_h))
-    buf = io.BytesIO()
-    img.save(buf, format="WEBP")
-    buf.seek(0)
-    img.close()
-    return ("image.webp", buf)
+    return image_cache.reference_buffer(image_path)
 
 
 def step_draw(book_id, data, paragraphs_with_id, supabase, client):
@@ -499,24 +725,18 @@ def step_draw(book_id, data, paragraphs_with_id, supabase, client):
             para_map[idx_counter] = (chapter_number, idx)
             idx_counter += 1
 
+    # Портрет = базовая эмоция (первая включённая) + варианты остальных эмоций.
+    # draw_mode: reference — варианты рисуются через images.edit по готовому базовому портрету,
+    # prompt — каждая эмоция отдельным запросом без референса
+    draw_mode = (config.get("characters", {}) or {}).get("draw_mode", "reference")
+    versions = _next_versions(out_dir)
+    portraits = []
     for char in characters:
         char_id = char["id"]
         names = char["names"]
-        first_paragraph = char.get("first_paragraph")
         print(f"\n🧑 Персонаж: {names.main}")
 
-        char_folder = out_dir
-        version = 1
-        existing_versions = []
-        for fname in char_folder.glob(f"{char_id}_p*_v*_*.webp"):
-            stem = fname.stem
-            try:
-                v = int(stem.split("_v")[1].split("_")[0])
-                existing_versions.append(v)
-            except Exception:
-                continue
-        if existing_versions:
-            version = max(existing_versions) + 1
+        version = versions.get(char_id, 0) + 1
         print(f"Версия иллюстраций: {version}")
 
         appearances = []
@@ -530,21 +750,25 @@ def step_draw(book_id, data, paragraphs_with_id, supabase, client):
             continue
 
         for para_num, appearance in appearances:
-            if para_num > 1:
+            if para_num > 1 or not emotions:
                 continue
 
-            first_emotion = True
-            for emotion_code in emotions:
-                files_for_openai = []
-
-                if first_emotion:
+            base_prompt = (
+                f"Нарисуй иллюстрацию персонажа по мотивам книги '{title}' автора {author}.\n"
+                f"Имя персонажа: {names.main}.\n"
+                f"Изображение персонажа должно соответствовать другим изображениям, если они даны.\n"
+                f"Но учитывай изменение во внешности по ходу книги (для абзаца {para_num}): {appearance}.\n"
+                f"Передай персонажа в эмоции: {emotions[0]}.\n"
+                f"Стиль должен быть таким: {style}.\n"
+                "Оставь верхнюю часть изображения пустой."
+            )
+            variants = []
+            for emotion_code in emotions[1:]:
+                if draw_mode == "reference":
                     prompt = (
-                        f"Нарисуй иллюстрацию персонажа по мотивам книги '{title}' автора {author}.\n"
-                        f"Имя персонажа: {names.main}.\n"
-                        f"Изображение персонажа должно соответствовать другим изображениям, если они даны.\n"
-                        f"Но учитывай изменение во внешности по ходу книги (для абзаца {para_num}): {appearance}.\n"
-                        f"Передай персонажа в эмоции: {emotion_code}.\n"
-                        f"Стиль должен быть таким: {style}.\n"
+                        f"Повтори персонажа с изображения в новой эмоции: {emotion_code}.\n"
+                        f"Сохрани внешность, одежду, ракурс и стиль рисунка.\n"
+                        f"Прозрачный фон.\n"
                         "Оставь верхнюю часть изображения пустой."
                     )
                 else:
@@ -553,51 +777,98 @@ def step_draw(book_id, data, paragraphs_with_id, supabase, client):
                         f"Прозрачный фон.\n"
                         "Оставь верхнюю часть изображения пустой."
                     )
+                variants.append({"char": char, "version": version, "para_num": para_num,
+                                 "emotion_code": emotion_code, "prompt": prompt})
+            portraits.append({
+                "base": {"char": char, "version": version, "para_num": para_num,
+                         "emotion_code": emotions[0], "prompt": base_prompt},
+                "variants": variants,
+            })
 
-                print(f"    ➡️ Абзац: {para_num} | Эмоция: {emotion_code}")
-                image_base64 = None
+    def draw(job, reference=None):
+        print(f"    ➡️ {job['char']['names'].main} | Абзац: {job['para_num']} | Эмоция: {job['emotion_code']}")
+        params = dict(
+            model=model,
+            prompt=job["prompt"],
+            n=1,
+            size=size,
+            user=f"book-characters:{int(datetime.now(timezone.utc).timestamp())}"
+        )
+        if reference is not None:
+            response = image_jobs.edit(client, "characters_draw", image=reference, **params)
+        else:
+            response = image_jobs.generate(client, "characters_draw", **params)
+        return response.data[0].b64_json
+
+    def save(job, image_base64):
+        if not image_base64:
+            print("❌ OpenAI не вернул base64 изображение.")
+            return None, None
+        # Сохраняем ОРИГИНАЛ в characters/book<id>
+        image_data = base64.b64decode(image_base64)
+        output_file = image_jobs.write_atomic(
+            out_dir / f"{job['char']['id']}_p{job['para_num']}_v{job['version']}_{job['emotion_code']}.webp",
+            image_data)
+        print(f"      💾 Иллюстрация сохранена: {output_file}")
+        return output_file, image_data
+
+    def export_copy(job, image_data):
+        # Базовая эмоция p1 — уменьшенная копия в ./export/characters
+        first_paragraph = job["char"].get("first_paragraph")
+        if job["para_num"] != 1 or not first_paragraph:
+            return
+        chapter_num, para_in_chap = para_map.get(first_paragraph, (None, None))
+        if chapter_num is None:
+            return
+        export_path = export_dir / f"book_{book_id}_{chapter_num}_{para_in_chap}.webp"
+        # Уменьшаем до 512x512:
+        img = Image.open(io.BytesIO(image_data))
+        img = img.convert("RGBA")  # для прозрачности
+        img = img.resize((512, 512))
+        image_jobs.write_atomic(export_path, img, format="WEBP")
+        img.close()
+        print(f"      📤 Копия для экспорта: {export_path}")
+
+    # Базовые портреты всех персонажей рисуются параллельно; варианты эмоций персонажа отправляются в пул,
+    # как только готова его база (задания отправляет этот поток, не сами задания пула)
+    pool = image_jobs.executor()
+    print(f"🎨 Портретов: {len(portraits)}, вариантов эмоций: {sum(len(p['variants']) for p in portraits)} "
+          f"(режим {draw_mode})")
+    base_futures = {pool.submit(draw, portrait["base"]): portrait for portrait in portraits}
+    variant_futures = []
+    if draw_mode != "reference":
+        variant_futures = [(variant, pool.submit(draw, variant))
+                           for portrait in portraits for variant in portrait["variants"]]
+
+    # Ошибка одного портрета (лимит, политика контента, сеть) не прерывает шаг: остальные задания уже оплачены
+    failed = 0
+    for future in as_completed(base_futures):
+        portrait = base_futures[future]
+        job = portrait["base"]
+        try:
+            base_path, image_data = save(job, future.result())
+        except Exception as e:
+            failed += 1
+            print(f"❌ Не удалось нарисовать {job['char']['names'].main} ({job['emotion_code']}): {e}")
+            if draw_mode == "reference" and portrait["variants"]:
+                print(f"   ⏭ Пропускаем эмоции без базового портрета: {len(portrait['variants'])}")
+            continue
+        if base_path is None:
+            continue
+        export_copy(job, image_data)
+        if draw_mode == "reference":
+            for variant in portrait["variants"]:
+                variant_futures.append((variant, pool.submit(draw, variant, create_resized_buffer(base_path))))
 
-                response = client.images.generate(
-                    model=model,
-                    prompt=prompt,
-                    n=1,
-                    size=size,
-                    user=f"book-characters:{int(datetime.now(timezone.utc).timestamp())}"
-                )
-                image_base64 = response.data[0].b64_json
-
-                if not image_base64:
-                    print("❌ OpenAI не вернул base64 изображение.")
-                    continue
-
-                # 1. Сохраняем ОРИГИНАЛ в characters/book<id>
-                output_file = char_folder / \
-                    f"{char_id}_p{para_num}_v{version}_{emotion_code}.webp"
-                img_bytes = io.BytesIO()
-                img_bytes.write(base64.b64decode(image_base64))
-                img_bytes.seek(0)
-                with open(output_file, "wb") as f:
-                    f.write(img_bytes.read())
-                print(f"      💾 Иллюстрация сохранена: {output_file}")
-
-                # 2. Если это первая эмоция p1 — Сохраняем уменьшенную копию в ./export/characters
-                if para_num == 1 and first_emotion and first_paragraph:
-                    chapter_num, para_in_chap = para_map.get(
-                        first_paragraph, (None, None))
-                    if chapter_num is not None:
-                        export_name = f"book_{book_id}_{chapter_num}_{para_in_chap}.webp"
-                        export_path = export_dir / export_name
-                        # Уменьшаем до 512x512:
-                        img_bytes.seek(0)
-                        img = Image.open(img_bytes)
-                        img = img.convert("RGBA")  # для прозрачности
-                        img = img.resize((512, 512))
-                        img.save(export_path, format="WEBP")
-                        img.close()
-                        print(f"      📤 Копия для экспорта: {export_path}")
-
-                first_emotion = False
+    for variant, future in variant_futures:
+        try:
+            save(variant, future.result())
+        except Exception as e:
+            failed += 1
+            print(f"❌ Не удалось нарисовать {variant['char']['names'].main} ({variant['emotion_code']}): {e}")
 
+    if failed:
+        print(f"⚠️ Не нарисовано изображений: {failed}")
     print("✅ Иллюстрации персонажей успешно сгенерированы и сохранены.")
 
 
@@ -668,6 +939,10 @@ def step_verify_character_images(book_id, data, supabase, client):
             img_bytes = f.read()
             img_b64 = base64.b64encode(img_bytes).decode()
 
+        # Явный брак (пустой вырез, кадр без деталей) отклоняем без запроса к модели
+        with Image.open(io.BytesIO(img_bytes)) as img:
+            verdict, reasons, _ = image_quality.screen(img, cutout=True)
+
         prompt = (
             f"Книга: {title}\n"
             f"Автор: {author}\n"
@@ -678,28 +953,33 @@ def step_verify_character_images(book_id, data, supabase, client):
             "Верни результат строго как объект ImageVerification: verification (целое число от 1 до 10), comment (короткий комментарий на русском, что не так)."
         )
 
-        try:
-            completion = client.beta.chat.completions.parse(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {"type": "image_url", "image_url": {
-                                "url": f"data:image/webp;base64,{img_b64}"}}
-                        ]
-                    }
-                ],
-                response_format=ImageVerification
-            )
-            verification_obj = completion.choices[0].message.parsed
-            verification_score = verification_obj.verification
-            comment = verification_obj.comment
-        except Exception as e:
-            print(f"❌ Ошибка при проверке иллюстрации для {names.main}: {e}")
-            verification_score = None
-            comment = f"Ошибка: {e}"
+        if verdict == "reject":
+            print(f"  🚫 Локальная проверка {names.main}: {', '.join(reasons)}")
+            verification_score = 1
+            comment = f"Локальная проверка: {', '.join(reasons)}"
+        else:
+            try:
+                completion = client.beta.chat.completions.parse(
+                    model="gpt-4o",
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": [
+                                {"type": "text", "text": prompt},
+                                {"type": "image_url", "image_url": {
+                                    "url": f"data:image/webp;base64,{img_b64}"}}
+                            ]
+                        }
+                    ],
+                    response_format=ImageVerification
+                )
+                verification_obj = completion.choices[0].message.parsed
+                verification_score = verification_obj.verification
+                comment = verification_obj.comment
+            except Exception as e:
+                print(f"❌ Ошибка при проверке иллюстрации для {names.main}: {e}")
+                verification_score = None
+                comment = f"Ошибка: {e}"
 
         supabase.table("books_characters").update({
             "verification": verification_score,
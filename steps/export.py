@@ -3,6 +3,7 @@ import json
 from pathlib import Path
 from utils.supabase_client import get_supabase_client
 from schemas.export_schema import LocalizedMeta
+from utils import json_stream, metrics, model_router, translation_storage
 from openai import OpenAI
 from tqdm import tqdm
 
@@ -35,7 +36,7 @@ def fetch_localized_title_and_author(title: str, author: str, year: str, target_
     )
 
     completion = client.beta.chat.completions.parse(
-        model="gpt-4.1",
+        model=model_router.model_for("localized_meta"),
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": f"title: {title}\nauthor: {author}\nyear: {year}"}
@@ -46,10 +47,8 @@ def fetch_localized_title_and_author(title: str, author: str, year: str, target_
     return completion.choices[0].message.parsed
 
 
-def extract_task(task_data, chapter_number, para_number, field):
-    chapter = next((c for c in (task_data or {}).get(
-        "chapters", []) if c["chapter_number"] == chapter_number), {})
-    paragraph = next((p for p in chapter.get("paragraphs", [])
+def extract_task(task_chapter, para_number, field):
+    paragraph = next((p for p in (task_chapter or {}).get("paragraphs", [])
                      if p["paragraph_number"] == para_number), {})
     return paragraph.get(field)
 
@@ -119,7 +118,7 @@ def export_book_json(book_id_start: int, book_id_end: int, source_lang: str, tar
                 print(f"   ⏭ Язык {target_lang} — перевода нет.")
                 continue
 
-            data = trans_response.data
+            data = translation_storage.resolve(supabase, book_id, target_lang, trans_response.data)
             localized_title = data.get("title", "")
             localized_author = data.get("author", "")
 
@@ -131,46 +130,47 @@ def export_book_json(book_id_start: int, book_id_end: int, source_lang: str, tar
             except Exception:
                 chapter_titles_translated = None
 
-            original_text = json.loads(data["text_by_chapters_sentence_translation_words"]) if data.get(
-                "text_by_chapters_sentence_translation_words") else None
-            simplified_text = json.loads(data["text_by_chapters_simplified_sentence_translation_words"]) if data.get(
-                "text_by_chapters_simplified_sentence_translation_words") else None
+            # Поля книги разбираются по главам (utils/json_stream): в памяти одна глава, а не граф всей книги
+            original_text = data.get("text_by_chapters_sentence_translation_words")
+            simplified_text = json_stream.ChapterCursor(
+                data.get("text_by_chapters_simplified_sentence_translation_words"))
 
-            tasks_true_or_false = json.loads(data["tasks_true_or_false"]) if data.get(
-                "tasks_true_or_false") else None
-            tasks_true_or_false_s = json.loads(data["tasks_true_or_false_simplified"]) if data.get(
-                "tasks_true_or_false_simplified") else None
+            tasks_true_or_false = json_stream.ChapterCursor(data.get("tasks_true_or_false"))
+            tasks_true_or_false_s = json_stream.ChapterCursor(data.get("tasks_true_or_false_simplified"))
 
-            tasks_how_to_translate = json.loads(data["tasks_truefalse_howto"]) if data.get(
-                "tasks_truefalse_howto") else None
-            tasks_how_to_translate_s = json.loads(data["tasks_truefalse_howto_simplified"]) if data.get(
-                "tasks_truefalse_howto_simplified") else None
+            tasks_how_to_translate = json_stream.ChapterCursor(data.get("tasks_truefalse_howto"))
+            tasks_how_to_translate_s = json_stream.ChapterCursor(data.get("tasks_truefalse_howto_simplified"))
 
-            tasks_two_words = json.loads(data["tasks_truefalse_howto_words"]) if data.get(
-                "tasks_truefalse_howto_words") else None
-            tasks_two_words_s = json.loads(data["tasks_truefalse_howto_words_simplified"]) if data.get(
-                "tasks_truefalse_howto_words_simplified") else None
+            tasks_two_words = json_stream.ChapterCursor(data.get("tasks_truefalse_howto_words"))
+            tasks_two_words_s = json_stream.ChapterCursor(data.get("tasks_truefalse_howto_words_simplified"))
 
-            if not original_text:
+            if original_text:
+                original_chapters = json_stream.iter_chapters(original_text)
+            else:
                 print(f"   ⚠️ Нет основного текста — создаём заглушку.")
-                original_text = {
-                    "chapters": [{
-                        "chapter_number": 1,
-                        "paragraphs": [{
-                            "paragraph_number": 1,
-                            "sentences": []
-                        }]
+                original_chapters = [{
+                    "chapter_number": 1,
+                    "paragraphs": [{
+                        "paragraph_number": 1,
+                        "sentences": []
                     }]
-                }
+                }]
 
-            # --------- Вычисляем длины глав -----------
-            chapters_len = [len(ch["paragraphs"])
-                            for ch in original_text["chapters"]]
+            # --------- Длины глав считаем по ходу обхода -----------
+            chapters_len = []
 
-            for orig_ch in original_text["chapters"]:
+            for orig_ch in original_chapters:
                 chapter_number = orig_ch["chapter_number"]
-                simp_ch = next((c for c in (simplified_text or {}).get(
-                    "chapters", []) if c["chapter_number"] == chapter_number), {})
+                chapters_len.append(len(orig_ch["paragraphs"]))
+                simp_ch = simplified_text.get(chapter_number)
+                task_chapters = {
+                    "true_or_false": tasks_true_or_false.get(chapter_number),
+                    "true_or_false_s": tasks_true_or_false_s.get(chapter_number),
+                    "how_to_translate": tasks_how_to_translate.get(chapter_number),
+                    "how_to_translate_s": tasks_how_to_translate_s.get(chapter_number),
+                    "two_words": tasks_two_words.get(chapter_number),
+                    "two_words_s": tasks_two_words_s.get(chapter_number),
+                }
 
                 # --- Ищем title для главы ---
                 translated_title = None
@@ -208,14 +208,14 @@ def export_book_json(book_id_start: int, book_id_end: int, source_lang: str, tar
                         "sentences_original": orig_p.get("sentences", []),
                         "sentences_simplified": simp_p.get("sentences", []),
                         "tasks_original": {
-                            "true_or_false": extract_task(tasks_true_or_false, chapter_number, para_num, "true_or_false"),
-                            "how_to_translate": extract_task(tasks_how_to_translate, chapter_number, para_num, "how_to_translate"),
-                            "two_words": extract_task(tasks_two_words, chapter_number, para_num, "two_words")
+                            "true_or_false": extract_task(task_chapters["true_or_false"], para_num, "true_or_false"),
+                            "how_to_translate": extract_task(task_chapters["how_to_translate"], para_num, "how_to_translate"),
+                            "two_words": extract_task(task_chapters["two_words"], para_num, "two_words")
                         },
                         "tasks_simplified": {
-                            "true_or_false": extract_task(tasks_true_or_false_s, chapter_number, para_num, "true_or_false"),
-                            "how_to_translate": extract_task(tasks_how_to_translate_s, chapter_number, para_num, "how_to_translate"),
-                            "two_words": extract_task(tasks_two_words_s, chapter_number, para_num, "two_words")
+                            "true_or_false": extract_task(task_chapters["true_or_false_s"], para_num, "true_or_false"),
+                            "how_to_translate": extract_task(task_chapters["how_to_translate_s"], para_num, "how_to_translate"),
+                            "two_words": extract_task(task_chapters["two_words_s"], para_num, "two_words")
                         }
                     })
 
@@ -232,8 +232,9 @@ def export_book_json(book_id_start: int, book_id_end: int, source_lang: str, tar
                     json.dump(chapter_data, f, ensure_ascii=False, indent=2)
                 print(f"✅ Сохранена глава: {chapter_path.name}")
 
-            paragraphs_total = sum(len(ch["paragraphs"])
-                                   for ch in original_text["chapters"])
+            paragraphs_total = sum(chapters_len)
+            metrics.inc("paragraphs_processed_total", paragraphs_total,
+                        step="export", lang=target_lang)
 
             # -------- books_info: embedding книги УБРАН ---------
             books_info.append({
@@ -246,7 +247,7 @@ def export_book_json(book_id_start: int, book_id_end: int, source_lang: str, tar
                 "set": book_set,
                 "source_lang": source_lang,
                 "target_lang": target_lang,
-                "chapters": len(original_text["chapters"]),
+                "chapters": len(chapters_len),
                 "paragraphs": paragraphs_total,
                 "chapters_len": chapters_len
                 # Больше нет "embedding"!
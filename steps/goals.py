@@ -5,9 +5,10 @@ import random
 from openai import OpenAI
 from schemas.chapter_goals import WordGroups
 from utils.supabase_client import get_supabase_client
+from utils import json_stream, model_router, vocabulary_store
 
 
-def generate_chapter_goals(book_id: int, source_field: str, result_field: str, target_lang: str):
+def generate_chapter_goals(book_id: int, source_field: str, result_field: str, target_lang: str, source_lang: str):
     supabase = get_supabase_client()
     client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
@@ -20,17 +21,26 @@ def generate_chapter_goals(book_id: int, source_field: str, result_field: str, t
         print("❌ Нет текста для анализа.")
         return
 
-    data = json.loads(text_data)
-    chapters = data["chapters"]
+    # главы разбираются по одной: граф всей книги в памяти не нужен
+    chapters = json_stream.iter_chapters(text_data)
     result = {"chapters": []}
 
+    # Служебные слова (самые частые леммы словаря корпуса этого языка и поля) в тематические группы не попадают
+    common = vocabulary_store.common_lemmas(source_lang, source_field)
+
     for chapter in chapters:
         print(f"\n📘 Глава {chapter['chapter_number']}")
         word_list = []
+        seen_lemmas = set()
 
         for paragraph in chapter["paragraphs"]:
             for sentence in paragraph["sentences"]:
                 for word_idx, word in enumerate(sentence.get("words", [])):
+                    # одна лемма — одно слово в списке: в лимит промпта помещается больше разных слов
+                    lemma = vocabulary_store.lemma_key(word)
+                    if lemma in common or lemma in seen_lemmas:
+                        continue
+                    seen_lemmas.add(lemma)
                     word_id = f"{chapter['chapter_number']}_{paragraph['paragraph_number']}_{sentence['sentence_number']}_{word_idx + 1}"
                     word_list.append({
                         "id": word_id,
@@ -67,7 +77,7 @@ def generate_chapter_goals(book_id: int, source_field: str, result_field: str, t
 
         try:
             completion = client.beta.chat.completions.parse(
-                model="gpt-4.1",
+                model=model_router.model_for("chapter_goals"),
                 messages=[
                     {"role": "system", "content": system_prompt_1},
                     {"role": "user", "content": input_json[:3000]}
@@ -92,7 +102,7 @@ def generate_chapter_goals(book_id: int, source_field: str, result_field: str, t
             )
 
             completion = client.beta.chat.completions.parse(
-                model="gpt-4.1",
+                model=model_router.model_for("chapter_goals"),
                 messages=[
                     {"role": "system", "content": system_prompt_2},
                     {"role": "user", "content": "Словарь слов:\n" +
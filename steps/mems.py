@@ -1,11 +1,10 @@
 import os
-import io
 import json
 from pathlib import Path
-from PIL import Image
 from datetime import datetime, timezone
 from openai import OpenAI
 from utils.supabase_client import get_supabase_client
+from utils import model_router, image_cache
 from schemas.mems import MemeIdea
 
 
@@ -73,7 +72,7 @@ def generate_memes_for_book(book_id: int, source_lang: str = "en"):
 
         try:
             completion = client.beta.chat.completions.parse(
-                model="gpt-4.1",
+                model=model_router.model_for("generate_mems"),
                 messages=[
                     # поменять промт
                     {"role": "system", "content": system_prompt_comix},
@@ -107,23 +106,11 @@ def generate_meme_image(book_id: int, chapter_id: int, paragraph_id: int, prompt
     client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
     input_folder = Path(f"export/pictures/book_{book_id}")
-    image_files = list(input_folder.glob("*.webp"))
 
     image_files = []
-    for img_path in input_folder.glob("*.webp"):
+    for img_path in sorted(input_folder.glob("*.webp")):
         try:
-            img = Image.open(img_path)
-            w, h = img.size
-            if w >= h:
-                new_w, new_h = 512, int(h * (512 / w))
-            else:
-                new_h, new_w = 512, int(w * (512 / h))
-            img = img.resize((new_w, new_h))
-            buf = io.BytesIO()
-            img.save(buf, format="WEBP")
-            buf.seek(0)
-            image_files.append(("image.webp", buf))
-            img.close()
+            image_files.append(image_cache.reference_buffer(img_path))
         except Exception:
             continue
 
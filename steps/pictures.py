@@ -5,9 +5,9 @@ import yaml
 from pathlib import Path
 from openai import OpenAI
 from utils.supabase_client import get_supabase_client
+from utils import model_router, image_jobs, image_postprocess, image_quality
 from schemas.pictures import BookObject, BookObjectsResponse
 from PIL import Image
-import numpy as np
 import io
 
 
@@ -17,20 +17,8 @@ def load_config(config_path: str = "config.yaml") -> dict:
 
 
 def enhance_highlights_and_shadows(image_bytes):
-    # Открыть изображение из байтов
-    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-    arr = np.array(image).astype(np.float32) / 255.0
-
-    # Крутая S-кривая: экстремальный контраст
-    def contrast_boost(x):
-        return np.clip((x - 0.5) * 4 + 0.5, 0, 1)
-    arr_boosted = contrast_boost(arr)
-    arr_boosted = (arr_boosted * 255).astype(np.uint8)
-    result_image = Image.fromarray(arr_boosted, mode="RGB")
-    # Ресайз до 512x512
-    result_image = result_image.resize((512, 512), Image.LANCZOS)
-
-    return result_image
+    # Крутая S-кривая (экстремальный контраст) и ресайз до 512x512 — в пуле постобработки
+    return image_postprocess.submit(image_postprocess.enhance_contrast, image_bytes).result()
 
 
 def get_image_score_via_openai(client, eval_prompt, pil_image):
@@ -60,6 +48,19 @@ def get_image_score_via_openai(client, eval_prompt, pil_image):
     return score
 
 
+def score_image(client, eval_prompt, pil_image):
+    # Явный брак отклоняется локально (оценка 1), уверенно хорошее — при image_quality.trust_local_pass (оценка 7),
+    # остальное оценивает vision-модель
+    verdict, reasons, _ = image_quality.screen(pil_image)
+    if verdict == "reject":
+        print(f"   🚫 Локальная проверка: {', '.join(reasons)}")
+        return 1
+    if verdict == "pass":
+        print("   ✅ Локальная проверка: метрики в норме, без оценки OpenAI")
+        return 7
+    return get_image_score_via_openai(client, eval_prompt, pil_image)
+
+
 def generate_object_pictures_for_book(
     book_id: int,
     config_path: str = "config.yaml"
@@ -137,7 +138,7 @@ def generate_object_pictures_for_book(
 
     try:
         completion = client.beta.chat.completions.parse(
-            model="gpt-4.1",
+            model=model_router.model_for("generate_pictures"),
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": book_text[:100000]}
@@ -158,103 +159,93 @@ def generate_object_pictures_for_book(
     output_dir.mkdir(parents=True, exist_ok=True)
     print(f"📂 Папка для экспорта: {output_dir.resolve()}")
 
-    # 5. Генерация изображений для каждого объекта (черный и белый фон)
-    total_tasks = len(object_list) * 2
-    task_count = 0
+    # 5. Генерация изображений для каждого объекта (черный и белый фон) — параллельно в общем пуле
+    jobs = [(obj, bg) for obj in object_list for bg in ["b", "w"]]  # b=black, w=white
+    total_tasks = len(jobs)
     print(f"🎨 Генерация {total_tasks} изображений ...")
-    for obj_idx, obj in enumerate(object_list, 1):
-        for bg in ["b", "w"]:  # b=black, w=white
-            task_count += 1
-            prompt_bg = config["styles"]["prompt_black_bg"] if bg == "b" else config["styles"]["prompt_white_bg"]
-
-            prompt = (
-                f"Style: {prompt_bg}\n"
-                f"Object: {obj.object_description}. Draw only it.\n"
-                f"Book: '{title}', author: {author}. Use it to draw according to the genre and period of time.\n"
-                f"Focus on the main object and leave background clean. "
-            )
-            bg_label = "чёрный" if bg == "b" else "белый"
-            print(
-                f"[{task_count}/{total_tasks}] 🖼️ Генерация: [{obj.paragraph_id}] '{obj.object_description}', фон: {bg_label}")
-
-            try:
-                # === Первая генерация изображения ===
-                response = client.images.generate(
-                    model="gpt-image-1",
-                    prompt=prompt,
-                    n=1,
-                    size="1024x1024"
-                )
-                image_base64_1 = response.data[0].b64_json
-                if not image_base64_1:
-                    print(
-                        f"   ❌ Нет base64 для [{obj.paragraph_id}] ({bg_label})")
-                    continue
-
-                # --- Обработка контрастности и resize ---
-                image_bytes_1 = base64.b64decode(image_base64_1)
-                enhanced_image_1 = enhance_highlights_and_shadows(
-                    image_bytes_1)
-
-                # --- Оценка изображения OpenAI ---
-                print(
-                    "   📝 Оцениваем соответствие изображения описанию через OpenAI ...")
-                eval_prompt = (
-                    f"Оцени по 10-балльной шкале, насколько это изображение естественно, не содержит ошибок, соответствует текстовому описанию предмета.\n"
-                    f"Описание предмета: {obj.object_description}\n"
-                    f"Пожалуйста, верни только целое число от 1 до 10 без пояснений."
-                )
-                score_1 = get_image_score_via_openai(
-                    client, eval_prompt, enhanced_image_1)
-                print(f"   🔎 Оценка OpenAI: {score_1}/10")
 
-                # Если оценка >=7 — сразу сохраняем
-                if score_1 >= 7:
-                    file_path = output_dir / f"{obj.paragraph_id}_{bg}.webp"
-                    enhanced_image_1.save(file_path, format="WEBP")
-                    print(
-                        f"   ✅ Сохранено: {file_path.name} (оценка {score_1}/10)")
-                    continue
+    def draw(job):
+        obj, bg = job
+        prompt_bg = config["styles"]["prompt_black_bg"] if bg == "b" else config["styles"]["prompt_white_bg"]
 
-                # === Повторная генерация изображения ===
-                print("   ↩️ Оценка ниже 7, повторяем генерацию ...")
-                response2 = client.images.generate(
-                    model="gpt-image-1",
-                    prompt=prompt,
-                    n=1,
-                    size="1024x1024"
-                )
-                image_base64_2 = response2.data[0].b64_json
-                if not image_base64_2:
-                    print(
-                        f"   ❌ Нет base64 (2) для [{obj.paragraph_id}] ({bg_label})")
-                    file_path = output_dir / f"{obj.paragraph_id}_{bg}.webp"
-                    enhanced_image_1.save(file_path, format="WEBP")
-                    print(
-                        f"   ✅ Сохранено (первое изображение): {file_path.name}")
-                    continue
-
-                image_bytes_2 = base64.b64decode(image_base64_2)
-                enhanced_image_2 = enhance_highlights_and_shadows(
-                    image_bytes_2)
-                score_2 = get_image_score_via_openai(
-                    client, eval_prompt, enhanced_image_2)
-                print(f"   🔎 Оценка OpenAI (2): {score_2}/10")
-
-                # Выбираем лучшее изображение
-                if score_2 > score_1:
-                    file_path = output_dir / f"{obj.paragraph_id}_{bg}.webp"
-                    enhanced_image_2.save(file_path, format="WEBP")
-                    print(
-                        f"   ✅ Сохранено: {file_path.name} (оценка {score_2}/10)")
-                else:
-                    file_path = output_dir / f"{obj.paragraph_id}_{bg}.webp"
-                    enhanced_image_1.save(file_path, format="WEBP")
-                    print(
-                        f"   ✅ Сохранено (первое изображение): {file_path.name} (оценка {score_1}/10)")
-
-            except Exception as e:
-                print(
-                    f"   ❌ Ошибка генерации для [{obj.paragraph_id}] ({bg_label}): {e}")
+        prompt = (
+            f"Style: {prompt_bg}\n"
+            f"Object: {obj.object_description}. Draw only it.\n"
+            f"Book: '{title}', author: {author}. Use it to draw according to the genre and period of time.\n"
+            f"Focus on the main object and leave background clean. "
+        )
+        bg_label = "чёрный" if bg == "b" else "белый"
+        print(f"🖼️ Генерация: [{obj.paragraph_id}] '{obj.object_description}', фон: {bg_label}")
+
+        try:
+            # === Первая генерация изображения ===
+            response = image_jobs.generate(
+                client, "generate_pictures",
+                model="gpt-image-1",
+                prompt=prompt,
+                n=1,
+                size="1024x1024"
+            )
+            image_base64_1 = response.data[0].b64_json
+            if not image_base64_1:
+                print(f"   ❌ Нет base64 для [{obj.paragraph_id}] ({bg_label})")
+                return None
+
+            # --- Обработка контрастности и resize ---
+            image_bytes_1 = base64.b64decode(image_base64_1)
+            enhanced_image_1 = enhance_highlights_and_shadows(image_bytes_1)
+
+            # --- Оценка изображения OpenAI ---
+            eval_prompt = (
+                f"Оцени по 10-балльной шкале, насколько это изображение естественно, не содержит ошибок, соответствует текстовому описанию предмета.\n"
+                f"Описание предмета: {obj.object_description}\n"
+                f"Пожалуйста, верни только целое число от 1 до 10 без пояснений."
+            )
+            score_1 = score_image(client, eval_prompt, enhanced_image_1)
+            print(f"   🔎 [{obj.paragraph_id}] ({bg_label}) Оценка: {score_1}/10")
+
+            # Если оценка >=7 — берём сразу
+            if score_1 >= 7:
+                return enhanced_image_1, score_1, ""
+
+            # === Повторная генерация изображения ===
+            print(f"   ↩️ [{obj.paragraph_id}] ({bg_label}) Оценка ниже 7, повторяем генерацию ...")
+            response2 = image_jobs.generate(
+                client, "generate_pictures",
+                model="gpt-image-1",
+                prompt=prompt,
+                n=1,
+                size="1024x1024"
+            )
+            image_base64_2 = response2.data[0].b64_json
+            if not image_base64_2:
+                print(f"   ❌ Нет base64 (2) для [{obj.paragraph_id}] ({bg_label})")
+                return enhanced_image_1, score_1, " (первое изображение)"
+
+            image_bytes_2 = base64.b64decode(image_base64_2)
+            enhanced_image_2 = enhance_highlights_and_shadows(image_bytes_2)
+            score_2 = score_image(client, eval_prompt, enhanced_image_2)
+            print(f"   🔎 [{obj.paragraph_id}] ({bg_label}) Оценка (2): {score_2}/10")
+
+            # Выбираем лучшее изображение
+            if score_2 > score_1:
+                return enhanced_image_2, score_2, ""
+            return enhanced_image_1, score_1, " (первое изображение)"
+
+        except Exception as e:
+            print(f"   ❌ Ошибка генерации для [{obj.paragraph_id}] ({bg_label}): {e}")
+            return None
+
+    # Файлы пишутся в порядке объектов, по мере готовности
+    task_count = 0
+    saved_count = 0
+    for (obj, bg), result in zip(jobs, image_jobs.run_ordered(draw, jobs)):
+        task_count += 1
+        if result is None:
+            continue
+        image, score, note = result
+        file_path = image_jobs.write_atomic(output_dir / f"{obj.paragraph_id}_{bg}.webp", image)
+        saved_count += 1
+        print(f"[{task_count}/{total_tasks}] ✅ Сохранено{note}: {file_path.name} (оценка {score}/10)")
 
-    print(f"🏁 Готово! Сгенерировано {task_count} файлов для книги '{title}'.")
+    print(f"🏁 Готово! Сгенерировано {saved_count} файлов для книги '{title}'.")
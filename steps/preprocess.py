@@ -3,8 +3,10 @@ import re
 import time
 import json
 import spacy
+import hashlib
 from typing import Optional
 from openai import OpenAI, OpenAIError, APIConnectionError, RateLimitError, AuthenticationError
+from utils import metrics, model_router, translation_memory, translation_storage, prompts
 from utils.sentence_splitter import split_old_into_sentences
 from steps.export import fetch_localized_title_and_author
 from schemas.translation_schema import (
@@ -14,11 +16,14 @@ from schemas.translation_schema import (
     ChapterStructureWithSentences,
     WordItem,
     ParagraphWordAnalysis,
+    ParagraphSegmentation,
+    ParagraphWordTranslations,
     SentenceOriginal,
     ChapterParagraphSentenceOriginal,
     ChapterParagraphSentenceTranslated,
     ChapterItemWithTranslatedSentences,
     ChapterStructureTranslatedSentences,
+    SentenceTranslated,
 )
 from schemas.chapter_schema import ChapterStructure
 from schemas.paragraph_split import ParagraphParts
@@ -39,7 +44,7 @@ def format_text_with_openai(text, lang="en", max_chars=4000) -> str:
     try:
         print("⏳ Отправка запроса в OpenAI...")
         response = client.chat.completions.create(
-            model="gpt-4.1",
+            model=model_router.model_for("preprocess"),
             messages=[
                 {"role": "system", "content": system_prompt},
                 # <--- Используем лимит из конфига
@@ -97,7 +102,7 @@ def split_paragraphs_with_openai(text, lang="en", max_chars=4000) -> str:
     try:
         print("⏳ Отправка текста на разбивку в OpenAI...")
         response = client.chat.completions.create(
-            model="gpt-4.1",
+            model=model_router.model_for("paragraph_split"),
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": text[:max_chars]}
@@ -175,7 +180,7 @@ def group_into_chapters(book_id: int, lang: str, max_chars: int):
         print("⏳ Отправка текста в GPT для структурированной разбивки на главы...")
 
         completion = client.beta.chat.completions.parse(
-            model="gpt-4.1",
+            model=model_router.model_for("chapter_split"),
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": text[:max_chars]}
@@ -269,6 +274,7 @@ def simplify_text_for_beginners(book_id: int, lang: str, max_chars: int):
 
         chapter_attempts = 0
         success = False
+        level = 0
 
         while chapter_attempts < 3 and not success:
             chapter_attempts += 1
@@ -278,7 +284,7 @@ def simplify_text_for_beginners(book_id: int, lang: str, max_chars: int):
                 chapter_json = chapter.model_dump_json(indent=2)
 
                 completion = client.beta.chat.completions.parse(
-                    model="gpt-4.1",
+                    model=model_router.model_for("simplify_text", level),
                     messages=[
                         {"role": "system", "content": system_prompt},
                         {"role": "user", "content": chapter_json[:max_chars]}
@@ -294,6 +300,7 @@ def simplify_text_for_beginners(book_id: int, lang: str, max_chars: int):
                 if simplified_count != original_count:
                     print(
                         f"  ⚠️ Ошибка: ожидалось {original_count} абзацев, получено {simplified_count}")
+                    level = model_router.escalate("simplify_text", level)
                 else:
                     print(f"  ✅ Успешно. Абзацев: {simplified_count}")
                     simplified_chapters.append(simplified)
@@ -301,6 +308,8 @@ def simplify_text_for_beginners(book_id: int, lang: str, max_chars: int):
 
             except Exception as e:
                 print(f"  ❌ Ошибка GPT: {e}")
+                if model_router.is_validation_error(e):
+                    level = model_router.escalate("simplify_text", level)
 
         if not success:
             print(
@@ -316,6 +325,84 @@ def simplify_text_for_beginners(book_id: int, lang: str, max_chars: int):
     print("\n✅ Все главы адаптированы и сохранены.")
 
 
+def paragraph_from_memory(memory, para_struct_original: ChapterParagraphSentenceOriginal):
+    """
+    Перевод абзаца из памяти переводов, если там есть все его предложения; иначе None.
+    """
+    if memory is None:
+        return None
+    # попадания засчитываются, только если из памяти взят весь абзац
+    found = []
+    for sentence in para_struct_original.sentences:
+        match = memory.find(sentence.sentence_original)
+        if match is None:
+            memory.record_misses(len(para_struct_original.sentences))
+            return None
+        found.append(match)
+    memory.record_hits("sentence", found)
+    sentences = [
+        SentenceTranslated(
+            sentence_number=sentence.sentence_number,
+            sentence_original=sentence.sentence_original,
+            sentence_translation=match[0]
+        )
+        for sentence, match in zip(para_struct_original.sentences, found)
+    ]
+    return ChapterParagraphSentenceTranslated(
+        paragraph_number=para_struct_original.paragraph_number, sentences=sentences)
+
+
+def words_from_memory(memory, paragraph) -> bool:
+    """
+    Разбор слов абзаца из памяти: только точные совпадения оригинала и с тем же переводом предложения
+    (o_t переводятся в контексте перевода).
+    """
+    if memory is None:
+        return False
+    found = []
+    matches = []
+    for sentence in paragraph.sentences:
+        match = memory.find(sentence.sentence_original, kind="words", fuzzy=False)
+        remembered = json.loads(match[0]) if match is not None else None
+        if remembered is None or remembered["translation"] != sentence.sentence_translation:
+            memory.record_misses(len(paragraph.sentences))
+            return False
+        matches.append(match)
+        found.append([WordItem(**word) for word in remembered["words"]])
+    memory.record_hits("words", matches)
+    for sentence, words in zip(paragraph.sentences, found):
+        sentence.words = words
+    return True
+
+
+def remember_words(memory, paragraph):
+    if memory is None:
+        return
+    for sentence in paragraph.sentences:
+        memory.store(sentence.sentence_original, json.dumps({
+            "translation": sentence.sentence_translation,
+            "words": [word.model_dump() for word in sentence.words]
+        }, ensure_ascii=False), kind="words")
+
+
+def words_from_saved(saved: dict, chapter_number: int, paragraph) -> bool:
+    """
+    Разбор слов абзаца, уже записанный в books_translations_paragraphs прошлым (прерванным) запуском.
+    Берётся, только если предложения и их переводы не изменились.
+    """
+    stored = saved.get((chapter_number, paragraph.paragraph_number))
+    if not stored or len(stored.get("sentences", [])) != len(paragraph.sentences):
+        return False
+    for sentence, stored_sentence in zip(paragraph.sentences, stored["sentences"]):
+        if (stored_sentence.get("sentence_original") != sentence.sentence_original
+                or stored_sentence.get("sentence_translation") != sentence.sentence_translation
+                or not stored_sentence.get("words")):
+            return False
+    for sentence, stored_sentence in zip(paragraph.sentences, stored["sentences"]):
+        sentence.words = [WordItem(**word) for word in stored_sentence["words"]]
+    return True
+
+
 def translate_text_structure(
     book_id: int,
     source_field: str,
@@ -365,140 +452,174 @@ def translate_text_structure(
             print(f"❌ Глава {chapter_number} не найдена.")
             return
 
-    for chapter in chapters_to_process:
-        print(f"\n📚 Глава {chapter.chapter_number}")
-        translated_paragraphs = []
-
-        for paragraph in chapter.paragraphs:
-            print(f"  ✂️ Абзац {paragraph.paragraph_number}")
-
-            raw_sentences = split_old_into_sentences(
-                paragraph.paragraph_content, source_lang, spacy_nlp)
-            para_struct_original = ChapterParagraphSentenceOriginal(
-                paragraph_number=paragraph.paragraph_number,
-                sentences=[
-                    SentenceOriginal(
-                        sentence_number=i + 1,
-                        sentence_original=s.strip()
-                    )
-                    for i, s in enumerate(raw_sentences)
-                ]
-            )
-            paragraphs_sentences_flat.append(para_struct_original)
-
-            # Формируем system prompt с контекстом
-            context_prefix = (
-                f"Ты переводчик. Работаешь с книгой '{title}' автора {author}.\n"
-                f"Язык оригинала: {source_lang}. Целевой язык: {target_lang}.\n"
-                "Переведи каждое предложение в текущем абзаце.\n"
-                "Перевод должен быть легким и естественным.\n"
-                "Сохрани JSON-структуру, добавив 'sentence_translation' рядом с 'sentence_original'.\n"
-                "Не удаляй и не объединяй предложения.\n"
-            )
-
-            # Добавим до 2 предыдущих абзацев, если их общая длина < 300 символов
-            # максимум 2 последних
-            context_paragraphs = previous_paragraphs[-2:]
-            context_joined = "\n".join(context_paragraphs).strip()
-
-            if context_joined and len(context_joined) <= 300:
-                context_prefix += f"\nПредыдущий текст для контекста (НЕ переводить):\n{context_joined}\n"
-            elif previous_paragraphs:
-                context_prefix += f"\nПредыдущий текст для контекста (НЕ переводить):\n{previous_paragraphs[-1]}\n"
-
-            system_prompt_translate = context_prefix
-
-            # Перевод
-            attempt = 0
-            success = False
-
-            while attempt < 3 and not success:
-                attempt += 1
-                try:
-                    print(f"    🌍 Перевод (попытка {attempt})...")
-                    completion = client.beta.chat.completions.parse(
-                        model="gpt-4.1",
-                        messages=[
-                            {"role": "system", "content": system_prompt_translate},
-                            {"role": "user", "content": para_struct_original.model_dump_json(indent=2)[
-                                :max_chars]}
-                        ],
-                        response_format=ChapterParagraphSentenceTranslated
-                    )
-                    translated_para = completion.choices[0].message.parsed
-
-                    if len(translated_para.sentences) != len(para_struct_original.sentences):
-                        print(
-                            f"    ⚠️ Несовпадение: {len(para_struct_original.sentences)} → {len(translated_para.sentences)}")
-                    else:
-                        translated_paragraphs.append(translated_para)
-                        translated_count += 1
-                        percent = round(
-                            (translated_count / total_paragraphs) * 100)
-                        print(
-                            f"    ✅ Успешно. 📊 Прогресс: {translated_count}/{total_paragraphs} ({percent}%)")
-                        success = True
-
-                except Exception as e:
-                    print(f"    ❌ Ошибка GPT: {e}")
-                    time.sleep(2)
-
-            if not success:
-                print(
-                    f"⛔ Не удалось обработать абзац: книга-{book_id} глава-{chapter.chapter_number} абзац-{paragraph.paragraph_number} язык-{target_lang} источник-{source_field}. Остановка.")
-                return
-
-            previous_paragraphs.append(paragraph.paragraph_content.strip())
-
-        chapters_result.append(ChapterItemWithTranslatedSentences(
-            chapter_number=chapter.chapter_number,
-            paragraphs=translated_paragraphs
-        ))
-
-    # Сохраняем финальный результат
-    print(f"\n💾 Сохраняем результат в books_translations для {target_lang}...")
-
-    full_structure = ChapterStructureTranslatedSentences(
-        chapters=chapters_result)
-    json_translated = full_structure.model_dump_json(indent=2)
-
-    # 🌍 Получение локализованного названия и автора
+    step_name = f"translate:{source_field}"
+    metrics.set_gauge("queue_depth", sum(len(ch.paragraphs) for ch in chapters_to_process),
+                      step=step_name, lang=target_lang)
+    memory = translation_memory.open_memory(source_lang, target_lang, book_id)
+    book_context = prompts.translate_sentences_context(title, author, source_lang, target_lang)
     try:
-        localized = fetch_localized_title_and_author(
-            title, author, str(year), target_lang)
-        localized_title = localized.localized_title
-        localized_author = localized.localized_author
-        print(f"✅ Название на {target_lang}: {localized_title}")
-        print(f"✅ Автор на {target_lang}: {localized_author}")
-    except Exception as e:
-        print(f"⚠️ Ошибка при получении перевода названия и автора: {e}")
-        localized_title = title
-        localized_author = author
-
-    # Проверяем, есть ли уже запись
-    existing = supabase.table("books_translations").select("id").eq(
-        "book_id", book_id).eq("language", target_lang).execute()
-
-    if existing.data:
-        supabase.table("books_translations").update({
-            result_field: json_translated,
-            "title": localized_title,
-            "author": localized_author
-        }).eq("book_id", book_id).eq("language", target_lang).execute()
 
-        print("🔄 Обновлена существующая запись.")
-    else:
-        supabase.table("books_translations").insert({
-            "book_id": book_id,
-            "language": target_lang,
-            result_field: json_translated,
-            "title": localized_title,
-            "author": localized_author
-        }).execute()
+        for chapter in chapters_to_process:
+            print(f"\n📚 Глава {chapter.chapter_number}")
+            translated_paragraphs = []
+
+            for paragraph in chapter.paragraphs:
+                print(f"  ✂️ Абзац {paragraph.paragraph_number}")
+
+                raw_sentences = split_old_into_sentences(
+                    paragraph.paragraph_content, source_lang, spacy_nlp)
+                para_struct_original = ChapterParagraphSentenceOriginal(
+                    paragraph_number=paragraph.paragraph_number,
+                    sentences=[
+                        SentenceOriginal(
+                            sentence_number=i + 1,
+                            sentence_original=s.strip()
+                        )
+                        for i, s in enumerate(raw_sentences)
+                    ]
+                )
+                paragraphs_sentences_flat.append(para_struct_original)
+
+                remembered = paragraph_from_memory(memory, para_struct_original)
+                if remembered is not None:
+                    translated_paragraphs.append(remembered)
+                    translated_count += 1
+                    print(f"    🧠 Из памяти переводов. 📊 Прогресс: {translated_count}/{total_paragraphs}")
+                    metrics.inc("paragraphs_processed_total",
+                                step=step_name, lang=target_lang)
+                    metrics.add_gauge("queue_depth", -1,
+                                      step=step_name, lang=target_lang)
+                    previous_paragraphs.append(paragraph.paragraph_content.strip())
+                    continue
+
+                # Предыдущий текст — в конце запроса: инструкции и контекст книги остаются общим префиксом (utils/prompts.py)
+                # Добавим до 2 предыдущих абзацев, если их общая длина < 300 символов
+                # максимум 2 последних
+                context_paragraphs = previous_paragraphs[-2:]
+                context_joined = "\n".join(context_paragraphs).strip()
+
+                previous_text = ""
+                if context_joined and len(context_joined) <= 300:
+                    previous_text = context_joined
+                elif previous_paragraphs:
+                    previous_text = previous_paragraphs[-1]
+
+                # Перевод
+                attempt = 0
+                success = False
+                level = 0
+
+                while attempt < 3 and not success:
+                    attempt += 1
+                    model = model_router.model_for("translate_sentences", level)
+                    try:
+                        print(f"    🌍 Перевод (попытка {attempt}, {model})...")
+                        if attempt > 1:
+                            metrics.inc("retries_total", step=step_name)
+                        with metrics.track_request("openai", model, step_name):
+                            completion = client.beta.chat.completions.parse(
+                                model=model,
+                                messages=prompts.messages(
+                                    prompts.TRANSLATE_SENTENCES, book_context,
+                                    para_struct_original.model_dump_json(indent=2)[:max_chars],
+                                    background=prompts.previous_text_background(previous_text)),
+                                response_format=ChapterParagraphSentenceTranslated
+                            )
+                        prompts.record_usage(step_name, model, completion)
+                        translated_para = completion.choices[0].message.parsed
+
+                        if len(translated_para.sentences) != len(para_struct_original.sentences):
+                            print(
+                                f"    ⚠️ Несовпадение: {len(para_struct_original.sentences)} → {len(translated_para.sentences)}")
+                            level = model_router.escalate("translate_sentences", level)
+                        else:
+                            translated_paragraphs.append(translated_para)
+                            if memory is not None:
+                                for sentence in translated_para.sentences:
+                                    memory.store(sentence.sentence_original, sentence.sentence_translation)
+                            translated_count += 1
+                            percent = round(
+                                (translated_count / total_paragraphs) * 100)
+                            print(
+                                f"    ✅ Успешно. 📊 Прогресс: {translated_count}/{total_paragraphs} ({percent}%)")
+                            metrics.inc("paragraphs_processed_total",
+                                        step=step_name, lang=target_lang)
+                            metrics.add_gauge("queue_depth", -1,
+                                              step=step_name, lang=target_lang)
+                            success = True
+
+                    except Exception as e:
+                        print(f"    ❌ Ошибка GPT: {e}")
+                        if model_router.is_validation_error(e):
+                            level = model_router.escalate("translate_sentences", level)
+                        time.sleep(2)
+
+                if not success:
+                    print(
+                        f"⛔ Не удалось обработать абзац: книга-{book_id} глава-{chapter.chapter_number} абзац-{paragraph.paragraph_number} язык-{target_lang} источник-{source_field}. Остановка.")
+                    metrics.inc("paragraphs_failed_total",
+                                step=step_name, lang=target_lang)
+                    metrics.set_gauge("queue_depth", 0,
+                                      step=step_name, lang=target_lang)
+                    return
+
+                previous_paragraphs.append(paragraph.paragraph_content.strip())
+
+            chapters_result.append(ChapterItemWithTranslatedSentences(
+                chapter_number=chapter.chapter_number,
+                paragraphs=translated_paragraphs
+            ))
+
+        # Сохраняем финальный результат
+        print(f"\n💾 Сохраняем результат в books_translations для {target_lang}...")
+
+        full_structure = ChapterStructureTranslatedSentences(
+            chapters=chapters_result)
+        json_translated = full_structure.model_dump_json(indent=2)
+
+        # 🌍 Получение локализованного названия и автора
+        try:
+            localized = fetch_localized_title_and_author(
+                title, author, str(year), target_lang)
+            localized_title = localized.localized_title
+            localized_author = localized.localized_author
+            print(f"✅ Название на {target_lang}: {localized_title}")
+            print(f"✅ Автор на {target_lang}: {localized_author}")
+        except Exception as e:
+            print(f"⚠️ Ошибка при получении перевода названия и автора: {e}")
+            localized_title = title
+            localized_author = author
+
+        # Проверяем, есть ли уже запись
+        existing = supabase.table("books_translations").select("id").eq(
+            "book_id", book_id).eq("language", target_lang).execute()
+
+        if existing.data:
+            supabase.table("books_translations").update({
+                result_field: translation_storage.store_field(supabase, book_id, target_lang, result_field, json_translated),
+                "title": localized_title,
+                "author": localized_author
+            }).eq("book_id", book_id).eq("language", target_lang).execute()
+
+            print("🔄 Обновлена существующая запись.")
+        else:
+            supabase.table("books_translations").insert({
+                "book_id": book_id,
+                "language": target_lang,
+                result_field: translation_storage.store_field(supabase, book_id, target_lang, result_field, json_translated),
+                "title": localized_title,
+                "author": localized_author
+            }).execute()
 
-        print("🆕 Добавлена новая запись.")
+            print("🆕 Добавлена новая запись.")
 
-    print("\n✅ Перевод всех абзацев завершён.")
+        print("\n✅ Перевод всех абзацев завершён.")
+    finally:
+        # очередь шага пуста при любом выходе: успех, остановка на абзаце или исключение
+        metrics.set_gauge("queue_depth", 0, step=step_name, lang=target_lang)
+        if memory is not None:
+            print(memory.summary())
+            memory.close()
 
 
 def enrich_sentences_with_words(
@@ -508,7 +629,8 @@ def enrich_sentences_with_words(
     source_lang: str,
     target_lang: str,
     max_chars: int,
-    paras_number: Optional[int] = None
+    paras_number: Optional[int] = None,
+    two_phase: bool = False
 ):
 
     try:
@@ -538,141 +660,191 @@ def enrich_sentences_with_words(
         f"{source_field}"
     ).eq("book_id", book_id).eq("language", target_lang).single().execute()
 
-    text = response.data.get(source_field)
+    text = translation_storage.load_field(supabase, book_id, target_lang, source_field,
+                                          response.data.get(source_field))
     if not text:
         print(f"❌ Нет текста в поле {source_field}.")
         return
 
     structure = ChapterStructureWithSentences.model_validate_json(text)
     client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    memory = translation_memory.open_memory(source_lang, target_lang, book_id)
+    try:
+        total_sentences = sum(len(p.sentences)
+                              for c in structure.chapters for p in c.paragraphs)
+        enriched_count = 0
+
+        # Словари языков в именительном падеже
+        lang_names = {
+            "en": "английский",
+            "es": "испанский",
+            "fr": "французский",
+            "de": "немецкий",
+            "it": "итальянский",
+            "ru": "русский",
+            "pt": "португальский (бразильский)",
+            "tr": "турецкий",
+            "ja": "японский"
+        }
+
+        readable_source = lang_names.get(source_lang, source_lang)
+        readable_target = lang_names.get(target_lang, target_lang)
+
+        if two_phase:
+            paragraphs = [p for c in structure.chapters for p in c.paragraphs]
+            # Обработка только первых N абзацев главы 1
+            if (paras_number is not None) and (paras_number != -1):
+                paragraphs = [p for c in structure.chapters if c.chapter_number == 1
+                              for p in c.paragraphs][:paras_number]
+            metrics.set_gauge("queue_depth", len(paragraphs),
+                              step=f"words:{source_field}", lang=target_lang)
+            if enrich_words_two_phase(supabase, client, book_id, structure, source_field, result_field, target_lang,
+                                      paragraphs, readable_source, readable_target, memory):
+                save_enriched_words(supabase, structure, book_id, source_field, result_field, target_lang, start_time)
+            return
 
-    total_sentences = sum(len(p.sentences)
-                          for c in structure.chapters for p in c.paragraphs)
-    enriched_count = 0
+        words_context = prompts.words_context(readable_source, readable_target)
 
-    # Словари языков в именительном падеже
-    lang_names = {
-        "en": "английский",
-        "es": "испанский",
-        "fr": "французский",
-        "de": "немецкий",
-        "it": "итальянский",
-        "ru": "русский",
-        "pt": "португальский (бразильский)",
-        "tr": "турецкий",
-        "ja": "японский"
-    }
+        step_name = f"words:{source_field}"
+        metrics.set_gauge("queue_depth", sum(len(c.paragraphs) for c in structure.chapters),
+                          step=step_name, lang=target_lang)
 
-    readable_source = lang_names.get(source_lang, source_lang)
-    readable_target = lang_names.get(target_lang, target_lang)
+        # storage.layout: paragraphs — каждый разобранный абзац записывается сразу,
+        # и после сбоя разбор продолжается с первого незаписанного абзаца
+        saved = translation_storage.load_paragraphs(supabase, book_id, target_lang, result_field)
+        stored = set()
+        if saved:
+            print(f"♻️ Найдено {len(saved)} абзацев, сохранённых прошлым запуском")
 
-    # Словари языков в предложном падеже
-    lang_names_pr = {
-        "en": "английском",
-        "es": "испанском",
-        "fr": "французском",
-        "de": "немецком",
-        "ru": "русском",
-        "it": "итальянском",
-        "pt": "португальском (бразильском)",
-        "tr": "турецком",
-        "ja": "японском"
-    }
+        def store_paragraph(chapter_number: int, paragraph):
+            if translation_storage.save_paragraph(supabase, book_id, target_lang, result_field, chapter_number,
+                                                  paragraph.model_dump(mode="json")):
+                stored.update({(chapter_number, 0), (chapter_number, paragraph.paragraph_number)})
 
-    readable_source_pr = lang_names_pr.get(source_lang, source_lang)
-    readable_target_pr = lang_names_pr.get(target_lang, target_lang)
+        for chapter in structure.chapters:
+            print(f"\n📚 Глава {chapter.chapter_number}")
+            translated_paragraphs = chapter.paragraphs
 
-    system_prompt = (
-        f"Ты — языковой помощник.\n"
-        f"Язык оригинала — {readable_source}. Язык перевода — {readable_target}.\n"
-        f"Очисти каждый текст в 'sentence_original' от знаков препинания и разбей на минимальные по длине смысловые и грамматические группы, сохраняя вместе фразовые глаголы, идиомы, неделимые выражения.\n"
-        "Не объединяй слова в одну группу, если их можно разделить без изменения смысла и неверного толкования по отдельности.\n"
-        f"Для каждой группы укажи:\n"
-        f"- 'o': оригинал на {readable_source_pr};\n"
-        f"- 'o_t': дословный перевод на {readable_target}, а для артиклей, частиц, вспомогательных и служебных слов - их роль в предложении;\n"
-        f"- 'l': лемма на {readable_source_pr} (если отличается от `o`; если нет — оставь `""`);\n"
-        f"- 'l_t': перевод леммы на {readable_target} (если отличается от `o_t`; если нет — оставь `""`).\n"
-        f"Ответ строго по заданной структуре (response_format), где 'SentenceWordList' соответствует 'sentence_original'."
-    )
+            # Обработка только первых N абзацев главы 1
+            if (paras_number is not None) and (paras_number != -1):
+                if chapter.chapter_number != 1:
+                    continue
+                translated_paragraphs = chapter.paragraphs[:paras_number]
 
-    for chapter in structure.chapters:
-        print(f"\n📚 Глава {chapter.chapter_number}")
-        translated_paragraphs = chapter.paragraphs
-
-        # Обработка только первых N абзацев главы 1
-        if (paras_number is not None) and (paras_number != -1):
-            if chapter.chapter_number != 1:
-                continue
-            translated_paragraphs = chapter.paragraphs[:paras_number]
-
-        for paragraph in translated_paragraphs:
-            print(
-                f"  ✂️ Абзац {paragraph.paragraph_number} — {len(paragraph.sentences)} предложений")
-
-            attempt = 0
-            success = False
-
-            while attempt < 3 and not success:
-                attempt += 1
-                try:
-                    input_data = [
-                        {
-                            "sentence_number": s.sentence_number,
-                            "sentence_original": s.sentence_original  # ,
-                            # "sentence_translation": s.sentence_translation
-                        }
-                        for s in paragraph.sentences
-                    ]
+            for paragraph in translated_paragraphs:
+                print(
+                    f"  ✂️ Абзац {paragraph.paragraph_number} — {len(paragraph.sentences)} предложений")
+
+                if words_from_saved(saved, chapter.chapter_number, paragraph):
+                    stored.update({(chapter.chapter_number, 0), (chapter.chapter_number, paragraph.paragraph_number)})
+                    enriched_count += len(paragraph.sentences)
+                    print(f"    ♻️ Уже разобран прошлым запуском. 📊 Прогресс: {enriched_count}/{total_sentences}")
+                    metrics.inc("paragraphs_processed_total",
+                                step=step_name, lang=target_lang)
+                    metrics.add_gauge("queue_depth", -1,
+                                      step=step_name, lang=target_lang)
+                    continue
+
+                if words_from_memory(memory, paragraph):
+                    store_paragraph(chapter.chapter_number, paragraph)
+                    enriched_count += len(paragraph.sentences)
+                    print(f"    🧠 Из памяти переводов. 📊 Прогресс: {enriched_count}/{total_sentences}")
+                    metrics.inc("paragraphs_processed_total",
+                                step=step_name, lang=target_lang)
+                    metrics.add_gauge("queue_depth", -1,
+                                      step=step_name, lang=target_lang)
+                    continue
+
+                attempt = 0
+                success = False
+                level = 0
+
+                while attempt < 3 and not success:
+                    attempt += 1
+                    model = model_router.model_for("translate_words", level)
+                    try:
+                        input_data = [
+                            {
+                                "sentence_number": s.sentence_number,
+                                "sentence_original": s.sentence_original  # ,
+                                # "sentence_translation": s.sentence_translation
+                            }
+                            for s in paragraph.sentences
+                        ]
+
+                        if attempt > 1:
+                            metrics.inc("retries_total", step=step_name)
+                        with metrics.track_request("openai", model, step_name):
+                            completion = client.beta.chat.completions.parse(
+                                model=model,
+                                messages=prompts.messages(
+                                    prompts.WORDS, words_context,
+                                    json.dumps(input_data, ensure_ascii=False, indent=2)),
+                                response_format=ParagraphWordAnalysis,
+                            )
+                        prompts.record_usage(step_name, model, completion)
+
+                        parsed_paragraph = completion.choices[0].message.parsed
+                        parsed_sentences = parsed_paragraph.sentences
+
+                        if len(parsed_sentences) != len(paragraph.sentences):
+                            print(
+                                f"    ⚠️ Несовпадение числа предложений: ожидалось {len(paragraph.sentences)}, получено {len(parsed_sentences)}")
+                            level = model_router.escalate("translate_words", level)
+                        else:
+                            for sentence in paragraph.sentences:
+                                match = next(
+                                    (s for s in parsed_sentences if s.sentence_number == sentence.sentence_number), None)
+                                if not match:
+                                    raise ValueError(
+                                        f"Предложение {sentence.sentence_number} не найдено")
+                                sentence.words = match.words
+                            remember_words(memory, paragraph)
+                            store_paragraph(chapter.chapter_number, paragraph)
+
+                            enriched_count += len(paragraph.sentences)
+                            percent = round(
+                                (enriched_count / total_sentences) * 100)
+                            print(
+                                f"    ✅ Успешно — {len(paragraph.sentences)} предложений. 📊 Прогресс: {enriched_count}/{total_sentences} ({percent}%)")
+                            metrics.inc("paragraphs_processed_total",
+                                        step=step_name, lang=target_lang)
+                            metrics.add_gauge("queue_depth", -1,
+                                              step=step_name, lang=target_lang)
+                            success = True
+
+                    except Exception as e:
+                        print(f"    ❌ Ошибка при анализе слов: {e}")
+                        if model_router.is_validation_error(e):
+                            level = model_router.escalate("translate_words", level)
+
+                if not success:
+                    print(
+                        f"⛔ Не удалось обработать абзац: книга-{book_id} глава-{chapter.chapter_number} абзац-{paragraph.paragraph_number} язык-{target_lang} источник-{source_field}. Остановка.")
+                    metrics.inc("paragraphs_failed_total",
+                                step=step_name, lang=target_lang)
+                    metrics.set_gauge("queue_depth", 0,
+                                      step=step_name, lang=target_lang)
+                    return
 
-                    completion = client.beta.chat.completions.parse(
-                        model="gpt-4.1",
-                        messages=[
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": json.dumps(
-                                input_data, ensure_ascii=False, indent=2)}
-                        ],
-                        response_format=ParagraphWordAnalysis,
-                    )
+            # Выход из цикла, если только глава 1 и первые N абзацев
+            if paras_number is not None and paras_number > 0:
+                break
 
-                    parsed_paragraph = completion.choices[0].message.parsed
-                    parsed_sentences = parsed_paragraph.sentences
+        save_enriched_words(supabase, structure, book_id, source_field, result_field, target_lang, start_time, stored)
+    finally:
+        if memory is not None:
+            print(memory.summary())
+            memory.close()
 
-                    if len(parsed_sentences) != len(paragraph.sentences):
-                        print(
-                            f"    ⚠️ Несовпадение числа предложений: ожидалось {len(paragraph.sentences)}, получено {len(parsed_sentences)}")
-                    else:
-                        for sentence in paragraph.sentences:
-                            match = next(
-                                (s for s in parsed_sentences if s.sentence_number == sentence.sentence_number), None)
-                            if not match:
-                                raise ValueError(
-                                    f"Предложение {sentence.sentence_number} не найдено")
-                            sentence.words = match.words
-
-                        enriched_count += len(paragraph.sentences)
-                        percent = round(
-                            (enriched_count / total_sentences) * 100)
-                        print(
-                            f"    ✅ Успешно — {len(paragraph.sentences)} предложений. 📊 Прогресс: {enriched_count}/{total_sentences} ({percent}%)")
-                        success = True
-
-                except Exception as e:
-                    print(f"    ❌ Ошибка при анализе слов: {e}")
-
-            if not success:
-                print(
-                    f"⛔ Не удалось обработать абзац: книга-{book_id} глава-{chapter.chapter_number} абзац-{paragraph.paragraph_number} язык-{target_lang} источник-{source_field}. Остановка.")
-                return
 
-        # Выход из цикла, если только глава 1 и первые N абзацев
-        if paras_number is not None and paras_number > 0:
-            break
+def save_enriched_words(supabase, structure: ChapterStructureWithSentences, book_id: int, source_field: str,
+                        result_field: str, target_lang: str, start_time: float, stored: set = None):
+    metrics.set_gauge("queue_depth", 0, step=f"words:{source_field}", lang=target_lang)
 
     print(f"\n💾 Сохраняем {result_field} в books_translations...")
     json_result = structure.model_dump_json(indent=2)
-    supabase.table("books_translations").update(
-        {result_field: json_result}
-    ).eq("book_id", book_id).eq("language", target_lang).execute()
+    translation_storage.save_field(supabase, book_id, target_lang, result_field, json_result, stored)
 
     print("✅ Разбор слов завершён и сохранён.")
 
@@ -682,6 +854,217 @@ def enrich_sentences_with_words(
     print(f"⏱ Время перевода слов книги: {minutes} мин {seconds} сек")
 
 
+# === Двухфазный разбор слов ===
+# Группы слов 'o' и леммы 'l' зависят только от исходного текста: они строятся один раз на книгу
+# (или берутся из разбора, уже готового для другого языка) и кешируются в cache/segmentation,
+# а для каждого языка запрашиваются только переводы 'o_t' / 'l_t' для готового списка групп.
+
+SEGMENTATION_CACHE_DIR = os.path.join("cache", "segmentation")
+
+
+def _paragraph_key(sentences) -> str:
+    text = "\n".join(sentence.sentence_original for sentence in sentences)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _segmentation_cache_path(book_id: int, source_field: str) -> str:
+    return os.path.join(SEGMENTATION_CACHE_DIR, f"book_{book_id}_{source_field}.json")
+
+
+def _load_segmentation_cache(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_segmentation_cache(path: str, segmentation: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(segmentation, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def segmentation_from_words(structure: ChapterStructureWithSentences) -> dict:
+    """
+    Группы и леммы из готового разбора слов (любого языка): ключ абзаца → список групп по предложениям.
+    """
+    segmentation = {}
+    for chapter in structure.chapters:
+        for paragraph in chapter.paragraphs:
+            if all(sentence.words for sentence in paragraph.sentences):
+                segmentation[_paragraph_key(paragraph.sentences)] = [
+                    [{"o": word.o, "l": word.l or ""} for word in sentence.words]
+                    for sentence in paragraph.sentences
+                ]
+    return segmentation
+
+
+def _segmentation_from_other_languages(supabase, book_id: int, result_field: str, target_lang: str) -> dict:
+    rows = supabase.table("books_translations").select("language").eq(
+        "book_id", book_id).neq("language", target_lang).execute().data
+    for row in rows:
+        response = supabase.table("books_translations").select(result_field).eq(
+            "book_id", book_id).eq("language", row["language"]).single().execute()
+        raw = translation_storage.load_field(supabase, book_id, row["language"], result_field,
+                                             response.data.get(result_field))
+        if not raw or str(raw).strip() in {"", "{}", "[]"}:
+            continue
+        try:
+            segmentation = segmentation_from_words(ChapterStructureWithSentences.model_validate_json(raw))
+        except Exception as e:
+            print(f"    ⚠️ Разбор слов языка {row['language']} не подошёл: {e}")
+            continue
+        if segmentation:
+            print(f"♻️ Группы слов взяты из разбора языка {row['language']} ({len(segmentation)} абзацев)")
+            return segmentation
+    return {}
+
+
+def _segment_paragraph(client, paragraph, words_context: str, step_name: str) -> list[list[dict]] | None:
+    input_data = [
+        {"sentence_number": s.sentence_number, "sentence_original": s.sentence_original}
+        for s in paragraph.sentences
+    ]
+    level = 0
+    for attempt in range(1, 4):
+        model = model_router.model_for("words_segmentation", level)
+        try:
+            if attempt > 1:
+                metrics.inc("retries_total", step=step_name)
+            with metrics.track_request("openai", model, step_name):
+                completion = client.beta.chat.completions.parse(
+                    model=model,
+                    messages=prompts.messages(
+                        prompts.WORDS_SEGMENTATION, words_context,
+                        json.dumps(input_data, ensure_ascii=False, indent=2)),
+                    response_format=ParagraphSegmentation,
+                )
+            prompts.record_usage(step_name, model, completion)
+            parsed = {s.sentence_number: s.words for s in completion.choices[0].message.parsed.sentences}
+            missing = [s.sentence_number for s in paragraph.sentences if not parsed.get(s.sentence_number)]
+            if missing:
+                raise ValueError(f"Нет групп слов для предложений {missing}")
+            return [[{"o": w.o, "l": w.l or ""} for w in parsed[s.sentence_number]] for s in paragraph.sentences]
+        except Exception as e:
+            print(f"    ❌ Ошибка при разбиении на группы: {e}")
+            if model_router.is_validation_error(e):
+                level = model_router.escalate("words_segmentation", level)
+    return None
+
+
+def _translate_segments(client, paragraph, segments: list[list[dict]], words_context: str,
+                        step_name: str) -> list[list[WordItem]] | None:
+    input_data = [
+        {
+            "sentence_number": sentence.sentence_number,
+            "sentence_original": sentence.sentence_original,
+            "words": [
+                {"id": f"{sentence.sentence_number}_{index + 1}", "o": word["o"], "l": word["l"]}
+                for index, word in enumerate(sentence_segments)
+            ]
+        }
+        for sentence, sentence_segments in zip(paragraph.sentences, segments)
+    ]
+    expected = {word["id"] for sentence in input_data for word in sentence["words"]}
+
+    level = 0
+    for attempt in range(1, 4):
+        model = model_router.model_for("translate_words", level)
+        try:
+            if attempt > 1:
+                metrics.inc("retries_total", step=step_name)
+            with metrics.track_request("openai", model, step_name):
+                completion = client.beta.chat.completions.parse(
+                    model=model,
+                    messages=prompts.messages(
+                        prompts.WORDS_TRANSLATION, words_context,
+                        json.dumps(input_data, ensure_ascii=False, indent=2)),
+                    response_format=ParagraphWordTranslations,
+                )
+            prompts.record_usage(step_name, model, completion)
+            translations = {item.id: item for item in completion.choices[0].message.parsed.words}
+            missing = expected - translations.keys()
+            if missing:
+                raise ValueError(f"Нет перевода для {len(missing)} групп: {sorted(missing)[:5]}")
+            return [
+                [
+                    WordItem(
+                        o=word["o"],
+                        o_t=translations[word["id"]].o_t,
+                        l=word["l"],
+                        l_t=(translations[word["id"]].l_t or "") if word["l"] else ""
+                    )
+                    for word in sentence["words"]
+                ]
+                for sentence in input_data
+            ]
+        except Exception as e:
+            print(f"    ❌ Ошибка при переводе групп слов: {e}")
+            if model_router.is_validation_error(e):
+                level = model_router.escalate("translate_words", level)
+    return None
+
+
+def enrich_words_two_phase(supabase, client, book_id: int, structure: ChapterStructureWithSentences,
+                           source_field: str, result_field: str, target_lang: str, paragraphs: list,
+                           readable_source: str, readable_target: str,
+                           memory=None) -> bool:
+    """
+    Фаза 1 — группы и леммы (кеш, другой язык или запрос), фаза 2 — переводы групп на target_lang.
+    """
+    step_name = f"words:{source_field}"
+    cache_path = _segmentation_cache_path(book_id, source_field)
+    segmentation = _load_segmentation_cache(cache_path)
+
+    missing = [p for p in paragraphs if _paragraph_key(p.sentences) not in segmentation]
+    if missing:
+        segmentation.update(_segmentation_from_other_languages(supabase, book_id, result_field, target_lang))
+        missing = [p for p in paragraphs if _paragraph_key(p.sentences) not in segmentation]
+
+    if missing:
+        print(f"🧩 Фаза 1: разбиваем на группы {len(missing)} абзацев (один раз для всех языков)...")
+        segmentation_context = prompts.words_context(readable_source)
+        for paragraph in missing:
+            segments = _segment_paragraph(client, paragraph, segmentation_context, step_name)
+            if segments is None:
+                print(f"⛔ Не удалось разбить абзац {paragraph.paragraph_number} на группы. Остановка.")
+                _save_segmentation_cache(cache_path, segmentation)
+                return False
+            segmentation[_paragraph_key(paragraph.sentences)] = segments
+        _save_segmentation_cache(cache_path, segmentation)
+    elif not os.path.exists(cache_path):
+        _save_segmentation_cache(cache_path, segmentation)
+
+    translation_context = prompts.words_context(readable_source, readable_target)
+
+    total = len(paragraphs)
+    print(f"🌍 Фаза 2: переводим группы слов на {readable_target} ({total} абзацев)...")
+    for done, paragraph in enumerate(paragraphs, start=1):
+        if words_from_memory(memory, paragraph):
+            print(f"    🧠 Абзац {paragraph.paragraph_number} из памяти переводов — {round(done / total * 100)}%")
+            metrics.inc("paragraphs_processed_total", step=step_name, lang=target_lang)
+            metrics.add_gauge("queue_depth", -1, step=step_name, lang=target_lang)
+            continue
+        words = _translate_segments(client, paragraph, segmentation[_paragraph_key(paragraph.sentences)],
+                                    translation_context, step_name)
+        if words is None:
+            print(
+                f"⛔ Не удалось обработать абзац: книга-{book_id} абзац-{paragraph.paragraph_number} язык-{target_lang} источник-{source_field}. Остановка.")
+            metrics.inc("paragraphs_failed_total", step=step_name, lang=target_lang)
+            metrics.set_gauge("queue_depth", 0, step=step_name, lang=target_lang)
+            return False
+        for sentence, sentence_words in zip(paragraph.sentences, words):
+            sentence.words = sentence_words
+        remember_words(memory, paragraph)
+        print(f"    ✅ Абзац {paragraph.paragraph_number} — {round(done / total * 100)}%")
+        metrics.inc("paragraphs_processed_total", step=step_name, lang=target_lang)
+        metrics.add_gauge("queue_depth", -1, step=step_name, lang=target_lang)
+    return True
+
+
 # новый промежуточный шаг после форматирования - разбивка на короткие предложения
 
 
@@ -711,7 +1094,7 @@ def split_into_sentences(book_id, lang="en", max_chars=4000):
     try:
         print("⏳ Отправка текста на разбивку предложений в OpenAI...")
         response = client.chat.completions.create(
-            model="gpt-4.1",
+            model=model_router.model_for("sentence_split"),
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": text[:max_chars]}
@@ -827,7 +1210,7 @@ def verify_separated_text(book_id: int, lang_code: str, nlp):
                 )
 
                 completion = client.beta.chat.completions.parse(
-                    model="gpt-4.1",
+                    model=model_router.model_for("paragraph_split_manual"),
                     messages=[
                         {"role": "system", "content": system_prompt},
                         {"role": "user", "content": paragraph}
@@ -4,12 +4,315 @@ import json
 import time
 import random
 from openai import OpenAI
-from pathlib import Path
+from utils import metrics, model_router, concurrency, logger, word_frequency, json_stream, translation_storage, prompts
 from utils.supabase_client import get_supabase_client
 from schemas.paragraph_tf import ParagraphTFItem, ParagraphTFQuestionOnly
 from schemas.paragraph_translate import HowToTranslateTask
 from schemas.paragraph_two_words import TwoWordsTask
+from schemas.paragraph_tasks import ParagraphTasks
+
+
+lang_names_pr = {
+    "en": "английском",
+    "es": "испанском",
+    "fr": "французском",
+    "de": "немецком",
+    "ru": "русском",
+    "it": "итальянском",
+    "pt": "португальском (бразильском)",
+    "tr": "турецком",
+    "ja": "японском"
+}
+
+HOW_TO_TRANSLATE_PROMPT = (
+    "Ты — преподаватель иностранного языка.\n\n"
+    "У тебя есть список слов с полями:\n"
+    "- id — идентификатор слова\n"
+    "- o — слово на изучаемом языке\n"
+    "- o_t — его перевод на язык ученика\n\n"
+    "Выбери одно менее частотное, специфичное для абзаца слово для проверки понимания учеником текста."
+    "Верни:\n"
+    "- correct_id — id этого слова\n"
+    "- incorrect1_id и incorrect2_id — id других слов из списка, схожих по типу, но отличающихся по значению\n\n"
+    "Верни строго JSON по схеме"
+)
+
+
+def true_or_false_prompt(expected_answer: str, readable_target_pr: str) -> str:
+    if expected_answer == "true":
+        task = "Сформулируй верное утверждение по содержанию абзаца"
+        fact = "отражать суть происходящего"
+    else:
+        task = "Сформулируй заведомо ложное утверждение по содержанию абзаца"
+        fact = "отражать вымышленный факт относительно происходящего"
+
+    return (
+        f"Ты — помощник по чтению книг. {task}.\n\n"
+        f"Утверждение должно:\n"
+        f"- быть на {readable_target_pr} языке;\n"
+        f"- {fact};\n"
+        f"- быть легко проверяемым по содержанию;\n"
+        f"- быть достаточно очевидным для вдумчивого читателя;\n"
+        f"- быть коротким, до 7 слов;\n"
+        f"- не содержать двусмысленностей.\n\n"
+        f"Верни объект строго по схеме: {{ question: '...' }}"
+    )
+
+
+def two_words_prompt(readable_target_pr: str) -> str:
+    return (
+        f"У тебя есть список слов из текста на {readable_target_pr} языке.\n"
+        f"Твоя задача:\n"
+        f"1. Найди два слова, которые похожи по типу (например, оба — действия или предметы), но разные по значению.\n"
+        f"2. Верни их id как id1 и id2.\n"
+        f"3. Придумай третье слово на {readable_target_pr} языке, похожее по типу, которое не подходит к теме текста.\n\n"
+        f"Верни строго JSON: {{ id1, id2, invented }}"
+    )
+
+
+# === Слова-кандидаты абзаца ===
+
+def how_to_translate_words(chapter_number: int, paragraph: dict) -> tuple[list[dict], dict]:
+    word_objects = []
+    word_lookup = {}
+
+    for sentence in paragraph["sentences"]:
+        sid = sentence["sentence_number"]
+        for wid, word in enumerate(sentence.get("words", [])):
+            word_id = f"{chapter_number}_{paragraph['paragraph_number']}_{sid}_{wid + 1}"
+
+            o = word["o"].strip()
+            o_t = word["o_t"].strip()
+
+            if len(o) > 22 or len(o_t) > 22:
+                continue
+
+            word_obj = {
+                "id": word_id,
+                "o": word["o"],
+                "o_t": word["o_t"]
+            }
+            word_objects.append(word_obj)
+            word_lookup[word_id] = word_obj
+
+    return word_objects, word_lookup
+
+
+def two_words_candidates(chapter_number: int, paragraph: dict) -> tuple[list[dict], dict]:
+    candidates = []
+    word_lookup = {}
+
+    for sentence in paragraph["sentences"]:
+        sid = sentence["sentence_number"]
+        for wid, word in enumerate(sentence.get("words", [])):
+            word_id = f"{chapter_number}_{paragraph['paragraph_number']}_{sid}_{wid + 1}"
+            o_t = word.get("o_t", "").strip()
+            if len(o_t.split()) <= 2 and len(o_t) < 15:
+                candidates.append({"id": word_id, "o_t": o_t})
+                word_lookup[word_id] = o_t
+
+    return candidates, word_lookup
+
+
+def ranked_how_to_translate(index, mode: str, chapter_number: int, paragraph: dict,
+                            word_objects: list[dict], log) -> tuple[list[dict], dict | None]:
+    """
+    Сужает список слов для GPT по индексу частот; в режиме local собирает задание без запроса.
+    """
+    if index is None:
+        return word_objects, None
+    ranked = word_frequency.rank_words(index, chapter_number, paragraph)
+    if mode == "local":
+        task = word_frequency.pick_local(ranked)
+        if task is not None:
+            log(f"    ✅ Собрано локально: {task}")
+            return word_objects, task
+    if len(ranked) >= 3:
+        return word_frequency.top_candidates(ranked), None
+    return word_objects, None
+
+
+# === Проверка ответов ===
+
+def clean_question(question: str) -> str:
+    cleaned_question = question.strip()
+    if cleaned_question.endswith("."):
+        cleaned_question = cleaned_question[:-1]
+    if not cleaned_question:
+        raise ValueError("Пустое утверждение")
+    return cleaned_question
+
+
+def check_how_to_translate(task: HowToTranslateTask, word_lookup: dict) -> dict:
+    # KeyError, если модель вернула id не из списка
+    for word_id in (task.correct_id, task.incorrect1_id, task.incorrect2_id):
+        word_lookup[word_id]
+    if len({task.correct_id, task.incorrect1_id, task.incorrect2_id}) < 3:
+        raise ValueError("ID слов повторяются")
+    return {
+        "c": task.correct_id,
+        "i1": task.incorrect1_id,
+        "i2": task.incorrect2_id
+    }
+
+
+def check_two_words(task: TwoWordsTask, word_lookup: dict) -> dict:
+    if task.id1 not in word_lookup or task.id2 not in word_lookup:
+        raise KeyError(f"ID {task.id1} или {task.id2} не найдены")
+    if task.id1 == task.id2:
+        raise ValueError("ID слов совпадают")
+    if not task.invented.strip():
+        raise ValueError("Пустое придуманное слово")
+    return {
+        "id1": task.id1,
+        "id2": task.id2,
+        "invented": task.invented
+    }
+
+
+# === Запросы по одному заданию ===
+
+def request_true_or_false(client, paragraph_text: str, expected_answer: str, readable_target_pr: str,
+                          result_field: str, log, where: str = "") -> dict | None:
+    system_prompt = true_or_false_prompt(expected_answer, readable_target_pr)
+
+    attempt = 0
+    max_attempts = 2
+    level = 0
+
+    while attempt < max_attempts:
+        attempt += 1
+        if attempt > 1:
+            metrics.inc("retries_total", step=result_field)
+        model = model_router.model_for("tasks_true_or_false", level)
+        try:
+            concurrency.openai_limiter().acquire()
+            with metrics.track_request("openai", model, result_field):
+                completion = client.beta.chat.completions.parse(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": paragraph_text[:2000]}
+                    ],
+                    response_format=ParagraphTFQuestionOnly
+                )
+            prompts.record_usage(result_field, model, completion)
+            q_obj = completion.choices[0].message.parsed
+            cleaned_question = clean_question(q_obj.question)
+
+            log(f"    🏅 Вопрос: {cleaned_question} [{expected_answer}]")
+
+            return ParagraphTFItem(
+                question=cleaned_question,
+                answer=expected_answer
+            ).model_dump()
+        except Exception as e:
+            log(f"    ⚠️ Ошибка (попытка {attempt}): {e} ({where})")
+            if model_router.is_validation_error(e):
+                level = model_router.escalate("tasks_true_or_false", level)
+            concurrency.pause_after_error(e, concurrency.openai_limiter())
+
+    return None
+
+
+def request_how_to_translate(client, word_objects: list[dict], word_lookup: dict, result_field: str, log) -> dict | None:
+    input_json = json.dumps(word_objects, ensure_ascii=False, indent=2)
+
+    attempt = 0
+    max_attempts = 2
+    level = 0
+
+    while attempt < max_attempts:
+        attempt += 1
+        if attempt > 1:
+            metrics.inc("retries_total", step=result_field)
+        model = model_router.model_for("tasks_how_to_translate", level)
+        try:
+            concurrency.openai_limiter().acquire()
+            with metrics.track_request("openai", model, result_field):
+                completion = client.beta.chat.completions.parse(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": HOW_TO_TRANSLATE_PROMPT},
+                        {"role": "user", "content": input_json[:3000]}
+                    ],
+                    response_format=HowToTranslateTask
+                )
+            prompts.record_usage(result_field, model, completion)
+            task_result = check_how_to_translate(completion.choices[0].message.parsed, word_lookup)
+
+            correct_word = word_lookup[task_result["c"]]
+            incorrect1 = word_lookup[task_result["i1"]]
+            incorrect2 = word_lookup[task_result["i2"]]
+            log(f"    ✅ Вопрос: Как переводится '{correct_word.get('o_t', '<???>')}' → {correct_word.get('o', '—')} | {incorrect1.get('o', '—')} | {incorrect2.get('o', '—')}")
+            return task_result
+        except KeyError as e:
+            log(f"    ⚠️ Один из ID не найден в словаре: {e}.")
+            level = model_router.escalate("tasks_how_to_translate", level)
+        except Exception as e:
+            log(f"    ❌ Ошибка GPT (попытка {attempt}): {e}")
+            if model_router.is_validation_error(e):
+                level = model_router.escalate("tasks_how_to_translate", level)
+            concurrency.pause_after_error(e, concurrency.openai_limiter())
+
+    return None
+
+
+def request_two_words(client, candidates: list[dict], word_lookup: dict, readable_target_pr: str,
+                      result_field: str, log) -> dict | None:
+    input_json = json.dumps(candidates, ensure_ascii=False, indent=2)
+    system_prompt = two_words_prompt(readable_target_pr)
+
+    attempt = 0
+    max_attempts = 2
+    level = 0
+
+    while attempt < max_attempts:
+        attempt += 1
+        if attempt > 1:
+            metrics.inc("retries_total", step=result_field)
+        model = model_router.model_for("tasks_two_words", level)
+        try:
+            concurrency.openai_limiter().acquire()
+            with metrics.track_request("openai", model, result_field):
+                completion = client.beta.chat.completions.parse(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": input_json[:3000]}
+                    ],
+                    response_format=TwoWordsTask
+                )
+            prompts.record_usage(result_field, model, completion)
+            task_result = check_two_words(completion.choices[0].message.parsed, word_lookup)
+
+            o1 = word_lookup[task_result["id1"]]
+            o2 = word_lookup[task_result["id2"]]
+            log(f"    ✅ {task_result['id1']}: {o1} | {task_result['id2']}: {o2} → {task_result['invented']}")
+            return task_result
+        except KeyError as e:
+            log(f"    ❌ Ошибка: {e}.")
+            level = model_router.escalate("tasks_two_words", level)
+        except Exception as e:
+            log(f"    ❌ Ошибка GPT (попытка {attempt}): {e}")
+            if model_router.is_validation_error(e):
+                level = model_router.escalate("tasks_two_words", level)
+            concurrency.pause_after_error(e, concurrency.openai_limiter())
+
+    return None
+
+
+def group_by_chapter(chapter_numbers: list[int], outputs: list[tuple[int, dict]]) -> dict:
+    """
+    Собирает результаты абзацев обратно в структуру глав (порядок абзацев сохраняется).
+    """
+    chapters = {number: [] for number in chapter_numbers}
+    for chapter_number, paragraph_output in outputs:
+        chapters[chapter_number].append(paragraph_output)
+    return {"chapters": [{"chapter_number": number, "paragraphs": paragraphs} for number, paragraphs in chapters.items()]}
+
 
+# === Генераторы заданий по книге ===
 
 def generate_paragraph_tasks(book_id: int, source_field: str, result_field: str, target_lang: str, source_lang: str):
 
@@ -17,14 +320,7 @@ def generate_paragraph_tasks(book_id: int, source_field: str, result_field: str,
     supabase = get_supabase_client()
     client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-    log_dir = Path("logs")
-    log_dir.mkdir(exist_ok=True)
-    log_path = log_dir / f"log_tasks_book_{book_id}_{target_lang}.txt"
-
-    def log(msg):
-        print(msg)
-        with open(log_path, "a", encoding="utf-8") as f:
-            f.write(msg + "\n")
+    log = logger.step_logger("tasks", book_id, target_lang, step=result_field)
 
     # Проверка: если результат уже есть — пропускаем
     existing = supabase.table("books_translations").select(result_field).eq(
@@ -37,137 +333,65 @@ def generate_paragraph_tasks(book_id: int, source_field: str, result_field: str,
     log(f"📥 Загружаем {source_field} из books_translations для книги {book_id} и языка {target_lang}...")
     response = supabase.table("books_translations").select(source_field).eq(
         "book_id", book_id).eq("language", target_lang).single().execute()
-    text_data = response.data.get(source_field)
+    text_data = translation_storage.load_field(supabase, book_id, target_lang, source_field,
+                                               response.data.get(source_field))
 
     if not text_data:
         log(
             f"❌ Нет текста для анализа (книга {book_id}, поле {source_field}, язык {target_lang}).")
         return
 
+    readable_target_pr = lang_names_pr.get(target_lang, target_lang)
+
+    # Главы разбираются по одной (utils/json_stream): от абзаца в работе остаётся только текст.
+    # Ответ (верное/ложное утверждение) выбираем заранее, чтобы не зависеть от порядка потоков
+    chapter_numbers = []
+    work = []
     try:
-        data = json.loads(text_data)
+        for chapter in json_stream.iter_chapters(text_data):
+            chapter_numbers.append(chapter["chapter_number"])
+            for paragraph in chapter["paragraphs"]:
+                paragraph_text = " ".join(
+                    sentence["sentence_translation"] for sentence in paragraph["sentences"]).strip()
+                if not paragraph_text:
+                    continue
+                expected_answer = "true" if random.random() < 0.6 else "false"
+                work.append((chapter["chapter_number"], paragraph["paragraph_number"], paragraph_text, expected_answer))
     except Exception as e:
         log(f"❌ Ошибка при парсинге JSON: {e} (книга {book_id}, поле {source_field})")
         return
 
-    chapters = data["chapters"]
-    total_paragraphs = sum(len(ch["paragraphs"]) for ch in chapters)
-    processed_paragraphs = 0
-    result = {"chapters": []}
-
-    lang_names_pr = {
-        "en": "английском",
-        "es": "испанском",
-        "fr": "французском",
-        "de": "немецком",
-        "ru": "русском",
-        "it": "итальянском",
-        "pt": "португальском (бразильском)",
-        "tr": "турецком",
-        "ja": "японском"
-    }
-    readable_target_pr = lang_names_pr.get(target_lang, target_lang)
-
-    for chapter in chapters:
-        log_line = f"\n📘 Глава {chapter['chapter_number']} (книга {book_id}, язык {target_lang})"
-        print(log_line)
-        with open(log_path, "a", encoding="utf-8") as f:
-            f.write(log_line + "\n")
-
-        chapter_output = {
-            "chapter_number": chapter["chapter_number"], "paragraphs": []}
-
-        for paragraph in chapter["paragraphs"]:
-            paragraph_text = " ".join(
-                sentence["sentence_translation"] for sentence in paragraph["sentences"]).strip()
-            if not paragraph_text:
-                continue
-
-            processed_paragraphs += 1
-            percent = round((processed_paragraphs / total_paragraphs) * 100)
-            log(f"  ✂️ Абзац {paragraph['paragraph_number']} — {percent}%")
-            expected_answer = "true" if random.random() < 0.6 else "false"
-
-            if expected_answer == "true":
-                system_prompt = (
-                    f"Ты — помощник по чтению книг. Сформулируй верное утверждение по содержанию абзаца.\n\n"
-                    f"Утверждение должно:\n"
-                    f"- быть на {readable_target_pr} языке;\n"
-                    f"- отражать суть происходящего;\n"
-                    f"- быть легко проверяемым по содержанию;\n"
-                    f"- быть достаточно очевидным для вдумчивого читателя;\n"
-                    f"- быть коротким, до 7 слов;\n"
-                    f"- не содержать двусмысленностей.\n\n"
-                    f"Верни объект строго по схеме: {{ question: '...' }}"
-                )
-            else:
-                system_prompt = (
-                    f"Ты — помощник по чтению книг. Сформулируй заведомо ложное утверждение по содержанию абзаца.\n\n"
-                    f"Утверждение должно:\n"
-                    f"- быть на {readable_target_pr} языке;\n"
-                    f"- отражать вымышленный факт относительно происходящего;\n"
-                    f"- быть легко проверяемым по содержанию;\n"
-                    f"- быть достаточно очевидным для вдумчивого читателя;\n"
-                    f"- быть коротким, до 7 слов;\n"
-                    f"- не содержать двусмысленностей.\n\n"
-                    f"Верни объект строго по схеме: {{ question: '...' }}"
-                )
-
-            attempt = 0
-            max_attempts = 2
-            success = False
-            paragraph_output = {
-                "paragraph_number": paragraph["paragraph_number"],
-                "true_or_false": None
-            }
-
-            while attempt < max_attempts and not success:
-                attempt += 1
-                try:
-                    completion = client.beta.chat.completions.parse(
-                        model="gpt-4.1",
-                        messages=[
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": paragraph_text[:2000]}
-                        ],
-                        response_format=ParagraphTFQuestionOnly
-                    )
-                    q_obj = completion.choices[0].message.parsed
-
-                    cleaned_question = q_obj.question.strip()
-                    if cleaned_question.endswith("."):
-                        cleaned_question = cleaned_question[:-1]
-
-                    log(
-                        f"    🏅 Вопрос: {cleaned_question} [{expected_answer}]")
-
-                    paragraph_output["true_or_false"] = ParagraphTFItem(
-                        question=cleaned_question,
-                        answer=expected_answer
-                    ).model_dump()
-                    success = True
-                except Exception as e:
-                    log(
-                        f"    ⚠️ Ошибка (попытка {attempt}): {e} (книга {book_id}, абзац {paragraph['paragraph_number']}, язык {target_lang})")
-                    time.sleep(2)
-
-            chapter_output["paragraphs"].append(paragraph_output)
-
-        result["chapters"].append(chapter_output)
-
+    workers = concurrency.workers_for("tasks_true_or_false")
+    log(f"🧵 Абзацев: {len(work)}, потоков: {workers} (книга {book_id}, язык {target_lang})")
+    metrics.set_gauge("queue_depth", len(work),
+                      step=result_field, lang=target_lang)
+    progress = concurrency.Progress(len(work))
+
+    def process(item):
+        chapter_number, paragraph_number, paragraph_text, expected_answer = item
+        task = request_true_or_false(
+            client, paragraph_text, expected_answer, readable_target_pr, result_field, log,
+            where=f"книга {book_id}, абзац {paragraph_number}, язык {target_lang}")
+        log(f"  ✂️ Глава {chapter_number}, абзац {paragraph_number} — {progress.tick()}%")
+        metrics.inc("paragraphs_processed_total",
+                    step=result_field, lang=target_lang)
+        metrics.add_gauge("queue_depth", -1,
+                          step=result_field, lang=target_lang)
+        return chapter_number, {"paragraph_number": paragraph_number, "true_or_false": task}
+
+    outputs = concurrency.run_ordered(process, work, workers, name=result_field)
+    result = group_by_chapter(chapter_numbers, outputs)
+
+    metrics.set_gauge("queue_depth", 0, step=result_field, lang=target_lang)
     log(f"\n💾 Сохраняем результат в {result_field} для книги {book_id} и языка {target_lang}...")
-    supabase.table("books_translations").update({
-        result_field: json.dumps(result, ensure_ascii=False, indent=2)
-    }).eq("book_id", book_id).eq("language", target_lang).execute()
+    translation_storage.save_field(supabase, book_id, target_lang, result_field,
+                                   json.dumps(result, ensure_ascii=False, indent=2))
     log(f"✅ Вопросы по абзацам сохранены в {result_field}.")
 
     elapsed = time.time() - start_time
     minutes = int(elapsed // 60)
     seconds = int(elapsed % 60)
-    summary_msg = f"⏱ Время генерации вопросов: {minutes} мин {seconds} сек (книга {book_id}, язык {target_lang}, поле {result_field})"
-    print(summary_msg)
-    with open(log_path, "a", encoding="utf-8") as f:
-        f.write(summary_msg + "\n")
+    log(f"⏱ Время генерации вопросов: {minutes} мин {seconds} сек (книга {book_id}, язык {target_lang}, поле {result_field})")
 
 
 def add_how_to_translate_tasks(book_id: int, words_field: str, base_task_field: str, result_field: str, target_lang: str, source_lang: str):
@@ -176,14 +400,7 @@ def add_how_to_translate_tasks(book_id: int, words_field: str, base_task_field:
     supabase = get_supabase_client()
     client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-    log_dir = Path("logs")
-    log_dir.mkdir(exist_ok=True)
-    log_path = log_dir / f"log_translate_task_book_{book_id}_{target_lang}.txt"
-
-    def log(msg):
-        print(msg)
-        with open(log_path, "a", encoding="utf-8") as f:
-            f.write(msg + "\n")
+    log = logger.step_logger("translate_task", book_id, target_lang, step=result_field)
 
     existing = supabase.table("books_translations").select(result_field).eq(
         "book_id", book_id).eq("language", target_lang).single().execute()
@@ -198,125 +415,57 @@ def add_how_to_translate_tasks(book_id: int, words_field: str, base_task_field:
     tasks_response = supabase.table("books_translations").select(base_task_field).eq(
         "book_id", book_id).eq("language", target_lang).single().execute()
 
-    words_data = json.loads(words_response.data.get(words_field))
-    tasks_data = json.loads(tasks_response.data.get(base_task_field))
+    words_data = json_stream.LazyBook(translation_storage.load_field(
+        supabase, book_id, target_lang, words_field, words_response.data.get(words_field)))
+    tasks_data = json_stream.LazyBook(translation_storage.load_field(
+        supabase, book_id, target_lang, base_task_field, tasks_response.data.get(base_task_field)))
 
-    result = {"chapters": []}
-
-    total_paragraphs = sum(len(ch["paragraphs"])
-                           for ch in tasks_data["chapters"])
-    processed_paragraphs = 0
+    mode = word_frequency.candidate_mode()
+    index = None
+    if mode != "llm":
+        index = word_frequency.index_for(source_lang, words_field, target_lang, book_id, words_data)
+        log(f"🔤 Кандидаты по индексу частот: режим {mode}, книг в индексе {len(index.books)}")
 
+    chapter_numbers = []
+    work = []
     for ch_words, ch_tasks in zip(words_data["chapters"], tasks_data["chapters"]):
-        log(f"\n📘 Глава {ch_words['chapter_number']} (книга {book_id}, язык {target_lang})")
-        updated_paragraphs = []
-
+        chapter_numbers.append(ch_tasks["chapter_number"])
         for par_words, par_tasks in zip(ch_words["paragraphs"], ch_tasks["paragraphs"]):
-            processed_paragraphs += 1
-            percent = round((processed_paragraphs / total_paragraphs) * 100)
-
-            paragraph_number = par_words["paragraph_number"]
-            log(f"  ✂️ Абзац {paragraph_number} — {percent}%")
-
-            word_objects = []
-            word_lookup = {}
-
-            for sentence in par_words["sentences"]:
-                sid = sentence["sentence_number"]
-                for wid, word in enumerate(sentence.get("words", [])):
-                    word_id = f"{ch_words['chapter_number']}_{par_words['paragraph_number']}_{sid}_{wid + 1}"
-
-                    o = word["o"].strip()
-                    o_t = word["o_t"].strip()
-
-                    if len(o) > 22 or len(o_t) > 22:
-                        continue
-
-                    word_obj = {
-                        "id": word_id,
-                        "o": word["o"],
-                        "o_t": word["o_t"]
-                    }
-                    word_objects.append(word_obj)
-                    word_lookup[word_id] = word_obj
-
-            if len(word_objects) < 3:
-                log("    ⚠️ Недостаточно слов")
-                updated_paragraphs.append({
-                    "paragraph_number": paragraph_number,
-                    "how_to_translate": None
-                })
-                continue
-
-            input_json = json.dumps(word_objects, ensure_ascii=False, indent=2)
-
-            system_prompt = (
-                "Ты — преподаватель иностранного языка.\n\n"
-                "У тебя есть список слов с полями:\n"
-                "- id — идентификатор слова\n"
-                "- o — слово на изучаемом языке\n"
-                "- o_t — его перевод на язык ученика\n\n"
-                "Выбери одно менее частотное, специфичное для абзаца слово для проверки понимания учеником текста."
-                "Верни:\n"
-                "- correct_id — id этого слова\n"
-                "- incorrect1_id и incorrect2_id — id других слов из списка, схожих по типу, но отличающихся по значению\n\n"
-                "Верни строго JSON по схеме"
-            )
-
-            attempt = 0
-            max_attempts = 2
-            success = False
-            task_result = None
-
-            while attempt < max_attempts and not success:
-                attempt += 1
-                try:
-                    completion = client.beta.chat.completions.parse(
-                        model="gpt-4.1",
-                        messages=[
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": input_json[:3000]}
-                        ],
-                        response_format=HowToTranslateTask
-                    )
-                    result_obj = completion.choices[0].message.parsed
-
-                    try:
-                        correct_word = word_lookup[result_obj.correct_id]
-                        incorrect1 = word_lookup[result_obj.incorrect1_id]
-                        incorrect2 = word_lookup[result_obj.incorrect2_id]
-                    except KeyError as e:
-                        log(
-                            f"    ⚠️ Один из ID не найден в словаре: {e}. Пропускаем абзац.")
-                        break
-
-                    task_result = {
-                        "c": result_obj.correct_id,
-                        "i1": result_obj.incorrect1_id,
-                        "i2": result_obj.incorrect2_id
-                    }
-
-                    log(f"    ✅ Вопрос: Как переводится '{correct_word.get('o_t', '<???>')}' → {correct_word.get('o', '—')} | {incorrect1.get('o', '—')} | {incorrect2.get('o', '—')}")
-                    success = True
-                except Exception as e:
-                    log(f"    ❌ Ошибка GPT (попытка {attempt}): {e}")
-                    time.sleep(2)
-
-            updated_paragraphs.append({
-                "paragraph_number": paragraph_number,
-                "how_to_translate": task_result
-            })
-            time.sleep(1)
-
-        result["chapters"].append({
-            "chapter_number": ch_tasks["chapter_number"],
-            "paragraphs": updated_paragraphs
-        })
-
+            work.append((ch_tasks["chapter_number"], ch_words["chapter_number"], par_words))
+
+    workers = concurrency.workers_for("tasks_how_to_translate")
+    log(f"🧵 Абзацев: {len(work)}, потоков: {workers} (книга {book_id}, язык {target_lang})")
+    metrics.set_gauge("queue_depth", len(work),
+                      step=result_field, lang=target_lang)
+    progress = concurrency.Progress(len(work))
+
+    def process(item):
+        task_chapter_number, chapter_number, par_words = item
+        paragraph_number = par_words["paragraph_number"]
+        word_objects, word_lookup = how_to_translate_words(chapter_number, par_words)
+        word_objects, task_result = ranked_how_to_translate(
+            index, mode, chapter_number, par_words, word_objects, log)
+
+        if task_result is None and len(word_objects) < 3:
+            log(f"    ⚠️ Недостаточно слов (глава {chapter_number}, абзац {paragraph_number})")
+        elif task_result is None:
+            task_result = request_how_to_translate(
+                client, word_objects, word_lookup, result_field, log)
+
+        log(f"  ✂️ Глава {chapter_number}, абзац {paragraph_number} — {progress.tick()}%")
+        metrics.inc("paragraphs_processed_total",
+                    step=result_field, lang=target_lang)
+        metrics.add_gauge("queue_depth", -1,
+                          step=result_field, lang=target_lang)
+        return task_chapter_number, {"paragraph_number": paragraph_number, "how_to_translate": task_result}
+
+    outputs = concurrency.run_ordered(process, work, workers, name=result_field)
+    result = group_by_chapter(chapter_numbers, outputs)
+
+    metrics.set_gauge("queue_depth", 0, step=result_field, lang=target_lang)
     log(f"\n💾 Сохраняем результат в {result_field}...")
-    supabase.table("books_translations").update({
-        result_field: json.dumps(result, ensure_ascii=False, indent=2)
-    }).eq("book_id", book_id).eq("language", target_lang).execute()
+    translation_storage.save_field(supabase, book_id, target_lang, result_field,
+                                   json.dumps(result, ensure_ascii=False, indent=2))
     log(f"✅ Вопросы 'how to translate' с ID сохранены в поле {result_field}.")
 
     elapsed = time.time() - start_time
@@ -331,14 +480,7 @@ def add_two_words_tasks(book_id: int, words_field: str, base_task_field: str, re
     supabase = get_supabase_client()
     client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-    log_dir = Path("logs")
-    log_dir.mkdir(exist_ok=True)
-    log_path = log_dir / f"log_two_words_book_{book_id}_{target_lang}.txt"
-
-    def log(msg):
-        print(msg)
-        with open(log_path, "a", encoding="utf-8") as f:
-            f.write(msg + "\n")
+    log = logger.step_logger("two_words", book_id, target_lang, step=result_field)
 
     existing = supabase.table("books_translations").select(result_field).eq(
         "book_id", book_id).eq("language", target_lang).single().execute()
@@ -353,126 +495,224 @@ def add_two_words_tasks(book_id: int, words_field: str, base_task_field: str, re
     tasks_response = supabase.table("books_translations").select(base_task_field).eq(
         "book_id", book_id).eq("language", target_lang).single().execute()
 
-    words_data = json.loads(words_response.data.get(words_field))
-    tasks_data = json.loads(tasks_response.data.get(base_task_field))
-
-    result = {"chapters": []}
-
-    total_paragraphs = sum(len(ch["paragraphs"])
-                           for ch in tasks_data["chapters"])
-    processed_paragraphs = 0
-
-    lang_names_pr = {
-        "en": "английском",
-        "es": "испанском",
-        "fr": "французском",
-        "de": "немецком",
-        "ru": "русском",
-        "it": "итальянском",
-        "pt": "португальском (бразильском)",
-        "tr": "турецком",
-        "ja": "японском"
-    }
+    words_data = json_stream.LazyBook(translation_storage.load_field(
+        supabase, book_id, target_lang, words_field, words_response.data.get(words_field)))
+    tasks_data = json_stream.LazyBook(translation_storage.load_field(
+        supabase, book_id, target_lang, base_task_field, tasks_response.data.get(base_task_field)))
+
     readable_target_pr = lang_names_pr.get(target_lang, target_lang)
 
+    chapter_numbers = []
+    work = []
     for ch_words, ch_tasks in zip(words_data["chapters"], tasks_data["chapters"]):
-        log(f"\n📘 Глава {ch_words['chapter_number']} (книга {book_id}, язык {target_lang})")
-        updated_paragraphs = []
-
+        chapter_numbers.append(ch_tasks["chapter_number"])
         for par_words, par_tasks in zip(ch_words["paragraphs"], ch_tasks["paragraphs"]):
-            processed_paragraphs += 1
-            percent = round((processed_paragraphs / total_paragraphs) * 100)
-
-            paragraph_number = par_words["paragraph_number"]
-            log(f"  ✂️ Абзац {paragraph_number} — {percent}%")
-
-            candidates = []
-            word_lookup = {}
-
-            for sentence in par_words["sentences"]:
-                sid = sentence["sentence_number"]
-                for wid, word in enumerate(sentence.get("words", [])):
-                    word_id = f"{ch_words['chapter_number']}_{paragraph_number}_{sid}_{wid + 1}"
-                    o_t = word.get("o_t", "").strip()
-                    if len(o_t.split()) <= 2 and len(o_t) < 15:
-                        candidates.append({"id": word_id, "o_t": o_t})
-                        word_lookup[word_id] = o_t
-
-            if len(candidates) < 2:
-                log("    ⚠️ Недостаточно подходящих слов")
-                updated_paragraphs.append({
-                    "paragraph_number": paragraph_number,
-                    "two_words": None
-                })
-                continue
+            work.append((ch_tasks["chapter_number"], ch_words["chapter_number"], par_words))
+
+    workers = concurrency.workers_for("tasks_two_words")
+    log(f"🧵 Абзацев: {len(work)}, потоков: {workers} (книга {book_id}, язык {target_lang})")
+    metrics.set_gauge("queue_depth", len(work),
+                      step=result_field, lang=target_lang)
+    progress = concurrency.Progress(len(work))
+
+    def process(item):
+        task_chapter_number, chapter_number, par_words = item
+        paragraph_number = par_words["paragraph_number"]
+        candidates, word_lookup = two_words_candidates(chapter_number, par_words)
+
+        task_result = None
+        if len(candidates) < 2:
+            log(f"    ⚠️ Недостаточно подходящих слов (глава {chapter_number}, абзац {paragraph_number})")
+        else:
+            task_result = request_two_words(
+                client, candidates, word_lookup, readable_target_pr, result_field, log)
+
+        log(f"  ✂️ Глава {chapter_number}, абзац {paragraph_number} — {progress.tick()}%")
+        metrics.inc("paragraphs_processed_total",
+                    step=result_field, lang=target_lang)
+        metrics.add_gauge("queue_depth", -1,
+                          step=result_field, lang=target_lang)
+        return task_chapter_number, {"paragraph_number": paragraph_number, "two_words": task_result}
+
+    outputs = concurrency.run_ordered(process, work, workers, name=result_field)
+    result = group_by_chapter(chapter_numbers, outputs)
+
+    metrics.set_gauge("queue_depth", 0, step=result_field, lang=target_lang)
+    log(f"\n💾 Сохраняем результат в {result_field}...")
+    translation_storage.save_field(supabase, book_id, target_lang, result_field,
+                                   json.dumps(result, ensure_ascii=False, indent=2))
+    log(f"✅ Вопросы 'two words + invented' сохранены в поле {result_field}.")
+
+    elapsed = time.time() - start_time
+    minutes = int(elapsed // 60)
+    seconds = int(elapsed % 60)
+    log(f"⏱ Время генерации: {minutes} мин {seconds} сек (книга {book_id}, язык {target_lang}, поле {result_field})")
+
 
-            input_json = json.dumps(candidates, ensure_ascii=False, indent=2)
-
-            system_prompt = (
-                f"У тебя есть список слов из текста на {readable_target_pr} языке.\n"
-                f"Твоя задача:\n"
-                f"1. Найди два слова, которые похожи по типу (например, оба — действия или предметы), но разные по значению.\n"
-                f"2. Верни их id как id1 и id2.\n"
-                f"3. Придумай третье слово на {readable_target_pr} языке, похожее по типу, которое не подходит к теме текста.\n\n"
-                f"Верни строго JSON: {{ id1, id2, invented }}"
-            )
-
-            attempt = 0
-            max_attempts = 2
-            success = False
-            task_result = None
-
-            while attempt < max_attempts and not success:
-                attempt += 1
-                try:
+# === Все три задания за один запрос ===
+
+def generate_combined_tasks(book_id: int, words_field: str, tf_field: str, how_to_field: str, two_words_field: str,
+                            target_lang: str, source_lang: str):
+    """
+    true/false, how-to-translate и two-words одним запросом на абзац.
+    Каждое задание проверяется отдельно; не прошедшее проверку добирается отдельным запросом.
+    """
+    start_time = time.time()
+    supabase = get_supabase_client()
+    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    step_name = f"combined:{tf_field}"
+
+    log = logger.step_logger("tasks_combined", book_id, target_lang, step=step_name)
+
+    result_fields = {"true_or_false": tf_field, "how_to_translate": how_to_field, "two_words": two_words_field}
+    existing = supabase.table("books_translations").select(", ".join(result_fields.values())).eq(
+        "book_id", book_id).eq("language", target_lang).single().execute()
+    missing = {
+        task: field for task, field in result_fields.items()
+        if not (existing.data.get(field) and str(existing.data.get(field)).strip() not in {"", "{}", "[]"})
+    }
+    if not missing:
+        log(f"⏭ Пропускаем: поля {', '.join(result_fields.values())} уже заполнены для книги {book_id}, языка {target_lang}")
+        return
+
+    log(f"📥 Загружаем {words_field} для книги {book_id}, язык {target_lang}...")
+    words_response = supabase.table("books_translations").select(words_field).eq(
+        "book_id", book_id).eq("language", target_lang).single().execute()
+    if not words_response.data.get(words_field):
+        log(f"❌ Нет разбора слов (книга {book_id}, поле {words_field}, язык {target_lang}).")
+        return
+    words_data = json_stream.LazyBook(translation_storage.load_field(
+        supabase, book_id, target_lang, words_field, words_response.data.get(words_field)))
+
+    readable_target_pr = lang_names_pr.get(target_lang, target_lang)
+
+    # В общем запросе список слов нужен и для two words, поэтому индекс частот используется только в режиме local
+    index = None
+    if word_frequency.candidate_mode() == "local" and "how_to_translate" in missing:
+        index = word_frequency.index_for(source_lang, words_field, target_lang, book_id, words_data)
+        log(f"🔤 how to translate собирается локально, книг в индексе {len(index.books)}")
+
+    # Ответ (верное/ложное утверждение) выбираем заранее, чтобы не зависеть от порядка потоков
+    chapter_numbers = []
+    work = []
+    for chapter in words_data["chapters"]:
+        chapter_numbers.append(chapter["chapter_number"])
+        for paragraph in chapter["paragraphs"]:
+            work.append((chapter["chapter_number"], paragraph, "true" if random.random() < 0.6 else "false"))
+
+    workers = concurrency.workers_for("tasks_combined")
+    log(f"🧵 Абзацев: {len(work)}, потоков: {workers} (книга {book_id}, язык {target_lang})")
+    metrics.set_gauge("queue_depth", len(work),
+                      step=step_name, lang=target_lang)
+    progress = concurrency.Progress(len(work))
+
+    def process(item):
+        chapter_number, paragraph, expected_answer = item
+        paragraph_number = paragraph["paragraph_number"]
+
+        paragraph_text = " ".join(
+            sentence.get("sentence_translation", "") for sentence in paragraph["sentences"]).strip()
+        word_objects, word_lookup = how_to_translate_words(chapter_number, paragraph)
+        candidates, two_words_lookup = two_words_candidates(chapter_number, paragraph)
+
+        tasks_result = {"true_or_false": None, "how_to_translate": None, "two_words": None}
+        fallbacks = []
+        parsed = None
+        _, local_task = ranked_how_to_translate(index, "local", chapter_number, paragraph, word_objects, log)
+
+        if paragraph_text and len(word_objects) >= 3:
+            model = model_router.model_for("tasks_combined")
+            try:
+                concurrency.openai_limiter().acquire()
+                with metrics.track_request("openai", model, step_name):
                     completion = client.beta.chat.completions.parse(
-                        model="gpt-4.1",
-                        messages=[
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": input_json[:3000]}
-                        ],
-                        response_format=TwoWordsTask
+                        model=model,
+                        messages=prompts.messages(
+                            prompts.COMBINED_TASKS,
+                            prompts.combined_tasks_context(expected_answer, readable_target_pr),
+                            json.dumps({"text": paragraph_text[:2000], "words": word_objects},
+                                       ensure_ascii=False, indent=2)[:5000]),
+                        response_format=ParagraphTasks
                     )
-                    task = completion.choices[0].message.parsed
-
-                    if task.id1 not in word_lookup or task.id2 not in word_lookup:
-                        log(
-                            f"    ❌ Ошибка: ID {task.id1} или {task.id2} не найдены. Пропускаем абзац.")
-                        break
-
-                    o1 = word_lookup[task.id1]
-                    o2 = word_lookup[task.id2]
-
-                    task_result = {
-                        "id1": task.id1,
-                        "id2": task.id2,
-                        "invented": task.invented
-                    }
-
-                    log(f"    ✅ {task.id1}: {o1} | {task.id2}: {o2} → {task.invented}")
-                    success = True
-                except Exception as e:
-                    log(f"    ❌ Ошибка GPT (попытка {attempt}): {e}")
-                    time.sleep(2)
-
-            updated_paragraphs.append({
-                "paragraph_number": paragraph_number,
-                "two_words": task_result
-            })
-            time.sleep(1)
-
-        result["chapters"].append({
-            "chapter_number": ch_tasks["chapter_number"],
-            "paragraphs": updated_paragraphs
-        })
-
-    log(f"\n💾 Сохраняем результат в {result_field}...")
+                prompts.record_usage(step_name, model, completion)
+                parsed = completion.choices[0].message.parsed
+            except Exception as e:
+                log(f"    ❌ Ошибка GPT (общий запрос, абзац {paragraph_number}): {e}")
+                seconds = concurrency.retry_after(e)
+                if seconds is not None:
+                    concurrency.openai_limiter().backoff(seconds)
+
+        if parsed is not None:
+            try:
+                tasks_result["true_or_false"] = ParagraphTFItem(
+                    question=clean_question(parsed.true_or_false_question),
+                    answer=expected_answer
+                ).model_dump()
+                log(f"    🏅 Вопрос: {tasks_result['true_or_false']['question']} [{expected_answer}]")
+            except Exception as e:
+                log(f"    ⚠️ true/false не прошёл проверку: {e}")
+            try:
+                if local_task is None:
+                    tasks_result["how_to_translate"] = check_how_to_translate(parsed.how_to_translate, word_lookup)
+                    log(f"    ✅ Как переводится: {tasks_result['how_to_translate']}")
+            except Exception as e:
+                log(f"    ⚠️ how to translate не прошёл проверку: {e}")
+            try:
+                tasks_result["two_words"] = check_two_words(parsed.two_words, two_words_lookup)
+                log(f"    ✅ Два слова: {tasks_result['two_words']}")
+            except Exception as e:
+                log(f"    ⚠️ two words не прошёл проверку: {e}")
+        if local_task is not None:
+            tasks_result["how_to_translate"] = local_task
+
+        # Добираем отдельными запросами то, что не прошло проверку
+        if tasks_result["true_or_false"] is None and "true_or_false" in missing and paragraph_text:
+            fallbacks.append("true_or_false")
+            tasks_result["true_or_false"] = request_true_or_false(
+                client, paragraph_text, expected_answer, readable_target_pr, tf_field, log,
+                where=f"книга {book_id}, абзац {paragraph_number}, язык {target_lang}")
+        if tasks_result["how_to_translate"] is None and "how_to_translate" in missing and len(word_objects) >= 3:
+            fallbacks.append("how_to_translate")
+            tasks_result["how_to_translate"] = request_how_to_translate(
+                client, word_objects, word_lookup, how_to_field, log)
+        if tasks_result["two_words"] is None and "two_words" in missing and len(candidates) >= 2:
+            fallbacks.append("two_words")
+            tasks_result["two_words"] = request_two_words(
+                client, candidates, two_words_lookup, readable_target_pr, two_words_field, log)
+
+        log(f"  ✂️ Глава {chapter_number}, абзац {paragraph_number} — {progress.tick()}%")
+        metrics.inc("paragraphs_processed_total",
+                    step=step_name, lang=target_lang)
+        metrics.add_gauge("queue_depth", -1,
+                          step=step_name, lang=target_lang)
+        return chapter_number, paragraph_number, bool(paragraph_text), tasks_result, fallbacks
+
+    outputs = concurrency.run_ordered(process, work, workers, name=step_name)
+
+    fallbacks = {task: 0 for task in result_fields}
+    results = {}
+    for task in result_fields:
+        results[task] = group_by_chapter(chapter_numbers, [
+            (chapter_number, {"paragraph_number": paragraph_number, task: tasks_result[task]})
+            for chapter_number, paragraph_number, has_text, tasks_result, _ in outputs
+            # как и в generate_paragraph_tasks, абзацы без текста не получают true/false
+            if has_text or task != "true_or_false"
+        ])
+    for *_, paragraph_fallbacks in outputs:
+        for task in paragraph_fallbacks:
+            fallbacks[task] += 1
+
+    metrics.set_gauge("queue_depth", 0, step=step_name, lang=target_lang)
+    log(f"\n💾 Сохраняем результат в {', '.join(missing.values())}...")
     supabase.table("books_translations").update({
-        result_field: json.dumps(result, ensure_ascii=False, indent=2)
+        field: translation_storage.store_field(supabase, book_id, target_lang, field,
+                                               json.dumps(results[task], ensure_ascii=False, indent=2))
+        for task, field in missing.items()
     }).eq("book_id", book_id).eq("language", target_lang).execute()
-    log(f"✅ Вопросы 'two words + invented' сохранены в поле {result_field}.")
+    log(f"✅ Задания сохранены. Добрано отдельными запросами: " +
+        ", ".join(f"{task} — {count}" for task, count in fallbacks.items()))
 
     elapsed = time.time() - start_time
     minutes = int(elapsed // 60)
     seconds = int(elapsed % 60)
-    log(f"⏱ Время генерации: {minutes} мин {seconds} сек (книга {book_id}, язык {target_lang}, поле {result_field})")
+    log(f"⏱ Время генерации: {minutes} мин {seconds} сек (книга {book_id}, язык {target_lang}, поле {tf_field})")
@@ -8,6 +8,7 @@ from openai import OpenAI
 from typing import List
 from schemas.voice_schema import VoicePlan
 from schemas.chapter_schema import ChapterStructure
+from utils import metrics
 from utils.supabase_client import get_supabase_client
 
 
@@ -74,6 +75,8 @@ def generate_audio_for_chapters(
 
     structure = ChapterStructure.model_validate_json(text)
     api_key = os.getenv("ELEVENLABS_API_KEY")
+    elevenlabs_url = os.getenv(
+        "ELEVENLABS_BASE_URL", "https://api.elevenlabs.io").rstrip("/")
 
     export_path = Path("export/voices")
     export_path.mkdir(parents=True, exist_ok=True)
@@ -130,23 +133,26 @@ def generate_audio_for_chapters(
 
             success = False
             for attempt in range(2):
+                if attempt > 0:
+                    metrics.inc("retries_total", step=text_field)
                 try:
-                    response = requests.post(
-                        f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}/with-timestamps",
-                        headers={
-                            "xi-api-key": api_key,
-                            "accept": "application/json",
-                            "Content-Type": "application/json"
-                        },
-                        json={
-                            "text": text_to_speak,
-                            "previous_text": "",
-                            "next_text": "",
-                            "model_id": "eleven_multilingual_v2",
-                            "voice_settings": voice_settings,
-                            "timestamp_format": ["word"]
-                        }
-                    )
+                    with metrics.track_request("elevenlabs", "eleven_multilingual_v2", text_field):
+                        response = requests.post(
+                            f"{elevenlabs_url}/v1/text-to-speech/{voice_id}/with-timestamps",
+                            headers={
+                                "xi-api-key": api_key,
+                                "accept": "application/json",
+                                "Content-Type": "application/json"
+                            },
+                            json={
+                                "text": text_to_speak,
+                                "previous_text": "",
+                                "next_text": "",
+                                "model_id": "eleven_multilingual_v2",
+                                "voice_settings": voice_settings,
+                                "timestamp_format": ["word"]
+                            }
+                        )
                     elevenlabs_requests += 1
 
                     if response.status_code == 200:
@@ -171,6 +177,8 @@ def generate_audio_for_chapters(
                             print(
                                 f"⚠️ [{book_id}:{chapter.chapter_number}:{paragraph.paragraph_number}] Тайминги не найдены в ответе.")
 
+                        metrics.inc("paragraphs_processed_total",
+                                    step=text_field, lang="source")
                         success = True
                         break
                     else:
@@ -0,0 +1,94 @@
+import re
+from collections import deque
+
+# Поиск упоминаний персонажей по именам и прозвищам (names.main + additional_names) без LLM.
+# Имена превращаются в последовательности слов, по ним строится автомат Ахо — Корасик,
+# и весь текст проходится один раз: время линейно от длины книги и не зависит от числа имён.
+# Сравнение без учёта регистра, но имя с заглавной буквы совпадает только со словом с заглавной
+# («Роза» — не «роза»). Совпадения не переходят границу абзаца.
+
+_word = re.compile(r"\w+")
+MIN_ALIAS_LENGTH = 2
+
+
+def tokenize(text: str) -> list[str]:
+    return _word.findall(text)
+
+
+class AliasMatcher:
+    def __init__(self, aliases: dict):
+        """
+        aliases: id персонажа → список имён. Одно имя у нескольких персонажей — неоднозначное.
+        """
+        self.alias_ids = {}
+        for char_id, names in aliases.items():
+            for name in names:
+                tokens = tuple(token.casefold() for token in tokenize(name or ""))
+                if not tokens or len("".join(tokens)) < MIN_ALIAS_LENGTH:
+                    continue
+                entry = self.alias_ids.setdefault(tokens, {"ids": set(), "capital": True})
+                entry["ids"].add(char_id)
+                entry["capital"] = entry["capital"] and name.strip()[:1].isupper()
+
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for tokens in self.alias_ids:
+            node = 0
+            for token in tokens:
+                if token not in self._goto[node]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[node][token] = len(self._goto) - 1
+                node = self._goto[node][token]
+            self._out[node].append(tokens)
+        self._build_failure_links()
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and token not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(token, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find(self, text: str):
+        """
+        (имя как последовательность слов, ids персонажей) для всех совпадений в тексте, по порядку.
+        """
+        words = tokenize(text)
+        node = 0
+        for position, word in enumerate(words):
+            token = word.casefold()
+            while node and token not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(token, 0)
+            for tokens in self._out[node]:
+                entry = self.alias_ids[tokens]
+                if entry["capital"] and not words[position - len(tokens) + 1][:1].isupper():
+                    continue
+                yield tokens, entry["ids"]
+
+
+def first_mentions(aliases: dict, paragraphs: list[str]) -> tuple[dict, list]:
+    """
+    Один проход по абзацам (нумерация с 1).
+    Возвращает ({id: первый абзац по однозначному имени},
+                [(абзац, ids)] — неоднозначные имена, встреченные раньше однозначного у кого-то из ids).
+    """
+    matcher = AliasMatcher(aliases)
+    first = {}
+    ambiguous = []
+    for paragraph_num, text in enumerate(paragraphs, start=1):
+        for _, ids in matcher.find(text):
+            if len(ids) == 1:
+                first.setdefault(next(iter(ids)), paragraph_num)
+            elif any(char_id not in first for char_id in ids):
+                if not ambiguous or ambiguous[-1] != (paragraph_num, ids):
+                    ambiguous.append((paragraph_num, ids))
+    return first, ambiguous
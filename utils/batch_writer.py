@@ -0,0 +1,108 @@
+# Пакетная запись в Supabase для шагов, которые раньше писали по строке (персонажи, внешность, роли).
+# insert копятся и уходят одним запросом на пачку; update по ключу сливаются и уходят upsert-ом.
+# Для upsert нужна строка целиком (NOT NULL колонки), поэтому писатель помнит известное состояние строк:
+# что выбрали раньше (remember) и что вернули вставки. Так не нужен select перед каждым update.
+
+BATCH_SIZE = 200
+PAGE_SIZE = 1000
+
+
+class BatchWriter:
+    def __init__(self, supabase, table: str, key: str = "id", batch_size: int = BATCH_SIZE):
+        self.supabase = supabase
+        self.table = table
+        self.key = key
+        self.batch_size = batch_size
+        self.state = {}
+        self._inserts = []
+        self._updates = {}
+        self.inserted = []
+        self.requests = 0
+
+    def remember(self, rows: list[dict]):
+        """
+        Известные строки таблицы (из select или вставок): основа для upsert при update.
+        """
+        for row in rows:
+            self.state.setdefault(row[self.key], {}).update(row)
+
+    def insert(self, row: dict):
+        self._inserts.append(row)
+        if len(self._inserts) >= self.batch_size:
+            self._flush_inserts()
+
+    def update(self, key_value, changes: dict):
+        """
+        Изменения строки по ключу; несколько update одной строки сливаются в один.
+        """
+        self._updates.setdefault(key_value, {}).update(changes)
+        self.state.setdefault(key_value, {self.key: key_value}).update(changes)
+
+    def get(self, key_value) -> dict:
+        return self.state.get(key_value, {})
+
+    def _flush_inserts(self):
+        rows, self._inserts = self._inserts, []
+        for start in range(0, len(rows), self.batch_size):
+            data = self.supabase.table(self.table).insert(rows[start:start + self.batch_size]).execute().data or []
+            self.requests += 1
+            self.remember(data)
+            self.inserted.extend(data)
+
+    def _flush_updates(self):
+        updates, self._updates = self._updates, {}
+        full_rows = []
+        for key_value, changes in updates.items():
+            row = self.state.get(key_value, {})
+            if set(row) - {self.key}:
+                full_rows.append(dict(row))
+            else:
+                # строки нет в состоянии — обычный update по ключу
+                self.supabase.table(self.table).update(changes).eq(self.key, key_value).execute()
+                self.requests += 1
+        # PostgREST требует одинаковый набор колонок во всех строках пачки
+        by_columns = {}
+        for row in full_rows:
+            by_columns.setdefault(tuple(sorted(row)), []).append(row)
+        for rows in by_columns.values():
+            for start in range(0, len(rows), self.batch_size):
+                self.supabase.table(self.table).upsert(rows[start:start + self.batch_size],
+                                                       on_conflict=self.key).execute()
+                self.requests += 1
+
+    def flush(self) -> list[dict]:
+        """
+        Отправляет накопленное; возвращает строки, вставленные с прошлого flush (с id).
+        """
+        self._flush_inserts()
+        self._flush_updates()
+        inserted, self.inserted = self.inserted, []
+        return inserted
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+
+
+def select_in(supabase, table: str, columns: str, column: str, values: list, order: str = None) -> list[dict]:
+    """
+    select ... where column in values — пачками значений и страницами, вместо запроса на каждое значение.
+    """
+    rows = []
+    values = list(values)
+    for start in range(0, len(values), BATCH_SIZE):
+        chunk = values[start:start + BATCH_SIZE]
+        offset = 0
+        while True:
+            query = supabase.table(table).select(columns).in_(column, chunk)
+            if order:
+                query = query.order(order)
+            page = query.range(offset, offset + PAGE_SIZE - 1).execute().data or []
+            rows.extend(page)
+            if len(page) < PAGE_SIZE:
+                break
+            offset += PAGE_SIZE
+    return rows
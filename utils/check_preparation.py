@@ -1,4 +1,4 @@
-import json
+from utils import json_stream
 from utils.supabase_client import get_supabase_client
 
 
@@ -45,11 +45,9 @@ def check_before_translate(book_id: int):
     # Очистка text_by_chapters и text_by_chapters_simplified от форматирования
     def extract_text(json_text):
         try:
-            obj = json.loads(json_text)
             paragraphs = [
                 p["paragraph_content"]
-                for chapter in obj.get("chapters", [])
-                for p in chapter.get("paragraphs", [])
+                for _, p in json_stream.iter_paragraphs(json_text)
             ]
             return paragraphs
         except Exception as e:
@@ -72,10 +70,9 @@ def check_before_translate(book_id: int):
     # 4. Проверка совпадения количества абзацев по главам
     def get_paragraph_counts(json_text):
         try:
-            obj = json.loads(json_text)
             return {
                 chapter["chapter_number"]: len(chapter.get("paragraphs", []))
-                for chapter in obj.get("chapters", [])
+                for chapter in json_stream.iter_chapters(json_text)
             }
         except Exception as e:
             print(f"⚠️ Ошибка при разборе глав: {e}")
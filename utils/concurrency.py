@@ -0,0 +1,121 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+# Параллельная обработка абзацев внутри шага.
+# Темп запросов задаёт общий на процесс ограничитель (token bucket): вместо фиксированных пауз
+# запросы идут так быстро, как позволяет лимит, а после 429 все потоки ждут retry-after.
+
+DEFAULT_WORKERS = 4
+DEFAULT_OPENAI_RPM = 300
+
+_settings = None
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def settings() -> dict:
+    global _settings
+    if _settings is None:
+        try:
+            with open("config.yaml", "r", encoding="utf-8") as f:
+                _settings = (yaml.safe_load(f) or {}).get("concurrency", {}) or {}
+        except FileNotFoundError:
+            _settings = {}
+    return _settings
+
+
+def workers_for(step: str) -> int:
+    config = settings()
+    return int((config.get("workers") or {}).get(step, config.get("default_workers", DEFAULT_WORKERS)))
+
+
+class RateLimiter:
+    def __init__(self, per_minute: float, burst: int = None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or max(1, int(per_minute // 60) or 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Ждёт свободный токен (и конец паузы после 429).
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def backoff(self, seconds: float):
+        """
+        Пауза для всех потоков: сервис ответил 429.
+        """
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+def openai_limiter() -> RateLimiter:
+    with _limiters_lock:
+        if "openai" not in _limiters:
+            _limiters["openai"] = RateLimiter(settings().get("openai_rpm", DEFAULT_OPENAI_RPM))
+        return _limiters["openai"]
+
+
+def retry_after(error: Exception, default: float = 5.0) -> float | None:
+    """
+    Секунды ожидания, если ошибка — 429 от сервиса; иначе None.
+    """
+    if getattr(error, "status_code", None) != 429:
+        return None
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after", default))
+    except (TypeError, ValueError):
+        return default
+
+
+def pause_after_error(error: Exception, limiter: RateLimiter, default: float = 2.0):
+    """
+    После 429 притормаживает все потоки через ограничитель, после прочих ошибок — только текущий.
+    """
+    seconds = retry_after(error)
+    if seconds is not None:
+        limiter.backoff(seconds)
+    else:
+        time.sleep(default)
+
+
+class Progress:
+    def __init__(self, total: int):
+        self.total = max(total, 1)
+        self.done = 0
+        self._lock = threading.Lock()
+
+    def tick(self) -> int:
+        with self._lock:
+            self.done += 1
+            return round(self.done / self.total * 100)
+
+
+def run_ordered(fn, items: list, max_workers: int = DEFAULT_WORKERS, name: str = "worker") -> list:
+    """
+    fn(item) для всех элементов в пуле потоков; результаты в исходном порядке.
+    """
+    if max_workers <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name) as executor:
+        return list(executor.map(fn, items))
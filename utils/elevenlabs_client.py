@@ -8,7 +8,9 @@ import requests
 
 def get_elevenlabs_voices(source_lang: str):
     api_key = os.getenv("ELEVENLABS_API_KEY")
-    url = "https://api.elevenlabs.io/v1/voices"
+    base_url = os.getenv("ELEVENLABS_BASE_URL",
+                         "https://api.elevenlabs.io").rstrip("/")
+    url = f"{base_url}/v1/voices"
 
     headers = {
         "accept": "application/json",
@@ -0,0 +1,86 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from utils import image_jobs
+
+# Кеш уменьшенных референсов для images.edit (примеры стиля для мемов, портреты персонажей).
+# Раньше каждый запрос заново открывал, уменьшал и кодировал все картинки папки; теперь готовые
+# WEBP-байты хранятся на весь запуск процесса. Ключ — (путь, mtime, размер файла, сторона): перерисованный
+# файл получает новый ключ, старая запись вытесняется. Объём ограничен images.reference_cache_mb (LRU).
+
+DEFAULT_CACHE_MB = 64
+REFERENCE_SIDE = 512
+
+_cache = OrderedDict()
+_cache_bytes = 0
+_hits = 0
+_misses = 0
+_lock = threading.Lock()
+
+
+def _limit_bytes() -> int:
+    return int(float(image_jobs.settings().get("reference_cache_mb", DEFAULT_CACHE_MB)) * 1024 * 1024)
+
+
+def _resize(path, side: int) -> bytes:
+    with Image.open(path) as img:
+        w, h = img.size
+        if w >= h:
+            new_w, new_h = side, int(h * (side / w))
+        else:
+            new_h, new_w = side, int(w * (side / h))
+        img = img.resize((new_w, new_h))
+        buf = io.BytesIO()
+        img.save(buf, format="WEBP")
+        img.close()
+    return buf.getvalue()
+
+
+def resized_bytes(path, side: int = REFERENCE_SIDE) -> bytes:
+    """
+    WEBP-байты картинки, уменьшенной до side по большей стороне (из кеша, если файл не менялся).
+    """
+    global _cache_bytes, _hits, _misses
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, side)
+    with _lock:
+        data = _cache.get(key)
+        if data is not None:
+            _cache.move_to_end(key)
+            _hits += 1
+            return data
+        _misses += 1
+
+    data = _resize(path, side)
+
+    with _lock:
+        if key not in _cache:
+            _cache[key] = data
+            _cache_bytes += len(data)
+            while _cache_bytes > _limit_bytes() and len(_cache) > 1:
+                _, evicted = _cache.popitem(last=False)
+                _cache_bytes -= len(evicted)
+    return data
+
+
+def reference_buffer(path, side: int = REFERENCE_SIDE) -> tuple:
+    """
+    ("image.webp", BytesIO) для параметра image в client.images.edit; у каждого вызова свой буфер.
+    """
+    return ("image.webp", io.BytesIO(resized_bytes(path, side)))
+
+
+def info() -> dict:
+    with _lock:
+        return {"entries": len(_cache), "bytes": _cache_bytes, "hits": _hits, "misses": _misses}
+
+
+def clear():
+    global _cache_bytes
+    with _lock:
+        _cache.clear()
+        _cache_bytes = 0
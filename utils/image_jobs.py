@@ -0,0 +1,137 @@
+import os
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+from utils import concurrency, metrics
+
+# Общий исполнитель заданий на изображения (иллюстрации, иконки глав, портреты персонажей).
+# У gpt-image-1 свой лимит — изображений в минуту, поэтому и ограничитель свой, отдельный от чата;
+# пул потоков один на процесс книги, шаги только отправляют в него задания.
+# Задание не должно само отправлять задания в пул: при занятых потоках оно ждало бы себя.
+# Файлы пишутся через временный файл и os.replace — прерванный запуск не оставляет битых .webp.
+
+DEFAULT_WORKERS = 4
+DEFAULT_IMAGES_PER_MINUTE = 20
+DEFAULT_RETRIES = 3
+DEFAULT_MODEL = "gpt-image-1"
+
+_settings = None
+_limiter = None
+_executor = None
+_lock = threading.Lock()
+
+
+def settings() -> dict:
+    global _settings
+    if _settings is None:
+        try:
+            with open("config.yaml", "r", encoding="utf-8") as f:
+                _settings = (yaml.safe_load(f) or {}).get("images", {}) or {}
+        except FileNotFoundError:
+            _settings = {}
+    return _settings
+
+
+def image_limiter() -> concurrency.RateLimiter:
+    global _limiter
+    with _lock:
+        if _limiter is None:
+            per_minute = settings().get("images_per_minute", DEFAULT_IMAGES_PER_MINUTE)
+            # первые workers заданий стартуют сразу, дальше — в темпе лимита
+            _limiter = concurrency.RateLimiter(per_minute, burst=int(settings().get("workers", DEFAULT_WORKERS)))
+        return _limiter
+
+
+def executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, int(settings().get("workers", DEFAULT_WORKERS))),
+                                           thread_name_prefix="images")
+        return _executor
+
+
+def run_ordered(fn, items: list):
+    """
+    fn(item) для всех элементов в общем пуле; результаты выдаются по одному в исходном порядке,
+    пока остальные задания ещё выполняются. fn сама ловит свои ошибки.
+    """
+    futures = [executor().submit(fn, item) for item in items]
+    for future in futures:
+        yield future.result()
+
+
+# === Запросы ===
+
+def _retryable(error: Exception) -> bool:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        return type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+    return status == 429 or status >= 500
+
+
+def _rewind(value):
+    if hasattr(value, "seek"):
+        value.seek(0)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _rewind(item)
+
+
+def _call(method, step: str, kwargs: dict):
+    model = kwargs.setdefault("model", DEFAULT_MODEL)
+    retries = int(settings().get("retries", DEFAULT_RETRIES))
+    limiter = image_limiter()
+    for attempt in range(1, retries + 1):
+        limiter.acquire()
+        try:
+            with metrics.track_request("openai", model, step):
+                return method(**kwargs)
+        except Exception as e:
+            if attempt == retries or not _retryable(e):
+                raise
+            metrics.inc("retries_total", step=step)
+            print(f"   🔁 [{step}] Ошибка генерации изображения, повтор {attempt + 1}/{retries}: {e}")
+            concurrency.pause_after_error(e, limiter)
+            # файлы для edit уже прочитаны первым запросом
+            for value in kwargs.values():
+                _rewind(value)
+
+
+def generate(client, step: str, **kwargs):
+    """
+    client.images.generate через общий ограничитель, с метриками и повтором после 429 / 5xx.
+    """
+    return _call(client.images.generate, step, kwargs)
+
+
+def edit(client, step: str, **kwargs):
+    """
+    client.images.edit — как generate.
+    """
+    return _call(client.images.edit, step, kwargs)
+
+
+# === Файлы ===
+
+def write_atomic(path, data, format: str = None) -> Path:
+    """
+    Записывает bytes или PIL.Image (формат — по расширению) через временный файл рядом и os.replace.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        if isinstance(data, (bytes, bytearray)):
+            tmp.write_bytes(data)
+        else:
+            from PIL import Image
+            data.save(tmp, format=format or Image.registered_extensions()[path.suffix.lower()])
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return path
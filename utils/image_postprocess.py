@@ -0,0 +1,87 @@
+import io
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from utils import image_jobs
+
+# Постобработка сгенерированных изображений (контраст иллюстраций, экспозиция иконок глав, уменьшение).
+# Кривые считаются один раз как таблицы на 256 значений и применяются через Image.point — без копии
+# картинки во float32 (1024×1024 RGB: 12 МБ float32 против 3 МБ uint8). Таблицы совпадают с прежним
+# расчётом бит в бит. Работа идёт в отдельном небольшом пуле (images.postprocess_workers): потоки
+# генерации отдают байты и возвращаются к запросам, а декодирование и ресайз не занимают их.
+
+DEFAULT_WORKERS = 2
+EXPORT_SIDE = 512
+
+_executor = None
+_lock = threading.Lock()
+
+
+def executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            workers = int(image_jobs.settings().get("postprocess_workers", DEFAULT_WORKERS))
+            _executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="postprocess")
+        return _executor
+
+
+def submit(fn, *args):
+    """
+    fn(*args) в пуле постобработки; возвращает Future.
+    """
+    return executor().submit(fn, *args)
+
+
+# === Таблицы ===
+
+@lru_cache(maxsize=None)
+def contrast_lut(gain: float = 4.0) -> tuple:
+    """
+    S-кривая clip((x - 0.5) * gain + 0.5) — та же арифметика float32, что и раньше над всей картинкой.
+    """
+    x = np.arange(256, dtype=np.float32) / 255.0
+    return tuple((np.clip((x - 0.5) * gain + 0.5, 0, 1) * 255).astype(np.uint8).tolist())
+
+
+@lru_cache(maxsize=None)
+def brightness_lut(factor: float) -> tuple:
+    """
+    Как ImageEnhance.Brightness(image).enhance(factor) для непрозрачных пикселей.
+    """
+    return tuple(min(255, int(i * factor)) for i in range(256))
+
+
+def apply_lut(image: Image.Image, lut: tuple) -> Image.Image:
+    """
+    Таблица на каждый цветовой канал; альфа-канал не меняется.
+    """
+    bands = image.getbands()
+    table = []
+    for band in bands:
+        table.extend(range(256) if band == "A" else lut)
+    return image.point(table)
+
+
+# === Обработка ===
+
+def enhance_contrast(image_bytes: bytes, side: int = EXPORT_SIDE) -> Image.Image:
+    """
+    Крутая S-кривая (экстремальный контраст) и ресайз до side×side — иллюстрации предметов.
+    """
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image = apply_lut(image.convert("RGB"), contrast_lut())
+    return image.resize((side, side), Image.LANCZOS)
+
+
+def expose_icon(image_bytes: bytes, factor: float = 1.10, side: int = EXPORT_SIDE) -> Image.Image:
+    """
+    Экспозиция +10% и ресайз до side×side — иконки глав.
+    """
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image = apply_lut(image.convert("RGBA"), brightness_lut(factor))
+    return image.resize((side, side), Image.LANCZOS)
@@ -0,0 +1,96 @@
+import numpy as np
+import yaml
+from PIL import Image
+
+# Дешёвая локальная проверка сгенерированных изображений перед оценкой vision-моделью.
+# Явный брак (пустой кадр, плоская заливка без деталей, пустой вырез персонажа) отклоняется без запроса;
+# соответствие описанию локально не проверить, поэтому остальное по-прежнему уходит в модель.
+# image_quality.trust_local_pass — иллюстрации с уверенно хорошими метриками принимаются без модели.
+
+THUMB_SIDE = 256
+BLANK_TOLERANCE = 10      # отклонение яркости от фона, которое ещё считается фоном
+EDGE_GRADIENT = 32        # перепад яркости соседних пикселей, который считается краем
+OPAQUE_ALPHA = 16
+
+DEFAULTS = {
+    "min_contrast": 0.04,          # стандартное отклонение яркости, 0..1
+    "max_blank_ratio": 0.98,       # доля пикселей цвета фона
+    "min_edge_density": 0.002,     # доля пикселей на краях
+    "min_opaque_ratio": 0.03,      # доля непрозрачных пикселей выреза персонажа
+    "good_contrast": 0.2,
+    "good_blank_ratio": 0.9,
+    "good_edge_density": 0.02,
+}
+
+_settings = None
+
+
+def settings() -> dict:
+    global _settings
+    if _settings is None:
+        try:
+            with open("config.yaml", "r", encoding="utf-8") as f:
+                _settings = (yaml.safe_load(f) or {}).get("image_quality", {}) or {}
+        except FileNotFoundError:
+            _settings = {}
+    return _settings
+
+
+def _limit(name: str) -> float:
+    return float(settings().get(name, DEFAULTS[name]))
+
+
+def measure(image: Image.Image) -> dict:
+    """
+    Метрики на уменьшенной копии: контраст, доля фона, плотность краёв, доля непрозрачных пикселей.
+    Фон — медиана яркости по рамке кадра; у выреза с прозрачностью считаются только непрозрачные пиксели.
+    """
+    thumb = image.convert("RGBA").resize((THUMB_SIDE, THUMB_SIDE), Image.BILINEAR)
+    pixels = np.asarray(thumb, dtype=np.int16)
+    alpha = pixels[..., 3]
+    opaque = alpha > OPAQUE_ALPHA
+    luma = np.asarray(thumb.convert("L"), dtype=np.int16)
+
+    if opaque.all():
+        border = np.concatenate([luma[0], luma[-1], luma[:, 0], luma[:, -1]])
+        blank = np.abs(luma - int(np.median(border))) <= BLANK_TOLERANCE
+    else:
+        blank = ~opaque
+    visible = luma[opaque] if opaque.any() else luma.flatten()
+
+    edges = (np.abs(np.diff(luma, axis=0))[:, :-1] > EDGE_GRADIENT) | \
+            (np.abs(np.diff(luma, axis=1))[:-1, :] > EDGE_GRADIENT)
+
+    return {
+        "contrast": float(visible.std() / 255.0),
+        "blank_ratio": float(blank.mean()),
+        "edge_density": float(edges.mean()),
+        "opaque_ratio": float(opaque.mean()),
+    }
+
+
+def screen(image: Image.Image, cutout: bool = False) -> tuple[str, list, dict]:
+    """
+    ("reject" | "pass" | "check", причины, метрики).
+    reject — явный брак; pass — уверенно хорошие метрики (только при trust_local_pass, не для вырезов);
+    check — решает vision-модель.
+    """
+    metrics = measure(image)
+    reasons = []
+    if metrics["contrast"] < _limit("min_contrast"):
+        reasons.append(f"нет контраста ({metrics['contrast']:.3f})")
+    if metrics["blank_ratio"] > _limit("max_blank_ratio"):
+        reasons.append(f"пустой кадр ({metrics['blank_ratio']:.0%} фона)")
+    if metrics["edge_density"] < _limit("min_edge_density"):
+        reasons.append(f"нет деталей (края {metrics['edge_density']:.3%})")
+    if cutout and metrics["opaque_ratio"] < _limit("min_opaque_ratio"):
+        reasons.append(f"пустой вырез ({metrics['opaque_ratio']:.1%} непрозрачного)")
+    if reasons:
+        return "reject", reasons, metrics
+
+    if not cutout and settings().get("trust_local_pass", False) \
+            and metrics["contrast"] >= _limit("good_contrast") \
+            and metrics["blank_ratio"] <= _limit("good_blank_ratio") \
+            and metrics["edge_density"] >= _limit("good_edge_density"):
+        return "pass", [], metrics
+    return "check", [], metrics
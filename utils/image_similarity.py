@@ -0,0 +1,131 @@
+import numpy as np
+import yaml
+from PIL import Image
+
+# Локальная проверка, что иконки соседних глав нарисованы в одном стиле (вместо запроса к LLM на каждую главу).
+# Сюжет у глав разный, поэтому сравнивается не содержание, а то, что задаёт стиль:
+# палитра (гистограмма HSV), тон (яркость, контраст, насыщенность) и фактура — распределение энергии
+# по частотам DCT (плоская заливка против штриховки и мелких деталей). Итог — расстояние 0..1.
+# Рядом с порогом решение можно отдать LLM (icon_similarity.llm_tiebreak).
+# pHash (тот же DCT, 64 бита) ловит почти одинаковые картинки подряд — icon_similarity.duplicate_max_bits.
+
+THUMB_SIDE = 64
+HASH_SIDE = 32
+HASH_BITS_SIDE = 8
+HUE_BINS, SAT_BINS, VAL_BINS = 8, 4, 4
+FREQUENCY_BANDS = 6
+WEIGHTS = {"palette": 0.2, "tone": 0.4, "texture": 0.4}  # палитра меняется с настроением главы, вес меньше
+
+DEFAULT_THRESHOLD = 0.45
+DEFAULT_TIEBREAK_MARGIN = 0.05
+
+_settings = None
+_dct_matrices = {}
+
+
+def settings() -> dict:
+    global _settings
+    if _settings is None:
+        try:
+            with open("config.yaml", "r", encoding="utf-8") as f:
+                _settings = (yaml.safe_load(f) or {}).get("icon_similarity", {}) or {}
+        except FileNotFoundError:
+            _settings = {}
+    return _settings
+
+
+# === Признаки ===
+
+def _dct_matrix(n: int) -> np.ndarray:
+    if n not in _dct_matrices:
+        k = np.arange(n)[:, None]
+        i = np.arange(n)[None, :]
+        matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+        matrix[0] /= np.sqrt(2.0)
+        _dct_matrices[n] = matrix
+    return _dct_matrices[n]
+
+
+def _dct2(pixels: np.ndarray) -> np.ndarray:
+    matrix = _dct_matrix(pixels.shape[0])
+    return matrix @ pixels @ matrix.T
+
+
+def _gray(image: Image.Image, side: int) -> np.ndarray:
+    return np.asarray(image.convert("L").resize((side, side), Image.LANCZOS), dtype=np.float64)
+
+
+def phash(image: Image.Image) -> np.ndarray:
+    """
+    Перцептивный хеш: 64 бита — низкие частоты DCT выше медианы.
+    """
+    low = _dct2(_gray(image, HASH_SIDE))[:HASH_BITS_SIDE, :HASH_BITS_SIDE].flatten()
+    return low > np.median(low[1:])
+
+
+def hamming(hash_a: np.ndarray, hash_b: np.ndarray) -> int:
+    return int(np.count_nonzero(hash_a != hash_b))
+
+
+def style_features(image: Image.Image) -> dict:
+    thumb = image.convert("RGB").resize((THUMB_SIDE, THUMB_SIDE), Image.LANCZOS)
+    hsv = np.asarray(thumb.convert("HSV"), dtype=np.float64)
+    palette, _ = np.histogramdd(
+        hsv.reshape(-1, 3) / 256.0,
+        bins=(HUE_BINS, SAT_BINS, VAL_BINS), range=((0, 1), (0, 1), (0, 1)))
+    palette = palette.flatten() / palette.sum()
+
+    gray = np.asarray(thumb.convert("L"), dtype=np.float64)
+    tone = np.array([gray.mean(), gray.std(), hsv[..., 1].mean(), hsv[..., 1].std()]) / 255.0
+
+    spectrum = np.abs(_dct2(gray))
+    spectrum[0, 0] = 0.0  # средняя яркость уже в тоне
+    radius = np.add.outer(np.arange(THUMB_SIDE), np.arange(THUMB_SIDE))
+    bands = np.array([spectrum[(radius * FREQUENCY_BANDS) // (2 * THUMB_SIDE - 1) == band].sum()
+                      for band in range(FREQUENCY_BANDS)])
+    texture = bands / max(bands.sum(), 1e-9)
+
+    return {"palette": palette, "tone": tone, "texture": texture}
+
+
+def style_distance(image_a: Image.Image, image_b: Image.Image) -> dict:
+    """
+    Расстояния 0..1 по палитре, тону и фактуре и их взвешенная сумма ("total").
+    """
+    a, b = style_features(image_a), style_features(image_b)
+    distances = {
+        "palette": 1.0 - float(np.minimum(a["palette"], b["palette"]).sum()),
+        "tone": float(np.abs(a["tone"] - b["tone"]).mean() * 2),
+        "texture": float(np.abs(a["texture"] - b["texture"]).sum() / 2),
+    }
+    distances = {key: min(1.0, value) for key, value in distances.items()}
+    distances["total"] = sum(WEIGHTS[key] * distances[key] for key in WEIGHTS)
+    return distances
+
+
+# === Решение ===
+
+def check_style(prev_image: Image.Image, curr_image: Image.Image, tiebreak=None) -> bool:
+    """
+    True, если иконки похожи по стилю. tiebreak(prev, curr) -> bool — проверка LLM для пограничных случаев,
+    вызывается только при icon_similarity.llm_tiebreak.
+    """
+    config = settings()
+    duplicate_max_bits = int(config.get("duplicate_max_bits", 0))
+    if duplicate_max_bits > 0:
+        bits = hamming(phash(prev_image), phash(curr_image))
+        if bits <= duplicate_max_bits:
+            print(f"🔎 Иконка почти совпадает с предыдущей (pHash: {bits} бит)")
+            return False
+
+    threshold = float(config.get("threshold", DEFAULT_THRESHOLD))
+    margin = float(config.get("tiebreak_margin", DEFAULT_TIEBREAK_MARGIN))
+    distances = style_distance(prev_image, curr_image)
+    total = distances["total"]
+    print(f"🔎 Сравнение иконок: {total:.3f} (палитра {distances['palette']:.2f}, "
+          f"тон {distances['tone']:.2f}, фактура {distances['texture']:.2f}; порог {threshold})")
+
+    if tiebreak is not None and config.get("llm_tiebreak", False) and abs(total - threshold) <= margin:
+        print("🔎 Пограничный случай — проверка через LLM")
+        return tiebreak(prev_image, curr_image)
+    return total <= threshold
@@ -0,0 +1,107 @@
+import re
+import json
+
+# Потоковый разбор JSON-полей книг ({"chapters": [...]}) из books / books_translations.
+# json.loads строит граф объектов всей книги сразу; здесь главы разбираются по одной по мере обхода,
+# и пройденная глава освобождается, если её не держит вызывающий код. Для шагов, которые только обходят
+# структуру (экспорт, задания, цели глав, проверка подготовки): строка поля в памяти остаётся, граф — нет.
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"[ \t\n\r]*")
+
+
+def _skip(text: str, pos: int) -> int:
+    return _whitespace.match(text, pos).end()
+
+
+def _expect(text: str, pos: int, char: str) -> int:
+    if pos >= len(text) or text[pos] != char:
+        found = text[pos] if pos < len(text) else "конец строки"
+        raise ValueError(f"JSON: ожидался '{char}' в позиции {pos}, найдено '{found}'")
+    return pos + 1
+
+
+def iter_items(text: str, key: str = "chapters"):
+    """
+    Элементы массива text[key] верхнего уровня — по одному, без разбора остального массива.
+    Остальные ключи объекта разбираются и отбрасываются. Нет ключа — пустой обход.
+    """
+    pos = _expect(text, _skip(text, 0), "{")
+    pos = _skip(text, pos)
+    if text[pos:pos + 1] == "}":
+        return
+
+    while True:
+        name, pos = _decoder.raw_decode(text, pos)
+        pos = _skip(text, _expect(text, _skip(text, pos), ":"))
+
+        if name == key:
+            pos = _skip(text, _expect(text, pos, "["))
+            if text[pos:pos + 1] == "]":
+                pos += 1
+            else:
+                while True:
+                    item, pos = _decoder.raw_decode(text, pos)
+                    yield item
+                    pos = _skip(text, pos)
+                    if text[pos:pos + 1] == "]":
+                        pos += 1
+                        break
+                    pos = _skip(text, _expect(text, pos, ","))
+        else:
+            _, pos = _decoder.raw_decode(text, pos)
+
+        pos = _skip(text, pos)
+        if text[pos:pos + 1] == "}":
+            return
+        pos = _skip(text, _expect(text, pos, ","))
+
+
+def iter_chapters(text: str):
+    if not text:
+        return iter(())
+    return iter_items(text, "chapters")
+
+
+def iter_paragraphs(text: str):
+    """
+    (chapter_number, paragraph) по всей книге.
+    """
+    for chapter in iter_chapters(text):
+        for paragraph in chapter.get("paragraphs", []):
+            yield chapter["chapter_number"], paragraph
+
+
+class LazyBook:
+    """
+    Замена json.loads(text) для кода, который только обходит data["chapters"]:
+    каждое обращение к "chapters" — новый ленивый обход глав.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def __getitem__(self, key: str):
+        if not self.text:
+            return iter(())
+        return iter_items(self.text, key)
+
+
+class ChapterCursor:
+    """
+    Поиск глав по номеру в поле, идущем параллельно основному обходу (упрощённый текст, задания).
+    Поле читается вперёд только до нужной главы; пропущенные главы ждут своей очереди, выданные — забываются.
+    """
+
+    def __init__(self, text: str):
+        self._chapters = iter_chapters(text)
+        self._pending = {}
+
+    def get(self, chapter_number: int) -> dict:
+        if chapter_number in self._pending:
+            return self._pending.pop(chapter_number)
+        for chapter in self._chapters:
+            if chapter.get("chapter_number") == chapter_number:
+                return chapter
+            self._pending[chapter.get("chapter_number")] = chapter
+        return {}
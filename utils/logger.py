@@ -0,0 +1,215 @@
+import os
+import json
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from pathlib import Path
+
+import yaml
+
+# Общий логгер шагов пайплайна.
+# Сообщения уходят в очередь, а фоновый поток процесса пишет их в файлы logs/log_<имя>_book_<id>_<язык>.txt:
+# файл открывается один раз за книгу, запись буферизуется и сбрасывается на диск, когда очередь простаивает;
+# в конце книги её файлы закрываются (close_files), чтобы воркер пула не копил открытые дескрипторы.
+# Формат (текст или JSONL) и ротация — в секции logging config.yaml.
+
+LOG_DIR = "logs"
+DEFAULT_FLUSH_SECONDS = 1.0
+
+_settings = None
+_lock = threading.Lock()
+_state = {"pid": None, "queue": None, "listener": None, "router": None}
+
+
+def settings() -> dict:
+    global _settings
+    if _settings is None:
+        try:
+            with open("config.yaml", "r", encoding="utf-8") as f:
+                _settings = (yaml.safe_load(f) or {}).get("logging", {}) or {}
+        except FileNotFoundError:
+            _settings = {}
+    return _settings
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps({
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "step": record.step,
+            "book_id": record.book_id,
+            "lang": record.lang,
+            "pid": record.process,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }, ensure_ascii=False)
+
+
+class _BufferedFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Файловый обработчик без flush после каждой записи: сбрасывает буфер по команде роутера.
+    """
+
+    def flush(self):
+        pass
+
+    def flush_now(self):
+        self.acquire()
+        try:
+            if self.stream and hasattr(self.stream, "flush"):
+                self.stream.flush()
+        finally:
+            self.release()
+
+
+class _FileRouter(logging.Handler):
+    """
+    Раскладывает записи по файлам (record.log_file); файлы книги открыты, пока их не закроет close_book.
+    """
+
+    def __init__(self):
+        super().__init__()
+        config = settings()
+        self.jsonl = config.get("format", "text") == "jsonl"
+        self.max_bytes = int(config.get("max_bytes", 0) or 0)
+        self.backup_count = int(config.get("backup_count", 3))
+        self.handlers = {}
+        self.books = {}  # book_id → файлы книги
+
+    def handler_for(self, log_file: str, book_id=None) -> _BufferedFileHandler:
+        handler = self.handlers.get(log_file)
+        if handler is None:
+            path = Path(log_file)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            handler = _BufferedFileHandler(path, maxBytes=self.max_bytes, backupCount=self.backup_count,
+                                           encoding="utf-8")
+            handler.setFormatter(_JsonFormatter() if self.jsonl else logging.Formatter("%(message)s"))
+            self.handlers[log_file] = handler
+            self.books.setdefault(book_id, set()).add(log_file)
+        return handler
+
+    def emit(self, record: logging.LogRecord):
+        self.handler_for(record.log_file, record.book_id).handle(record)
+
+    def flush_all(self):
+        for handler in list(self.handlers.values()):
+            handler.flush_now()
+
+    def close_book(self, book_id):
+        for log_file in self.books.pop(book_id, ()):
+            handler = self.handlers.pop(log_file, None)
+            if handler is not None:
+                handler.close()
+
+    def close(self):
+        for handler in self.handlers.values():
+            handler.close()
+        self.handlers.clear()
+        self.books.clear()
+        super().close()
+
+
+class _IdleFlushListener(logging.handlers.QueueListener):
+    """
+    QueueListener, который сбрасывает файлы на диск, если новых записей нет flush_seconds.
+    """
+
+    def __init__(self, log_queue, router: _FileRouter, flush_seconds: float):
+        super().__init__(log_queue, router)
+        self.router = router
+        self.flush_seconds = flush_seconds
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, timeout=self.flush_seconds)
+            except queue.Empty:
+                self.router.flush_all()
+
+
+def _ensure_started() -> queue.SimpleQueue:
+    with _lock:
+        # после fork очередь и поток родителя недоступны — заводим свои
+        if _state["pid"] != os.getpid():
+            _state.update(pid=os.getpid(), queue=queue.SimpleQueue(), listener=None, router=_FileRouter())
+        if _state["listener"] is None:
+            flush_seconds = float(settings().get("flush_seconds", DEFAULT_FLUSH_SECONDS))
+            _state["listener"] = _IdleFlushListener(_state["queue"], _state["router"], flush_seconds)
+            _state["listener"].start()
+        return _state["queue"]
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def __init__(self):
+        super().__init__(None)
+
+    def enqueue(self, record):
+        _ensure_started().put_nowait(record)
+
+    def prepare(self, record):
+        # сообщение уже готово: форматирование и копирование записи здесь не нужны
+        return record
+
+
+def _logger() -> logging.Logger:
+    log = logging.getLogger("clew.steps")
+    log.propagate = False
+    log.setLevel(logging.INFO)
+    if not log.handlers:
+        log.addHandler(_QueueHandler())
+    return log
+
+
+def step_logger(name: str, book_id: int, lang: str = None, step: str = None):
+    """
+    log(msg): печатает сообщение и ставит его в очередь записи в logs/log_<name>_book_<id>[_<язык>].txt(.jsonl).
+    """
+    suffix = f"_{lang}" if lang else ""
+    extension = "jsonl" if settings().get("format", "text") == "jsonl" else "txt"
+    log_file = os.path.join(LOG_DIR, f"log_{name}_book_{book_id}{suffix}.{extension}")
+    extra = {"log_file": log_file, "book_id": book_id, "lang": lang, "step": step or name}
+    target = _logger()
+
+    def log(msg, level: int = logging.INFO):
+        print(msg)
+        target.log(level, msg, extra=extra)
+
+    return log
+
+
+def flush():
+    """
+    Дописывает очередь и сбрасывает все файлы на диск (конец книги, выход процесса).
+    """
+    with _lock:
+        listener = _state["listener"]
+        if listener is None or _state["pid"] != os.getpid():
+            return
+        listener.stop()
+        _state["listener"] = None
+        _state["router"].flush_all()
+
+
+def close_files(book_id: int):
+    """
+    Дописывает очередь и закрывает файлы логов книги (конец книги в долгоживущем воркере пула).
+    """
+    flush()
+    with _lock:
+        # поток записи остановлен flush(), новые записи книги откроют файлы заново
+        if _state["router"] is not None and _state["pid"] == os.getpid():
+            _state["router"].close_book(book_id)
+
+
+def shutdown():
+    flush()
+    with _lock:
+        if _state["router"] is not None and _state["pid"] == os.getpid():
+            _state["router"].close()
+            _state["router"] = _FileRouter()
+
+
+atexit.register(shutdown)
@@ -0,0 +1,280 @@
+import time
+import bisect
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Живые метрики пайплайна в формате Prometheus (text exposition 0.0.4).
+# В пуле воркеров каждый процесс пересылает события в очередь главного процесса,
+# а главный процесс агрегирует их и отдаёт на http://127.0.0.1:<port>/metrics.
+
+METRIC_PREFIX = "clew_"
+
+# Границы корзин гистограмм задержек (секунды)
+DEFAULT_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+# Сколько последних наблюдений хранить для расчёта перцентилей
+QUANTILE_WINDOW = 1024
+QUANTILES = (0.5, 0.9, 0.99)
+
+HELP = {
+    "paragraphs_processed_total": "Обработанные абзацы по шагу и языку",
+    "paragraphs_failed_total": "Абзацы, которые не удалось обработать",
+    "retries_total": "Повторные попытки запросов по шагу",
+    "requests_total": "Запросы к внешним сервисам по сервису, модели и статусу",
+    "requests_in_flight": "Запросы к внешним сервисам, выполняющиеся сейчас",
+    "request_seconds": "Длительность запросов к внешним сервисам",
+    "queue_depth": "Абзацы, ожидающие обработки в текущем шаге",
+    "books_processed_total": "Книги, обработка которых завершена",
+    "model_escalations_total": "Переходы на более сильную модель после неудачной проверки ответа",
+    "translation_memory_hits_total": "Предложения, взятые из памяти переводов (точные и нечёткие совпадения)",
+    "prompt_tokens_total": "Входные токены запросов к LLM по шагу и модели",
+    "cached_prompt_tokens_total": "Входные токены, взятые из кеша префикса промпта провайдера",
+}
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.window = deque(maxlen=QUANTILE_WINDOW)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+        self.window.append(value)
+
+    def quantile(self, q: float) -> float:
+        if not self.window:
+            return 0.0
+        ordered = sorted(self.window)
+        idx = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+        return ordered[idx]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, dict[tuple, float]] = {}
+        self._gauges: dict[str, dict[tuple, float]] = {}
+        self._histograms: dict[str, dict[tuple, _Histogram]] = {}
+
+    def apply(self, kind: str, name: str, value: float, labels: dict):
+        key = _label_key(labels)
+        with self._lock:
+            if kind == "inc":
+                series = self._counters.setdefault(name, {})
+                series[key] = series.get(key, 0.0) + value
+            elif kind == "gauge_set":
+                self._gauges.setdefault(name, {})[key] = value
+            elif kind == "gauge_add":
+                series = self._gauges.setdefault(name, {})
+                series[key] = series.get(key, 0.0) + value
+            elif kind == "observe":
+                series = self._histograms.setdefault(name, {})
+                series.setdefault(key, _Histogram()).observe(value)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                full = METRIC_PREFIX + name
+                lines.append(f"# HELP {full} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {full} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(
+                        f"{full}{_format_labels(key)} {_format_value(value)}")
+
+            for name, series in sorted(self._gauges.items()):
+                full = METRIC_PREFIX + name
+                lines.append(f"# HELP {full} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {full} gauge")
+                for key, value in sorted(series.items()):
+                    lines.append(
+                        f"{full}{_format_labels(key)} {_format_value(value)}")
+
+            for name, series in sorted(self._histograms.items()):
+                full = METRIC_PREFIX + name
+                lines.append(f"# HELP {full} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {full} histogram")
+                for key, hist in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(hist.buckets + (float("inf"),), hist.counts):
+                        cumulative += count
+                        le = (("le", _format_value(bound)),)
+                        lines.append(
+                            f"{full}_bucket{_format_labels(key, le)} {cumulative}")
+                    lines.append(
+                        f"{full}_sum{_format_labels(key)} {_format_value(hist.total)}")
+                    lines.append(
+                        f"{full}_count{_format_labels(key)} {hist.count}")
+
+                # Перцентили по скользящему окну последних наблюдений
+                window_name = f"{full}_window"
+                lines.append(
+                    f"# HELP {window_name} {HELP.get(name, name)} (последние {QUANTILE_WINDOW} наблюдений)")
+                lines.append(f"# TYPE {window_name} summary")
+                for key, hist in sorted(series.items()):
+                    for q in QUANTILES:
+                        qlabel = (("quantile", _format_value(q)),)
+                        lines.append(
+                            f"{window_name}{_format_labels(key, qlabel)} {_format_value(hist.quantile(q))}")
+                    lines.append(
+                        f"{window_name}_sum{_format_labels(key)} {_format_value(sum(hist.window))}")
+                    lines.append(
+                        f"{window_name}_count{_format_labels(key)} {len(hist.window)}")
+
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# В воркерах пула — очередь в главный процесс; в главном процессе — None
+_forward_queue = None
+
+
+def _record(kind: str, name: str, value: float, labels: dict):
+    if _forward_queue is not None:
+        try:
+            _forward_queue.put_nowait((kind, name, value, labels))
+        except Exception:
+            # Метрики не должны ломать обработку книги
+            pass
+    else:
+        registry.apply(kind, name, value, labels)
+
+
+def inc(name: str, value: float = 1, **labels):
+    _record("inc", name, value, labels)
+
+
+def set_gauge(name: str, value: float, **labels):
+    _record("gauge_set", name, value, labels)
+
+
+def add_gauge(name: str, value: float, **labels):
+    _record("gauge_add", name, value, labels)
+
+
+def observe(name: str, value: float, **labels):
+    _record("observe", name, value, labels)
+
+
+@contextmanager
+def track_request(service: str, model: str = "", step: str = ""):
+    """
+    Оборачивает запрос к внешнему сервису: in-flight, счётчик по статусу и длительность.
+    """
+    add_gauge("requests_in_flight", 1, service=service, model=model)
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        add_gauge("requests_in_flight", -1, service=service, model=model)
+        inc("requests_total", service=service, model=model, step=step, status=status)
+        observe("request_seconds", elapsed, service=service, model=model)
+
+
+# === Обмен между процессами ===
+
+def init_worker(metrics_queue):
+    """Инициализатор multiprocessing.Pool: метрики воркера уходят в главный процесс."""
+    global _forward_queue
+    _forward_queue = metrics_queue
+
+
+def start_collector(metrics_queue) -> threading.Thread:
+    def drain():
+        while True:
+            try:
+                event = metrics_queue.get()
+            except (EOFError, OSError):
+                return
+            if event is None:
+                return
+            registry.apply(*event)
+
+    thread = threading.Thread(
+        target=drain, name="metrics-collector", daemon=True)
+    thread.start()
+    return thread
+
+
+# === HTTP-эндпоинт ===
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header(
+            "Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Не засоряем вывод пайплайна логами каждого опроса
+        pass
+
+
+def start_metrics_server(port: int = 9108, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(
+        target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    print(f"📈 Метрики доступны на http://{host}:{port}/metrics")
+    return server
+
+
+def setup_from_config(config: dict):
+    """
+    Запускает эндпоинт, если metrics.enabled в config.yaml.
+    Возвращает очередь для воркеров пула (или None, если метрики выключены).
+    """
+    import multiprocessing
+
+    metrics_config = config.get("metrics", {}) or {}
+    if not metrics_config.get("enabled"):
+        return None
+
+    port = int(metrics_config.get("port", 9108))
+    start_metrics_server(port)
+    metrics_queue = multiprocessing.Queue()
+    start_collector(metrics_queue)
+    return metrics_queue
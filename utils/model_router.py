@@ -0,0 +1,67 @@
+import yaml
+
+from utils import metrics
+
+# Выбор модели OpenAI по шагу пайплайна.
+# Каждый шаг получает уровень качества из секции models в config.yaml (fast / standard / strong),
+# а если ответ не прошёл проверку (не совпало число предложений, неизвестный ID слова, сломанная схема),
+# следующая попытка идёт на модели уровнем выше.
+
+DEFAULT_TIERS = {
+    "fast": "gpt-4.1-nano",
+    "standard": "gpt-4.1-mini",
+    "strong": "gpt-4.1",
+}
+DEFAULT_ORDER = ["fast", "standard", "strong"]
+DEFAULT_TIER = "strong"
+
+_config = None
+
+
+def _models_config() -> dict:
+    global _config
+    if _config is None:
+        try:
+            with open("config.yaml", "r", encoding="utf-8") as f:
+                _config = (yaml.safe_load(f) or {}).get("models", {}) or {}
+        except FileNotFoundError:
+            _config = {}
+    return _config
+
+
+def models_for(step: str) -> list[str]:
+    """
+    Цепочка моделей шага: с уровня шага до самого сильного.
+    """
+    config = _models_config()
+    tiers = {**DEFAULT_TIERS, **(config.get("tiers") or {})}
+    order = config.get("escalation") or DEFAULT_ORDER
+    tier = (config.get("steps") or {}).get(step, config.get("default_tier", DEFAULT_TIER))
+
+    if tier not in order:
+        raise ValueError(f"❌ Неизвестный уровень модели '{tier}' для шага {step}")
+    return [tiers[name] for name in order[order.index(tier):]]
+
+
+def model_for(step: str, level: int = 0) -> str:
+    chain = models_for(step)
+    return chain[min(level, len(chain) - 1)]
+
+
+def escalate(step: str, level: int) -> int:
+    """
+    Повышает уровень модели после ответа, не прошедшего проверку.
+    """
+    chain = models_for(step)
+    if level + 1 < len(chain):
+        print(f"    ⬆️ {step}: ответ {chain[level]} не прошёл проверку, переходим на {chain[level + 1]}")
+        metrics.inc("model_escalations_total", step=step, model=chain[level + 1])
+    return level + 1
+
+
+def is_validation_error(error: Exception) -> bool:
+    """
+    Ошибки разбора ответа — повод для эскалации; сетевые ошибки и 429 — нет.
+    ValidationError из pydantic и JSONDecodeError — наследники ValueError.
+    """
+    return isinstance(error, (ValueError, KeyError))
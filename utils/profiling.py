@@ -0,0 +1,149 @@
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+from pathlib import Path
+from collections import Counter
+from contextlib import contextmanager
+
+# Профилирование шагов пайплайна (python main.py --profile).
+# Папка профиля передаётся воркерам пула через переменную окружения, для каждого шага пишутся:
+#   <шаг>.prof / <шаг>.txt  — cProfile и топ функций по cumtime
+#   stacks_<pid>.collapsed  — стеки сэмплирующего профайлера (wall-clock, все потоки процесса)
+# В конце запуска стеки сливаются в flamegraph.collapsed (flamegraph.pl, speedscope, inferno).
+
+PROFILE_DIR_ENV = "CLEW_PROFILE_DIR"
+PROFILE_INTERVAL_ENV = "CLEW_PROFILE_INTERVAL_MS"
+
+DEFAULT_INTERVAL_MS = 10
+TOP_FUNCTIONS = 40
+
+_local = threading.local()
+
+
+def enable(base_dir: str = "profiles", interval_ms: int = DEFAULT_INTERVAL_MS) -> Path:
+    """
+    Включает профилирование для текущего процесса и всех его воркеров.
+    """
+    target_dir = Path(base_dir) / time.strftime("%Y%m%d-%H%M%S")
+    target_dir.mkdir(parents=True, exist_ok=True)
+    os.environ[PROFILE_DIR_ENV] = str(target_dir.resolve())
+    os.environ[PROFILE_INTERVAL_ENV] = str(interval_ms)
+    print(f"🔬 Профилирование включено, результаты: {target_dir}")
+    return target_dir
+
+
+def profile_dir() -> Path | None:
+    value = os.getenv(PROFILE_DIR_ENV)
+    return Path(value) if value else None
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    # ';' разделяет кадры в collapsed-формате, пробелы допустимы
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+class _StackSampler:
+    def __init__(self, root: str, interval: float):
+        self.root = root
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                name = names.get(thread_id, "")
+                if thread_id == own_id or name.startswith("metrics-"):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.reverse()
+                thread_part = [] if name == "MainThread" else [f"[{name}]"]
+                self.stacks[";".join([self.root] + thread_part + stack)] += 1
+
+
+@contextmanager
+def profile_step(step: str, book_id=None, lang=None):
+    """
+    Профилирует шаг, если включён --profile; иначе ничего не делает.
+    Вложенные шаги попадают в профиль внешнего.
+    """
+    target_dir = profile_dir()
+    if target_dir is None or getattr(_local, "active", False):
+        yield
+        return
+
+    parts = [str(p) for p in (f"book_{book_id}" if book_id is not None else None, lang, step) if p]
+    name = "_".join(parts)
+    interval = int(os.getenv(PROFILE_INTERVAL_ENV, DEFAULT_INTERVAL_MS)) / 1000
+
+    profiler = cProfile.Profile()
+    sampler = _StackSampler(";".join(parts), interval)
+    _local.active = True
+    started = time.perf_counter()
+    sampler.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        sampler.stop()
+        _local.active = False
+        elapsed = time.perf_counter() - started
+
+        try:
+            target_dir.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(target_dir / f"{name}.prof")
+            with open(target_dir / f"{name}.txt", "w", encoding="utf-8") as f:
+                f.write(f"{name}: {elapsed:.2f} сек\n\n")
+                stats = pstats.Stats(profiler, stream=f)
+                stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+            # Дописываем стеки в файл процесса: воркеры не пишут в один файл одновременно
+            with open(target_dir / f"stacks_{os.getpid()}.collapsed", "a", encoding="utf-8") as f:
+                for stack, count in sampler.stacks.items():
+                    f.write(f"{stack} {count}\n")
+            print(f"🔬 Профиль шага {name}: {elapsed:.2f} сек → {target_dir / (name + '.prof')}")
+        except Exception as e:
+            # Профилирование не должно ломать обработку книги
+            print(f"⚠️ Не удалось сохранить профиль шага {name}: {e}")
+
+
+def merge_collapsed(target_dir: Path | None = None) -> Path | None:
+    """
+    Сливает стеки всех процессов в один flamegraph.collapsed.
+    """
+    target_dir = target_dir or profile_dir()
+    if target_dir is None or not target_dir.exists():
+        return None
+
+    merged = Counter()
+    for path in sorted(target_dir.glob("stacks_*.collapsed")):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                if stack and count.isdigit():
+                    merged[stack] += int(count)
+
+    output = target_dir / "flamegraph.collapsed"
+    with open(output, "w", encoding="utf-8") as f:
+        for stack, count in sorted(merged.items()):
+            f.write(f"{stack} {count}\n")
+    print(f"🔥 Стеки для flamegraph: {output} (flamegraph.pl {output.name} > flamegraph.svg)")
+    return output
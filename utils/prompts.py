@@ -0,0 +1,182 @@
+import threading
+
+from utils import metrics
+
+# Шаблоны промптов для частых запросов (на каждый абзац) и раскладка сообщений под кеш префикса.
+# OpenAI кеширует начало запроса (от 1024 токенов) и берёт закешированные входные токены дешевле,
+# а отвечает на них быстрее — но только если префикс совпадает символ в символ. Поэтому порядок всегда один:
+#   system — неизменные инструкции шага: без названия книги, языков, предыдущего текста;
+#   user   — контекст, общий для многих запросов подряд (книга, языки, список персонажей);
+#   user   — данные конкретного запроса (абзац, слова, предыдущий текст).
+# Сколько входных токенов пришло из кеша, считается по шагам: usage.prompt_tokens_details.cached_tokens.
+
+_usage = {}
+_lock = threading.Lock()
+
+
+def messages(instructions: str, context: str = "", payload: str = "", background: str = "") -> list[dict]:
+    """
+    [system: инструкции] + [user: контекст, если есть] + [user: фон запроса, если есть] + [user: данные запроса].
+    Данные запроса — всегда последнее сообщение, отдельно от фона (например, предыдущего текста).
+    """
+    result = [{"role": "system", "content": instructions}]
+    if context:
+        result.append({"role": "user", "content": context})
+    if background:
+        result.append({"role": "user", "content": background})
+    result.append({"role": "user", "content": payload})
+    return result
+
+
+def context(**fields) -> str:
+    """
+    Блок контекста «Поле: значение» по строке на поле; пустые поля пропускаются.
+    """
+    return "\n".join(f"{name}: {value}" for name, value in fields.items() if value not in (None, ""))
+
+
+# === Учёт кеша ===
+
+def record_usage(step: str, model: str, completion):
+    """
+    Входные токены и токены из кеша ответа — в метрики и в сводку процесса по шагу.
+    """
+    usage = getattr(completion, "usage", None)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+
+    metrics.inc("prompt_tokens_total", prompt_tokens, step=step, model=model)
+    metrics.inc("cached_prompt_tokens_total", cached_tokens, step=step, model=model)
+    with _lock:
+        totals = _usage.setdefault(step, [0, 0, 0])
+        totals[0] += 1
+        totals[1] += prompt_tokens
+        totals[2] += cached_tokens
+
+
+def usage_report(reset: bool = True) -> str:
+    """
+    Сводка по шагам: запросы, входные токены, доля из кеша. reset — начать счёт заново (следующая книга).
+    """
+    with _lock:
+        rows = sorted(_usage.items())
+        if reset:
+            _usage.clear()
+    if not rows:
+        return ""
+    lines = ["🧾 Кеш промптов по шагам:"]
+    for step, (requests, prompt_tokens, cached_tokens) in rows:
+        share = cached_tokens / prompt_tokens if prompt_tokens else 0.0
+        lines.append(f"   {step}: запросов {requests}, входных токенов {prompt_tokens}, "
+                     f"из кеша {cached_tokens} ({share:.0%})")
+    return "\n".join(lines)
+
+
+# === Перевод предложений ===
+
+TRANSLATE_SENTENCES = (
+    "Ты переводчик художественной литературы.\n"
+    "Книга, язык оригинала и целевой язык указаны в контексте.\n"
+    "Переведи каждое предложение в текущем абзаце.\n"
+    "Перевод должен быть легким и естественным.\n"
+    "Сохрани JSON-структуру, добавив 'sentence_translation' рядом с 'sentence_original'.\n"
+    "Не удаляй и не объединяй предложения.\n"
+    "Предыдущий текст, если он дан отдельным сообщением, нужен только для контекста — его НЕ переводить.\n"
+    "Переводи только JSON абзаца из последнего сообщения."
+)
+
+
+def translate_sentences_context(title: str, author: str, source_lang: str, target_lang: str) -> str:
+    return context(**{"Книга": f"'{title}'", "Автор": author,
+                      "Язык оригинала": source_lang, "Целевой язык": target_lang})
+
+
+def previous_text_background(previous_text: str) -> str:
+    if not previous_text:
+        return ""
+    return f"Предыдущий текст для контекста (НЕ переводить):\n{previous_text}"
+
+
+# === Разбор слов ===
+
+WORDS = (
+    "Ты — языковой помощник. Язык оригинала и язык перевода указаны в контексте.\n"
+    "Очисти каждый текст в 'sentence_original' от знаков препинания и разбей на минимальные по длине смысловые и грамматические группы, сохраняя вместе фразовые глаголы, идиомы, неделимые выражения.\n"
+    "Не объединяй слова в одну группу, если их можно разделить без изменения смысла и неверного толкования по отдельности.\n"
+    "Для каждой группы укажи:\n"
+    "- 'o': оригинал на языке оригинала;\n"
+    "- 'o_t': дословный перевод на язык перевода, а для артиклей, частиц, вспомогательных и служебных слов - их роль в предложении;\n"
+    "- 'l': лемма на языке оригинала (если отличается от `o`; если нет — оставь `\"\"`);\n"
+    "- 'l_t': перевод леммы на язык перевода (если отличается от `o_t`; если нет — оставь `\"\"`).\n"
+    "Ответ строго по заданной структуре (response_format), где 'SentenceWordList' соответствует 'sentence_original'."
+)
+
+WORDS_SEGMENTATION = (
+    "Ты — языковой помощник. Язык текста указан в контексте.\n"
+    "Очисти каждый текст в 'sentence_original' от знаков препинания и разбей на минимальные по длине смысловые и грамматические группы, сохраняя вместе фразовые глаголы, идиомы, неделимые выражения.\n"
+    "Не объединяй слова в одну группу, если их можно разделить без изменения смысла и неверного толкования по отдельности.\n"
+    "Для каждой группы укажи:\n"
+    "- 'o': оригинал на языке текста;\n"
+    "- 'l': лемма на языке текста (если отличается от `o`; если нет — оставь `\"\"`).\n"
+    "Ответ строго по заданной структуре (response_format), где 'SentenceSegments' соответствует 'sentence_original'."
+)
+
+WORDS_TRANSLATION = (
+    "Ты — языковой помощник. Язык оригинала и язык перевода указаны в контексте.\n"
+    "Для каждого предложения дан готовый список групп слов 'words' (id, 'o' — оригинал, 'l' — лемма или `\"\"`).\n"
+    "Не меняй группы и не пропускай их. Для каждого id верни:\n"
+    "- 'o_t': дословный перевод группы в контексте предложения на язык перевода, а для артиклей, частиц, вспомогательных и служебных слов - их роль в предложении;\n"
+    "- 'l_t': перевод леммы на язык перевода (если 'l' пустая или перевод совпадает с `o_t` — оставь `\"\"`).\n"
+    "Ответ строго по заданной структуре (response_format)."
+)
+
+
+def words_context(source: str, target: str = "") -> str:
+    return context(**{"Язык оригинала": source, "Язык перевода": target})
+
+
+# === Персонажи ===
+
+CHARACTERS_IN_PARAGRAPH = (
+    "Найди в абзаце персонажей, которые являются ключевыми для сюжета книги. Малозначимых второстепенных персонажей пропускай."
+    "Если таких персонажей нет, верни пустой список по схеме CharactersInParagraph.\n"
+    "Не учитывай описание, если оно носит субъективный характер, например, если кто-то называет персонажа глупым или умницей."
+    "Для каждого найденного персонажа верни:\n"
+    "1. Объект Names с основным именем и всеми известными прозвищами/именами (измени основное имя и добавь дополнительные, если в абзаце появилось уточнение, или персонаж преобразился в нового персонаж).\n"
+    "2. Appearance с цитатой, касающейся внешности в этом абзаце. Пиши только выжимку из оригинального текста (например, желтое платье, красивый, высокий). Не возвращай деталей, которые не упоминаются в абзаце.\n"
+    "Если персонаж новый, верни id=0. Вернуть список объектов, строго по схеме CharactersInParagraph.\n"
+    "Книга и текущий список персонажей указаны в контексте, абзац — в последнем сообщении."
+)
+
+MENTION_DISAMBIGUATION = (
+    "Несколько персонажей книги носят общее имя. Кто из этих персонажей действительно упоминается в абзаце? "
+    "Верни их id по схеме MentionedCharacters (пустой список, если никто).\n"
+    "Книга и персонажи указаны в контексте, абзац — в последнем сообщении."
+)
+
+
+# === Задания по абзацу ===
+
+COMBINED_TASKS = (
+    "Ты — преподаватель иностранного языка и помощник по чтению книг.\n"
+    "На входе абзац книги в переводе ('text') и список слов абзаца с полями id, o (слово на изучаемом языке), "
+    "o_t (перевод на язык ученика). Язык ученика и вид утверждения указаны в контексте.\n\n"
+    "Составь три задания по абзацу:\n"
+    "1. true_or_false_question — утверждение указанного вида по содержанию абзаца на языке ученика: "
+    "до 7 слов, легко проверяемое, без двусмысленностей.\n"
+    "2. how_to_translate — correct_id: id менее частотного, специфичного для абзаца слова; "
+    "incorrect1_id и incorrect2_id: id других слов из списка, схожих по типу, но отличающихся по значению.\n"
+    "3. two_words — id1 и id2: два слова из списка с коротким переводом (до двух слов), похожие по типу, "
+    "но разные по значению; invented: придуманное слово на языке ученика того же типа, "
+    "которое не подходит к теме текста.\n\n"
+    "Используй только id из списка. Верни строго JSON по схеме."
+)
+
+
+def combined_tasks_context(expected_answer: str, readable_target_pr: str) -> str:
+    statement = "верное" if expected_answer == "true" else "заведомо ложное (вымышленный факт)"
+    return context(**{"Язык ученика (утверждение и придуманное слово)": f"на {readable_target_pr} языке",
+                      "Утверждение": statement})
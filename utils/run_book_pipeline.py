@@ -1,10 +1,11 @@
-def process_book_id(book_id: int):
+def run_book(book_id: int):
     import os
     import yaml
     import spacy
     import subprocess
     import multiprocessing
     from dotenv import load_dotenv
+    from utils import metrics, profiling, vocabulary_store, prompts
     from utils.supabase_client import load_book_text, save_formatted_text, get_supabase_client
     from utils.supabase_client import check_supabase_connection
     from utils.elevenlabs_client import get_elevenlabs_voices
@@ -26,6 +27,7 @@ def process_book_id(book_id: int):
     target_langs = [lang.strip() for lang in config["target_lang"].split(",")]
     steps_enabled = config["steps"]
     max_paragraphs = config.get("options", {}).get("max_voiced_paragraphs", -1)
+    words_two_phase = config.get("options", {}).get("words_two_phase", False)
 
     def ensure_spacy_model(lang_code: str):
         lang_map = {
@@ -50,7 +52,8 @@ def process_book_id(book_id: int):
     supabase = get_supabase_client()
     check_supabase_connection()
 
-    nlp = ensure_spacy_model(source_lang)
+    with profiling.profile_step("spacy_load", book_id):
+        nlp = ensure_spacy_model(source_lang)
 
     print(f"\n=== Обработка книги ID {book_id} ===")
 
@@ -68,196 +71,273 @@ def process_book_id(book_id: int):
     print(f"[{book_id}] ✅ Найдена книга: {title} — {author}")
 
     if steps_enabled.get("preprocess"):
-        book_text = load_book_text(book_id)
-        formatted = preprocess.run(book_text, source_lang, max_chars)
-        save_formatted_text(book_id, formatted)
+        with profiling.profile_step("preprocess", book_id):
+            book_text = load_book_text(book_id)
+            formatted = preprocess.run(book_text, source_lang, max_chars)
+            save_formatted_text(book_id, formatted)
 
     if steps_enabled.get("sentence_split"):
-        preprocess.split_into_sentences(book_id, source_lang, max_chars)
+        with profiling.profile_step("sentence_split", book_id):
+            preprocess.split_into_sentences(book_id, source_lang, max_chars)
 
     if steps_enabled.get("paragraph_split"):
-        preprocess.split_into_paragraphs(book_id, source_lang, max_chars)
+        with profiling.profile_step("paragraph_split", book_id):
+            preprocess.split_into_paragraphs(book_id, source_lang, max_chars)
 
     if steps_enabled.get("paragraph_split_manual"):
-        preprocess.verify_separated_text(book_id, source_lang, nlp)
+        with profiling.profile_step("paragraph_split_manual", book_id):
+            preprocess.verify_separated_text(book_id, source_lang, nlp)
 
     if steps_enabled.get("chapter_split"):
-        preprocess.group_into_chapters(book_id, source_lang, max_chars)
+        with profiling.profile_step("chapter_split", book_id):
+            preprocess.group_into_chapters(book_id, source_lang, max_chars)
 
     if steps_enabled.get("simplify_text"):
-        preprocess.simplify_text_for_beginners(book_id, source_lang, max_chars)
+        with profiling.profile_step("simplify_text", book_id):
+            preprocess.simplify_text_for_beginners(book_id, source_lang, max_chars)
 
     if steps_enabled.get("check_preparation"):
-        check_before_translate(book_id)
+        with profiling.profile_step("check_preparation", book_id):
+            check_before_translate(book_id)
         return
 
     if steps_enabled.get("generate_mems"):
-        mems.generate_memes_for_book(book_id, source_lang)
+        with profiling.profile_step("generate_mems", book_id):
+            mems.generate_memes_for_book(book_id, source_lang)
         return
 
     if steps_enabled.get("generate_pictures"):
-        pictures.generate_object_pictures_for_book(book_id)
+        with profiling.profile_step("generate_pictures", book_id):
+            pictures.generate_object_pictures_for_book(book_id)
         return
 
     if steps_enabled.get("collect_characters"):
-        characters.get_characters_appearance(book_id)
+        with profiling.profile_step("collect_characters", book_id):
+            characters.get_characters_appearance(book_id)
         return
 
     if steps_enabled.get("voice_narration"):
-        # voices = get_elevenlabs_voices(source_lang)
-        # voice_plan = voice.get_voice_plan_for_book(title, author, voices)
-        voice.generate_audio_for_chapters(
-            book_id=book_id,
-            is_simplified=False,
-            text_field="text_by_chapters",
-            # voice_plan=voice_plan,
-            output_dir=f"voice_book_{book_id}",
-            # voices_list=voices,
-            log_voice=config.get("options", {}).get("log_voice", False),
-            max_paragraphs=max_paragraphs
-        )
+        with profiling.profile_step("voice_narration", book_id):
+            # voices = get_elevenlabs_voices(source_lang)
+            # voice_plan = voice.get_voice_plan_for_book(title, author, voices)
+            voice.generate_audio_for_chapters(
+                book_id=book_id,
+                is_simplified=False,
+                text_field="text_by_chapters",
+                # voice_plan=voice_plan,
+                output_dir=f"voice_book_{book_id}",
+                # voices_list=voices,
+                log_voice=config.get("options", {}).get("log_voice", False),
+                max_paragraphs=max_paragraphs
+            )
         if not steps_enabled.get("voice_narration_simplified"):
             return
 
     if steps_enabled.get("voice_narration_simplified"):
-        # voices = get_elevenlabs_voices(source_lang)
-        # voice_plan = voice.get_voice_plan_for_book(title, author, voices)
-        voice.generate_audio_for_chapters(
-            book_id=book_id,
-            is_simplified=True,
-            text_field="text_by_chapters_simplified",
-            # voice_plan=voice_plan,
-            output_dir=f"voice_book_{book_id}",
-            # voices_list=voices,
-            log_voice=config.get("options", {}).get("log_voice", False),
-            max_paragraphs=max_paragraphs
-        )
+        with profiling.profile_step("voice_narration_simplified", book_id):
+            # voices = get_elevenlabs_voices(source_lang)
+            # voice_plan = voice.get_voice_plan_for_book(title, author, voices)
+            voice.generate_audio_for_chapters(
+                book_id=book_id,
+                is_simplified=True,
+                text_field="text_by_chapters_simplified",
+                # voice_plan=voice_plan,
+                output_dir=f"voice_book_{book_id}",
+                # voices_list=voices,
+                log_voice=config.get("options", {}).get("log_voice", False),
+                max_paragraphs=max_paragraphs
+            )
         return
 
     if steps_enabled.get("embeddings"):
-        embeddings.generate_embedding(book_id=book_id)
+        with profiling.profile_step("embeddings", book_id):
+            embeddings.generate_embedding(book_id=book_id)
 
     if steps_enabled.get("chapters_title"):
-        chapters.generate_titles(
-            book_id=book_id, book_title=title, book_author=author)
+        with profiling.profile_step("chapters_title", book_id):
+            chapters.generate_titles(
+                book_id=book_id, book_title=title, book_author=author)
 
     if steps_enabled.get("chapters_icons"):
-        chapters.generate_icons(
-            book_id=book_id, title=title, author=author)
+        with profiling.profile_step("chapters_icons", book_id):
+            chapters.generate_icons(
+                book_id=book_id, title=title, author=author)
 
     for lang in target_langs:
         print(f"🌐 Переводим на язык: {lang}")
 
         if steps_enabled.get("translate_sentences"):
-            preprocess.translate_text_structure(
-                book_id=book_id,
-                source_field="text_by_chapters",
-                result_field="text_by_chapters_sentence_translation",
-                source_lang=source_lang,
-                target_lang=lang,
-                max_chars=max_chars,
-                spacy_nlp=nlp,
-                chapter_number=-1
-            )
+            with profiling.profile_step("translate_sentences", book_id, lang):
+                preprocess.translate_text_structure(
+                    book_id=book_id,
+                    source_field="text_by_chapters",
+                    result_field="text_by_chapters_sentence_translation",
+                    source_lang=source_lang,
+                    target_lang=lang,
+                    max_chars=max_chars,
+                    spacy_nlp=nlp,
+                    chapter_number=-1
+                )
 
         if steps_enabled.get("translate_sentences_simplified"):
-            preprocess.translate_text_structure(
-                book_id=book_id,
-                source_field="text_by_chapters_simplified",
-                result_field="text_by_chapters_simplified_sentence_translation",
-                source_lang=source_lang,
-                target_lang=lang,
-                max_chars=max_chars,
-                spacy_nlp=nlp,
-                chapter_number=-1
-            )
+            with profiling.profile_step("translate_sentences_simplified", book_id, lang):
+                preprocess.translate_text_structure(
+                    book_id=book_id,
+                    source_field="text_by_chapters_simplified",
+                    result_field="text_by_chapters_simplified_sentence_translation",
+                    source_lang=source_lang,
+                    target_lang=lang,
+                    max_chars=max_chars,
+                    spacy_nlp=nlp,
+                    chapter_number=-1
+                )
 
         if steps_enabled.get("translate_words"):
-            preprocess.enrich_sentences_with_words(
-                book_id=book_id,
-                source_field="text_by_chapters_sentence_translation",
-                result_field="text_by_chapters_sentence_translation_words",
-                source_lang=source_lang,
-                target_lang=lang,
-                max_chars=max_chars,
-                paras_number=-1
-            )
+            with profiling.profile_step("translate_words", book_id, lang):
+                preprocess.enrich_sentences_with_words(
+                    book_id=book_id,
+                    source_field="text_by_chapters_sentence_translation",
+                    result_field="text_by_chapters_sentence_translation_words",
+                    source_lang=source_lang,
+                    target_lang=lang,
+                    max_chars=max_chars,
+                    paras_number=-1,
+                    two_phase=words_two_phase
+                )
 
         if steps_enabled.get("translate_words_simplified"):
-            preprocess.enrich_sentences_with_words(
-                book_id=book_id,
-                source_field="text_by_chapters_simplified_sentence_translation",
-                result_field="text_by_chapters_simplified_sentence_translation_words",
-                source_lang=source_lang,
-                target_lang=lang,
-                max_chars=max_chars,
-                paras_number=-1
-            )
+            with profiling.profile_step("translate_words_simplified", book_id, lang):
+                preprocess.enrich_sentences_with_words(
+                    book_id=book_id,
+                    source_field="text_by_chapters_simplified_sentence_translation",
+                    result_field="text_by_chapters_simplified_sentence_translation_words",
+                    source_lang=source_lang,
+                    target_lang=lang,
+                    max_chars=max_chars,
+                    paras_number=-1,
+                    two_phase=words_two_phase
+                )
+
+        if steps_enabled.get("vocabulary"):
+            with profiling.profile_step("vocabulary", book_id, lang):
+                vocabulary_store.sync(
+                    source_lang=source_lang,
+                    languages=[lang],
+                    fields=["text_by_chapters_sentence_translation_words",
+                            "text_by_chapters_simplified_sentence_translation_words"],
+                    book_ids=[book_id],
+                    refresh=True
+                )
 
         if steps_enabled.get("tasks_true_or_false"):
-            tasks.generate_paragraph_tasks(
-                book_id,
-                "text_by_chapters_sentence_translation",
-                "tasks_true_or_false",
-                lang,
-                source_lang
-            )
+            with profiling.profile_step("tasks_true_or_false", book_id, lang):
+                tasks.generate_paragraph_tasks(
+                    book_id,
+                    "text_by_chapters_sentence_translation",
+                    "tasks_true_or_false",
+                    lang,
+                    source_lang
+                )
 
         if steps_enabled.get("tasks_true_or_false_simplified"):
-            tasks.generate_paragraph_tasks(
-                book_id,
-                "text_by_chapters_simplified_sentence_translation",
-                "tasks_true_or_false_simplified",
-                lang,
-                source_lang
-            )
+            with profiling.profile_step("tasks_true_or_false_simplified", book_id, lang):
+                tasks.generate_paragraph_tasks(
+                    book_id,
+                    "text_by_chapters_simplified_sentence_translation",
+                    "tasks_true_or_false_simplified",
+                    lang,
+                    source_lang
+                )
 
         if steps_enabled.get("tasks_how_to_translate"):
-            tasks.add_how_to_translate_tasks(
-                book_id=book_id,
-                words_field="text_by_chapters_sentence_translation_words",
-                base_task_field="tasks_true_or_false",
-                result_field="tasks_truefalse_howto",
-                target_lang=lang,
-                source_lang=source_lang
-            )
+            with profiling.profile_step("tasks_how_to_translate", book_id, lang):
+                tasks.add_how_to_translate_tasks(
+                    book_id=book_id,
+                    words_field="text_by_chapters_sentence_translation_words",
+                    base_task_field="tasks_true_or_false",
+                    result_field="tasks_truefalse_howto",
+                    target_lang=lang,
+                    source_lang=source_lang
+                )
 
         if steps_enabled.get("tasks_how_to_translate_simplified"):
-            tasks.add_how_to_translate_tasks(
-                book_id=book_id,
-                words_field="text_by_chapters_simplified_sentence_translation_words",
-                base_task_field="tasks_true_or_false_simplified",
-                result_field="tasks_truefalse_howto_simplified",
-                target_lang=lang,
-                source_lang=source_lang
-            )
+            with profiling.profile_step("tasks_how_to_translate_simplified", book_id, lang):
+                tasks.add_how_to_translate_tasks(
+                    book_id=book_id,
+                    words_field="text_by_chapters_simplified_sentence_translation_words",
+                    base_task_field="tasks_true_or_false_simplified",
+                    result_field="tasks_truefalse_howto_simplified",
+                    target_lang=lang,
+                    source_lang=source_lang
+                )
 
         if steps_enabled.get("tasks_two_words"):
-            tasks.add_two_words_tasks(
-                book_id=book_id,
-                words_field="text_by_chapters_sentence_translation_words",
-                base_task_field="tasks_truefalse_howto",
-                result_field="tasks_truefalse_howto_words",
-                target_lang=lang
-            )
+            with profiling.profile_step("tasks_two_words", book_id, lang):
+                tasks.add_two_words_tasks(
+                    book_id=book_id,
+                    words_field="text_by_chapters_sentence_translation_words",
+                    base_task_field="tasks_truefalse_howto",
+                    result_field="tasks_truefalse_howto_words",
+                    target_lang=lang
+                )
 
         if steps_enabled.get("tasks_two_words_simplified"):
-            tasks.add_two_words_tasks(
-                book_id=book_id,
-                words_field="text_by_chapters_simplified_sentence_translation_words",
-                base_task_field="tasks_truefalse_howto_simplified",
-                result_field="tasks_truefalse_howto_words_simplified",
-                target_lang=lang
-            )
+            with profiling.profile_step("tasks_two_words_simplified", book_id, lang):
+                tasks.add_two_words_tasks(
+                    book_id=book_id,
+                    words_field="text_by_chapters_simplified_sentence_translation_words",
+                    base_task_field="tasks_truefalse_howto_simplified",
+                    result_field="tasks_truefalse_howto_words_simplified",
+                    target_lang=lang
+                )
+
+        if steps_enabled.get("tasks_combined"):
+            with profiling.profile_step("tasks_combined", book_id, lang):
+                tasks.generate_combined_tasks(
+                    book_id=book_id,
+                    words_field="text_by_chapters_sentence_translation_words",
+                    tf_field="tasks_true_or_false",
+                    how_to_field="tasks_truefalse_howto",
+                    two_words_field="tasks_truefalse_howto_words",
+                    target_lang=lang,
+                    source_lang=source_lang
+                )
+
+        if steps_enabled.get("tasks_combined_simplified"):
+            with profiling.profile_step("tasks_combined_simplified", book_id, lang):
+                tasks.generate_combined_tasks(
+                    book_id=book_id,
+                    words_field="text_by_chapters_simplified_sentence_translation_words",
+                    tf_field="tasks_true_or_false_simplified",
+                    how_to_field="tasks_truefalse_howto_simplified",
+                    two_words_field="tasks_truefalse_howto_words_simplified",
+                    target_lang=lang,
+                    source_lang=source_lang
+                )
 
         if steps_enabled.get("chapters_title_translate"):
-            chapters.translate_titles(
-                book_id=book_id,
-                source_field="chapters_titles",
-                result_field="chapters_titles_translations",
-                target_lang=lang,
-                gemini_refine=False
-            )
-
+            with profiling.profile_step("chapters_title_translate", book_id, lang):
+                chapters.translate_titles(
+                    book_id=book_id,
+                    source_field="chapters_titles",
+                    result_field="chapters_titles_translations",
+                    target_lang=lang,
+                    gemini_refine=False
+                )
+
+    metrics.inc("books_processed_total")
+    usage = prompts.usage_report()
+    if usage:
+        print(usage)
     print(
         f"🔧 [PID {pid}] [{proc_name}] ✅ Обработка книги ID {book_id} завершена")
+
+
+def process_book_id(book_id: int):
+    from utils import logger
+
+    try:
+        run_book(book_id)
+    finally:
+        # логи шагов пишет фоновый поток — дописываем их и закрываем файлы книги, пока воркер пула жив
+        logger.close_files(book_id)
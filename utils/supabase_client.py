@@ -1,13 +1,157 @@
 import os
+import gzip
+import json
+import base64
+
+import yaml
 from supabase import create_client, Client
 
+# Кодек больших JSON-полей (text_by_chapters, переводы, разбор слов, задания).
+# storage.encoding: plain — как есть; compact — JSON без отступов; gzip / zstd — сжатый компактный JSON
+# в base64 с меткой формата в начале строки. При чтении декодируются все форматы, поэтому старые
+# и новые записи читаются одинаково, а кодирование можно включать и выключать без миграции.
+
+ENCODED_FIELDS = {
+    "text_by_chapters",
+    "text_by_chapters_simplified",
+    "text_by_chapters_sentence_translation",
+    "text_by_chapters_simplified_sentence_translation",
+    "text_by_chapters_sentence_translation_words",
+    "text_by_chapters_simplified_sentence_translation_words",
+    "tasks_true_or_false",
+    "tasks_true_or_false_simplified",
+    "tasks_truefalse_howto",
+    "tasks_truefalse_howto_simplified",
+    "tasks_truefalse_howto_words",
+    "tasks_truefalse_howto_words_simplified",
+}
+PREFIXES = {"gzip": "b64+gzip:", "zstd": "b64+zstd:"}
+DEFAULT_MIN_BYTES = 4096
+
+_settings = None
+
+
+def settings() -> dict:
+    global _settings
+    if _settings is None:
+        try:
+            with open("config.yaml", "r", encoding="utf-8") as f:
+                _settings = (yaml.safe_load(f) or {}).get("storage", {}) or {}
+        except FileNotFoundError:
+            _settings = {}
+    return _settings
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("❌ storage.encoding: zstd требует пакет zstandard (pip install zstandard)")
+    return zstandard
+
+
+def encode_value(value: str, encoding: str = None) -> str:
+    """
+    Строка для записи в колонку: компактный JSON, при gzip / zstd — сжатый и с меткой формата.
+    """
+    encoding = encoding or settings().get("encoding", "plain")
+    if encoding == "plain" or not isinstance(value, str) or decoded_format(value):
+        return value
+    if encoding not in ("compact", *PREFIXES):
+        raise ValueError(f"❌ Неизвестный storage.encoding '{encoding}' (plain | compact | gzip | zstd)")
+    if len(value) < settings().get("encode_min_bytes", DEFAULT_MIN_BYTES):
+        return value
+    try:
+        value = json.dumps(json.loads(value), ensure_ascii=False, separators=(",", ":"))
+    except ValueError:
+        pass
+    if encoding == "compact":
+        return value
+    raw = value.encode("utf-8")
+    packed = gzip.compress(raw, compresslevel=6) if encoding == "gzip" else _zstd().ZstdCompressor(level=10).compress(raw)
+    return PREFIXES[encoding] + base64.b64encode(packed).decode("ascii")
+
+
+def decoded_format(value) -> str | None:
+    if isinstance(value, str):
+        for encoding, prefix in PREFIXES.items():
+            if value.startswith(prefix):
+                return encoding
+    return None
+
+
+def decode_value(value):
+    encoding = decoded_format(value)
+    if encoding is None:
+        return value
+    packed = base64.b64decode(value[len(PREFIXES[encoding]):])
+    raw = gzip.decompress(packed) if encoding == "gzip" else _zstd().ZstdDecompressor().decompress(packed)
+    return raw.decode("utf-8")
+
+
+def _encode_payload(payload):
+    if isinstance(payload, list):
+        return [_encode_payload(row) for row in payload]
+    if isinstance(payload, dict):
+        return {key: encode_value(value) if key in ENCODED_FIELDS else value for key, value in payload.items()}
+    return payload
+
+
+def _decode_payload(data):
+    if isinstance(data, list):
+        return [_decode_payload(row) for row in data]
+    if isinstance(data, dict):
+        return {key: decode_value(value) for key, value in data.items()}
+    return data
+
+
+class _CodecQuery:
+    """
+    Обёртка над построителем запроса postgrest: insert / update / upsert кодируют поля,
+    execute() возвращает ответ с уже декодированными полями.
+    """
+
+    def __init__(self, builder):
+        self._builder = builder
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if not callable(attr):
+            return _CodecQuery(attr) if hasattr(attr, "execute") else attr
+
+        def call(*args, **kwargs):
+            if name in ("insert", "update", "upsert") and args:
+                args = (_encode_payload(args[0]), *args[1:])
+            result = attr(*args, **kwargs)
+            if name == "execute":
+                if result is not None and getattr(result, "data", None) is not None:
+                    result.data = _decode_payload(result.data)
+                return result
+            return _CodecQuery(result) if hasattr(result, "execute") else result
+
+        return call
+
+
+class _CodecClient:
+    def __init__(self, client: Client):
+        self._client = client
+
+    def table(self, name: str) -> _CodecQuery:
+        return _CodecQuery(self._client.table(name))
+
+    from_ = table
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
 
 def get_supabase_client() -> Client:
     SUPABASE_URL = os.getenv("SUPABASE_URL")
     SUPABASE_KEY = os.getenv("SUPABASE_KEY")
     if not SUPABASE_URL or not SUPABASE_KEY:
         raise ValueError("❌ SUPABASE_URL или SUPABASE_KEY не заданы.")
-    return create_client(SUPABASE_URL, SUPABASE_KEY)
+    # клиент с кодеком больших полей; остальное (storage, rpc, auth) — без изменений
+    return _CodecClient(create_client(SUPABASE_URL, SUPABASE_KEY))
 
 
 def load_book_text(book_id: int) -> str:
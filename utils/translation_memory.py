@@ -0,0 +1,187 @@
+import re
+import sqlite3
+import difflib
+import threading
+from pathlib import Path
+
+import yaml
+
+from utils import metrics
+
+# Память переводов: уже переведённые предложения (и их разбор слов) по ключу
+# (текст оригинала, исходный язык, язык перевода, книга). Короткие повторяющиеся предложения
+# («he said.», диалоговые ремарки, служебные строки глав) берутся из памяти без запроса к GPT.
+# Точное совпадение — после нормализации пробелов; нечёткое (difflib) — только для переводов предложений,
+# с тем же числом слов и теми же числами.
+
+DEFAULT_PATH = "cache/translation_memory.sqlite"
+DEFAULT_MAX_WORDS = 12
+DEFAULT_FUZZY_THRESHOLD = 0.97
+FUZZY_CANDIDATES = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS memory (
+    kind TEXT NOT NULL,
+    source_lang TEXT NOT NULL,
+    target_lang TEXT NOT NULL,
+    book_id INTEGER NOT NULL,
+    source_text TEXT NOT NULL,
+    words INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL DEFAULT (datetime('now')),
+    PRIMARY KEY (kind, source_lang, target_lang, book_id, source_text)
+);
+CREATE INDEX IF NOT EXISTS memory_text ON memory (kind, source_lang, target_lang, source_text);
+CREATE INDEX IF NOT EXISTS memory_words ON memory (kind, source_lang, target_lang, words);
+"""
+
+NUMBER_PATTERN = re.compile(r"\d+")
+
+_settings = None
+
+
+def settings() -> dict:
+    global _settings
+    if _settings is None:
+        try:
+            with open("config.yaml", "r", encoding="utf-8") as f:
+                _settings = (yaml.safe_load(f) or {}).get("translation_memory", {}) or {}
+        except FileNotFoundError:
+            _settings = {}
+    return _settings
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+class TranslationMemory:
+    def __init__(self, source_lang: str, target_lang: str, book_id: int, path: str = None):
+        config = settings()
+        self.source_lang = source_lang
+        self.target_lang = target_lang
+        self.book_id = book_id
+        self.max_words = config.get("max_words", DEFAULT_MAX_WORDS)
+        self.fuzzy_threshold = config.get("fuzzy_threshold", DEFAULT_FUZZY_THRESHOLD)
+        self.share_across_books = config.get("share_across_books", True)
+        self.stats = {"exact": 0, "fuzzy": 0, "miss": 0, "stored": 0}
+
+        path = Path(path or config.get("path", DEFAULT_PATH))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def eligible(self, text: str) -> bool:
+        return 0 < len(text.split()) <= self.max_words
+
+    def _exact(self, kind: str, text: str) -> tuple | None:
+        # сначала своя книга, затем (если разрешено) любая другая
+        query = ("SELECT book_id, value FROM memory WHERE kind = ? AND source_lang = ? AND target_lang = ? "
+                 "AND source_text = ?")
+        params = [kind, self.source_lang, self.target_lang, text]
+        if not self.share_across_books:
+            query += " AND book_id = ?"
+            params.append(self.book_id)
+        rows = self._conn.execute(query, params).fetchall()
+        own = [row for row in rows if row[0] == self.book_id]
+        return (own or rows or [None])[0]
+
+    def _fuzzy(self, kind: str, text: str) -> tuple | None:
+        words = len(text.split())
+        query = ("SELECT book_id, value, source_text FROM memory WHERE kind = ? AND source_lang = ? "
+                 "AND target_lang = ? AND words = ?")
+        params = [kind, self.source_lang, self.target_lang, words]
+        if not self.share_across_books:
+            query += " AND book_id = ?"
+            params.append(self.book_id)
+        query += " ORDER BY hits DESC LIMIT ?"
+        params.append(FUZZY_CANDIDATES)
+
+        numbers = NUMBER_PATTERN.findall(text)
+        best, best_ratio = None, self.fuzzy_threshold
+        # SequenceMatcher кеширует вторую строку — фиксируем в ней искомый текст
+        matcher = difflib.SequenceMatcher(b=text, autojunk=False)
+        for book_id, value, candidate in self._conn.execute(query, params):
+            if NUMBER_PATTERN.findall(candidate) != numbers:
+                continue
+            matcher.set_seq1(candidate)
+            if matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = (book_id, value, candidate), ratio
+        return best
+
+    def find(self, text: str, kind: str = "sentence", fuzzy: bool = True) -> tuple | None:
+        """
+        (значение, book_id, исходный текст, "exact" | "fuzzy") без учёта в статистике; None — нет совпадения.
+        Попадание засчитывается через record_hits, когда совпадение действительно использовано.
+        """
+        text = normalize(text)
+        if not self.eligible(text):
+            return None
+        with self._lock:
+            row = self._exact(kind, text)
+            if row is not None:
+                return row[1], row[0], text, "exact"
+            if fuzzy and self.fuzzy_threshold and self.fuzzy_threshold < 1:
+                found = self._fuzzy(kind, text)
+                if found:
+                    return found[1], found[0], found[2], "fuzzy"
+        return None
+
+    def record_hits(self, kind: str, found: list[tuple]):
+        with self._lock, self._conn:
+            for _, book_id, source_text, match in found:
+                self._conn.execute(
+                    "UPDATE memory SET hits = hits + 1 WHERE kind = ? AND source_lang = ? AND target_lang = ? "
+                    "AND book_id = ? AND source_text = ?",
+                    (kind, self.source_lang, self.target_lang, book_id, source_text))
+                self.stats[match] += 1
+        for _, _, _, match in found:
+            metrics.inc("translation_memory_hits_total", kind=kind, match=match, lang=self.target_lang)
+
+    def record_misses(self, count: int = 1):
+        with self._lock:
+            self.stats["miss"] += count
+
+    def lookup(self, text: str, kind: str = "sentence", fuzzy: bool = True) -> str | None:
+        found = self.find(text, kind, fuzzy)
+        if found is None:
+            self.record_misses()
+            return None
+        self.record_hits(kind, [found])
+        return found[0]
+
+    def store(self, text: str, value: str, kind: str = "sentence"):
+        text = normalize(text)
+        if not self.eligible(text) or not value:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO memory (kind, source_lang, target_lang, book_id, source_text, words, value) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind, self.source_lang, self.target_lang, self.book_id, text, len(text.split()), value))
+            self.stats["stored"] += 1
+
+    def summary(self) -> str:
+        lookups = self.stats["exact"] + self.stats["fuzzy"] + self.stats["miss"]
+        hit_rate = round((self.stats["exact"] + self.stats["fuzzy"]) / lookups * 100) if lookups else 0
+        return (f"🧠 Память переводов: точных {self.stats['exact']}, нечётких {self.stats['fuzzy']}, "
+                f"промахов {self.stats['miss']} ({hit_rate}% попаданий), сохранено {self.stats['stored']}")
+
+    def close(self):
+        self._conn.close()
+
+
+def open_memory(source_lang: str, target_lang: str, book_id: int) -> TranslationMemory | None:
+    """
+    Память для книги или None, если translation_memory.enabled выключен.
+    """
+    if not settings().get("enabled", False):
+        return None
+    return TranslationMemory(source_lang, target_lang, book_id)
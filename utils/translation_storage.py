@@ -0,0 +1,199 @@
+import json
+from datetime import datetime, timezone
+
+import yaml
+
+# Хранение полей books_translations со структурой глав (переводы, разбор слов, задания).
+# storage.layout: json — как раньше, поле целиком в колонке;
+# paragraphs — строка на абзац в books_translations_paragraphs (sql/books_translations_paragraphs.sql),
+# а в колонке метка MARKER. Проверки «поле уже заполнено» видят метку как заполненное поле,
+# читатели получают прежний JSON через load_field / resolve, внешние — через вид books_translations_assembled.
+
+TABLE = "books_translations_paragraphs"
+MARKER = json.dumps({"storage": TABLE})
+CONFLICT_COLUMNS = "book_id,language,field,chapter_number,paragraph_number"
+PAGE_SIZE = 1000
+BATCH_SIZE = 200
+
+NORMALIZED_FIELDS = {
+    "text_by_chapters_sentence_translation",
+    "text_by_chapters_simplified_sentence_translation",
+    "text_by_chapters_sentence_translation_words",
+    "text_by_chapters_simplified_sentence_translation_words",
+    "tasks_true_or_false",
+    "tasks_true_or_false_simplified",
+    "tasks_truefalse_howto",
+    "tasks_truefalse_howto_simplified",
+    "tasks_truefalse_howto_words",
+    "tasks_truefalse_howto_words_simplified",
+}
+
+_settings = None
+
+
+def settings() -> dict:
+    global _settings
+    if _settings is None:
+        try:
+            with open("config.yaml", "r", encoding="utf-8") as f:
+                _settings = (yaml.safe_load(f) or {}).get("storage", {}) or {}
+        except FileNotFoundError:
+            _settings = {}
+    return _settings
+
+
+def layout() -> str:
+    value = settings().get("layout", "json")
+    if value not in ("json", "paragraphs"):
+        raise ValueError(f"❌ Неизвестный storage.layout '{value}' (json | paragraphs)")
+    return value
+
+
+def normalized(field: str) -> bool:
+    return layout() == "paragraphs" and field in NORMALIZED_FIELDS
+
+
+def is_marker(value) -> bool:
+    return isinstance(value, str) and value.strip() == MARKER
+
+
+# === Строки по абзацам ===
+
+def _row(book_id: int, language: str, field: str, chapter_number: int, paragraph_number: int,
+         content: dict, updated_at: str) -> dict:
+    return {
+        "book_id": book_id,
+        "language": language,
+        "field": field,
+        "chapter_number": chapter_number,
+        "paragraph_number": paragraph_number,
+        "content": content,
+        "updated_at": updated_at,
+    }
+
+
+def _rows(book_id: int, language: str, field: str, data: dict) -> list[dict]:
+    now = datetime.now(timezone.utc).isoformat()
+    rows = []
+    for chapter in data["chapters"]:
+        header = {key: value for key, value in chapter.items() if key != "paragraphs"}
+        rows.append(_row(book_id, language, field, chapter["chapter_number"], 0, header, now))
+        for paragraph in chapter.get("paragraphs", []):
+            rows.append(_row(book_id, language, field, chapter["chapter_number"],
+                             paragraph["paragraph_number"], paragraph, now))
+    return rows
+
+
+def _upsert(supabase, rows: list[dict]):
+    for start in range(0, len(rows), BATCH_SIZE):
+        supabase.table(TABLE).upsert(rows[start:start + BATCH_SIZE], on_conflict=CONFLICT_COLUMNS).execute()
+
+
+def _select_all(supabase, book_id: int, language: str, field: str, columns: str) -> list[dict]:
+    rows = []
+    while True:
+        page = supabase.table(TABLE).select(columns).eq("book_id", book_id).eq("language", language).eq(
+            "field", field).order("chapter_number").order("paragraph_number").range(
+            len(rows), len(rows) + PAGE_SIZE - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+
+
+def _delete_stale(supabase, book_id: int, language: str, field: str, keep: set):
+    stale = {}
+    for row in _select_all(supabase, book_id, language, field, "chapter_number, paragraph_number"):
+        key = (row["chapter_number"], row["paragraph_number"])
+        if key not in keep:
+            stale.setdefault(key[0], []).append(key[1])
+    for chapter_number, paragraph_numbers in stale.items():
+        supabase.table(TABLE).delete().eq("book_id", book_id).eq("language", language).eq("field", field).eq(
+            "chapter_number", chapter_number).in_("paragraph_number", paragraph_numbers).execute()
+
+
+def assemble(rows: list[dict]) -> dict:
+    """
+    Прежняя структура {"chapters": [...]} из строк таблицы (в любом порядке).
+    """
+    chapters = {}
+    for row in sorted(rows, key=lambda r: (r["chapter_number"], r["paragraph_number"])):
+        chapter = chapters.setdefault(row["chapter_number"],
+                                      {"chapter_number": row["chapter_number"], "paragraphs": []})
+        if row["paragraph_number"] > 0:
+            chapter["paragraphs"].append(row["content"])
+    return {"chapters": list(chapters.values())}
+
+
+# === Чтение ===
+
+def load_field(supabase, book_id: int, language: str, field: str, value):
+    """
+    Значение колонки как раньше: если в ней метка — JSON, собранный из строк по абзацам.
+    """
+    if not is_marker(value):
+        return value
+    rows = _select_all(supabase, book_id, language, field,
+                       "chapter_number, paragraph_number, content")
+    return json.dumps(assemble(rows), ensure_ascii=False) if rows else None
+
+
+def resolve(supabase, book_id: int, language: str, data: dict) -> dict:
+    """
+    load_field для всех колонок ответа select(...) из books_translations.
+    """
+    if not data:
+        return data
+    return {key: load_field(supabase, book_id, language, key, value) for key, value in data.items()}
+
+
+def load_paragraphs(supabase, book_id: int, language: str, field: str) -> dict:
+    """
+    Уже записанные абзацы поля: (глава, абзац) → абзац. Пусто, если поле хранится целиком.
+    """
+    if not normalized(field):
+        return {}
+    rows = _select_all(supabase, book_id, language, field, "chapter_number, paragraph_number, content")
+    return {(row["chapter_number"], row["paragraph_number"]): row["content"]
+            for row in rows if row["paragraph_number"] > 0}
+
+
+# === Запись ===
+
+def store_field(supabase, book_id: int, language: str, field: str, value, stored: set = None) -> str:
+    """
+    Значение для колонки books_translations: сам JSON (layout json) или MARKER после записи строк.
+    stored — ключи (глава, абзац), уже записанные save_paragraph: их повторно не отправляем.
+    """
+    if not normalized(field):
+        return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, indent=2)
+
+    data = json.loads(value) if isinstance(value, str) else value
+    rows = _rows(book_id, language, field, data)
+    stored = stored or set()
+    _upsert(supabase, [row for row in rows if (row["chapter_number"], row["paragraph_number"]) not in stored])
+    _delete_stale(supabase, book_id, language, field,
+                  {(row["chapter_number"], row["paragraph_number"]) for row in rows})
+    return MARKER
+
+
+def save_field(supabase, book_id: int, language: str, field: str, value, stored: set = None):
+    supabase.table("books_translations").update({
+        field: store_field(supabase, book_id, language, field, value, stored)
+    }).eq("book_id", book_id).eq("language", language).execute()
+
+
+def save_paragraph(supabase, book_id: int, language: str, field: str, chapter_number: int,
+                   paragraph: dict) -> bool:
+    """
+    Записывает один абзац (и заголовок его главы), не трогая остальную книгу.
+    Колонка не меняется: поле считается заполненным только после save_field.
+    False, если поле хранится целиком (layout json) — тогда сохраняется только вся книга в конце.
+    """
+    if not normalized(field):
+        return False
+    now = datetime.now(timezone.utc).isoformat()
+    _upsert(supabase, [
+        _row(book_id, language, field, chapter_number, 0, {"chapter_number": chapter_number}, now),
+        _row(book_id, language, field, chapter_number, paragraph["paragraph_number"], paragraph, now),
+    ])
+    return True
@@ -0,0 +1,274 @@
+import json
+import math
+import sqlite3
+import threading
+from pathlib import Path
+
+import yaml
+
+from utils import translation_storage
+from utils.supabase_client import get_supabase_client
+
+# Словарь корпуса в SQLite: производная от разборов слов (WordItem: o, o_t, l, l_t) в books_translations.
+# Книга попадает в базу один раз на (язык, поле) и дальше читается запросами, а не разбором JSON целиком:
+# частоты лемм для заданий, вхождения лемм по главам/абзацам, переводы по языкам, сложность глав.
+
+DEFAULT_PATH = "cache/vocabulary.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingested (
+    book_id INTEGER NOT NULL,
+    language TEXT NOT NULL,
+    field TEXT NOT NULL,
+    source_lang TEXT NOT NULL,
+    paragraphs INTEGER NOT NULL,
+    words INTEGER NOT NULL,
+    ingested_at TEXT NOT NULL DEFAULT (datetime('now')),
+    PRIMARY KEY (book_id, language, field)
+);
+CREATE TABLE IF NOT EXISTS lemmas (
+    id INTEGER PRIMARY KEY,
+    source_lang TEXT NOT NULL,
+    lemma TEXT NOT NULL,
+    UNIQUE (source_lang, lemma)
+);
+CREATE TABLE IF NOT EXISTS occurrences (
+    lemma_id INTEGER NOT NULL REFERENCES lemmas(id),
+    book_id INTEGER NOT NULL,
+    language TEXT NOT NULL,
+    field TEXT NOT NULL,
+    chapter INTEGER NOT NULL,
+    paragraph INTEGER NOT NULL,
+    sentence INTEGER NOT NULL,
+    word INTEGER NOT NULL,
+    form TEXT NOT NULL,
+    translation TEXT,
+    lemma_translation TEXT
+);
+CREATE INDEX IF NOT EXISTS occurrences_lemma ON occurrences (lemma_id, language);
+CREATE INDEX IF NOT EXISTS occurrences_book ON occurrences (book_id, language, field, chapter);
+"""
+
+_settings = None
+_lock = threading.Lock()
+
+
+def settings() -> dict:
+    global _settings
+    if _settings is None:
+        try:
+            with open("config.yaml", "r", encoding="utf-8") as f:
+                _settings = (yaml.safe_load(f) or {}).get("vocabulary", {}) or {}
+        except FileNotFoundError:
+            _settings = {}
+    return _settings
+
+
+def connect(path: str = None) -> sqlite3.Connection:
+    path = Path(path or settings().get("path", DEFAULT_PATH))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # несколько процессов пула пишут в одну базу: WAL и ожидание блокировки вместо ошибки
+    conn = sqlite3.connect(path, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def lemma_key(word: dict) -> str:
+    return (word.get("l") or word.get("o") or "").strip().lower()
+
+
+def is_ingested(conn: sqlite3.Connection, book_id: int, language: str, field: str) -> bool:
+    return conn.execute("SELECT 1 FROM ingested WHERE book_id = ? AND language = ? AND field = ?",
+                        (book_id, language, field)).fetchone() is not None
+
+
+def ingest_book(conn: sqlite3.Connection, book_id: int, language: str, field: str, words_data: dict,
+                source_lang: str) -> int:
+    """
+    Перезаписывает вхождения книги для (язык, поле). Возвращает число слов.
+    """
+    rows = []
+    paragraphs = 0
+    for chapter in words_data["chapters"]:
+        for paragraph in chapter["paragraphs"]:
+            paragraphs += 1
+            for sentence in paragraph["sentences"]:
+                for wid, word in enumerate(sentence.get("words", [])):
+                    lemma = lemma_key(word)
+                    if lemma:
+                        rows.append((lemma, chapter["chapter_number"], paragraph["paragraph_number"],
+                                     sentence["sentence_number"], wid + 1, word.get("o", ""),
+                                     word.get("o_t"), word.get("l_t") or None))
+
+    with _lock, conn:
+        conn.executemany("INSERT OR IGNORE INTO lemmas (source_lang, lemma) VALUES (?, ?)",
+                         {(source_lang, row[0]) for row in rows})
+        lemma_ids = dict(conn.execute("SELECT lemma, id FROM lemmas WHERE source_lang = ?", (source_lang,)))
+        conn.execute("DELETE FROM occurrences WHERE book_id = ? AND language = ? AND field = ?",
+                     (book_id, language, field))
+        conn.executemany(
+            "INSERT INTO occurrences (lemma_id, book_id, language, field, chapter, paragraph, sentence, word, "
+            "form, translation, lemma_translation) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(lemma_ids[row[0]], book_id, language, field, *row[1:]) for row in rows])
+        conn.execute("INSERT OR REPLACE INTO ingested (book_id, language, field, source_lang, paragraphs, words) "
+                     "VALUES (?, ?, ?, ?, ?, ?)", (book_id, language, field, source_lang, paragraphs, len(rows)))
+    return len(rows)
+
+
+def sync(source_lang: str, languages: list[str], fields: list[str], book_ids: list[int] = None,
+         refresh: bool = False, conn: sqlite3.Connection = None) -> int:
+    """
+    Дозагружает из books_translations книги, которых ещё нет в базе (refresh — все заново).
+    """
+    conn = conn or connect()
+    supabase = get_supabase_client()
+    added = 0
+
+    for language in languages:
+        rows = supabase.table("books_translations").select("book_id").eq("language", language).execute().data
+        for row in rows:
+            book_id = row["book_id"]
+            if book_ids is not None and book_id not in book_ids:
+                continue
+            for field in fields:
+                if not refresh and is_ingested(conn, book_id, language, field):
+                    continue
+                response = supabase.table("books_translations").select(field).eq(
+                    "book_id", book_id).eq("language", language).single().execute()
+                raw = translation_storage.load_field(supabase, book_id, language, field, response.data.get(field))
+                if not raw:
+                    continue
+                try:
+                    words = ingest_book(conn, book_id, language, field, json.loads(raw), source_lang)
+                except Exception as e:
+                    print(f"⚠️ Словарь: книга {book_id} ({language}, {field}) пропущена: {e}")
+                    continue
+                print(f"📚 Словарь: книга {book_id} ({language}, {field}) — {words} слов")
+                added += 1
+    return added
+
+
+# === Запросы ===
+
+def _book_scope(source_lang: str, field: str, language: str = None) -> tuple[str, tuple]:
+    """
+    Подзапрос (book_id, language): книги исходного языка с загруженным полем, каждая по одному языку —
+    заданному или первому, в котором книга загружена.
+    """
+    if language is None:
+        return ("SELECT book_id, MIN(language) AS language FROM ingested "
+                "WHERE source_lang = ? AND field = ? GROUP BY book_id"), (source_lang, field)
+    return ("SELECT book_id, language FROM ingested WHERE source_lang = ? AND field = ? AND language = ?",
+            (source_lang, field, language))
+
+
+def frequency_table(conn: sqlite3.Connection, source_lang: str, field: str, language: str = None) -> dict:
+    """
+    Частоты лемм: count (все вхождения), df (в скольких абзацах), paragraphs (всего абзацев), books.
+    Каждая книга считается один раз — по первому языку, в котором она загружена (если language не задан).
+    """
+    scope, params = _book_scope(source_lang, field, language)
+    books = conn.execute(f"SELECT i.book_id, i.paragraphs FROM ingested i JOIN ({scope}) s "
+                         f"USING (book_id, language) WHERE i.field = ?", (*params, field)).fetchall()
+    rows = conn.execute(
+        f"SELECT l.lemma, COUNT(*), COUNT(DISTINCT o.book_id || ':' || o.chapter || ':' || o.paragraph) "
+        f"FROM occurrences o JOIN ({scope}) s USING (book_id, language) JOIN lemmas l ON l.id = o.lemma_id "
+        f"WHERE o.field = ? GROUP BY l.lemma", (*params, field)).fetchall()
+    return {
+        "books": [book_id for book_id, _ in books],
+        "paragraphs": sum(paragraphs for _, paragraphs in books),
+        "count": {lemma: count for lemma, count, _ in rows},
+        "df": {lemma: df for lemma, _, df in rows},
+    }
+
+
+def occurrences(conn: sqlite3.Connection, lemma: str, source_lang: str, language: str = None,
+                limit: int = 100) -> list[dict]:
+    query = ("SELECT o.book_id, o.language, o.field, o.chapter, o.paragraph, o.sentence, o.word, o.form, "
+             "o.translation FROM occurrences o JOIN lemmas l ON l.id = o.lemma_id "
+             "WHERE l.source_lang = ? AND l.lemma = ?")
+    params = [source_lang, lemma.lower()]
+    if language:
+        query += " AND o.language = ?"
+        params.append(language)
+    query += " ORDER BY o.book_id, o.chapter, o.paragraph, o.sentence, o.word LIMIT ?"
+    params.append(limit)
+    columns = ["book_id", "language", "field", "chapter", "paragraph", "sentence", "word", "form", "translation"]
+    return [dict(zip(columns, row)) for row in conn.execute(query, params)]
+
+
+def translations(conn: sqlite3.Connection, lemma: str, source_lang: str, language: str) -> list[tuple[str, int]]:
+    """
+    Переводы леммы на язык по убыванию частоты.
+    """
+    return conn.execute(
+        "SELECT COALESCE(o.lemma_translation, o.translation) AS t, COUNT(*) AS n "
+        "FROM occurrences o JOIN lemmas l ON l.id = o.lemma_id "
+        "WHERE l.source_lang = ? AND l.lemma = ? AND o.language = ? AND t IS NOT NULL "
+        "GROUP BY t ORDER BY n DESC", (source_lang, lemma.lower(), language)).fetchall()
+
+
+def chapter_difficulty(conn: sqlite3.Connection, book_id: int, language: str, field: str,
+                       source_lang: str) -> list[dict]:
+    """
+    Сложность глав: средний idf слов, доля редких лемм (idf не ниже медианы корпуса) и число уникальных лемм.
+    """
+    table = frequency_table(conn, source_lang, field)
+    if not table["paragraphs"]:
+        return []
+    idf = {lemma: math.log((table["paragraphs"] + 1) / (df + 1)) + 1 for lemma, df in table["df"].items()}
+    median = sorted(idf.values())[len(idf) // 2] if idf else 0
+
+    max_idf = max(idf.values(), default=1)
+    chapters = {}
+    for chapter, lemma in conn.execute(
+            "SELECT o.chapter, l.lemma FROM occurrences o JOIN lemmas l ON l.id = o.lemma_id "
+            "WHERE o.book_id = ? AND o.language = ? AND o.field = ?", (book_id, language, field)):
+        chapters.setdefault(chapter, []).append(lemma)
+
+    result = []
+    for chapter, lemmas in sorted(chapters.items()):
+        values = [idf.get(lemma, max_idf) for lemma in lemmas]
+        result.append({
+            "chapter_number": chapter,
+            "words": len(values),
+            "lemmas": len(set(lemmas)),
+            "mean_idf": round(sum(values) / len(values), 3),
+            "rare_share": round(sum(1 for v in values if v >= median) / len(values), 3),
+        })
+    return result
+
+
+def common_lemmas(source_lang: str, field: str, limit: int = 100, conn: sqlite3.Connection = None) -> set[str]:
+    """
+    Самые частые леммы словаря (служебные слова) для исходного языка и поля: сначала по числу книг,
+    где лемма встречается, затем по числу вхождений. Каждая книга — по одному языку, как в frequency_table.
+    Пустое множество, если словарь ещё не собран.
+    """
+    conn = conn or connect()
+    scope, params = _book_scope(source_lang, field)
+    return {lemma for (lemma,) in conn.execute(
+        f"SELECT l.lemma FROM occurrences o JOIN ({scope}) s USING (book_id, language) "
+        f"JOIN lemmas l ON l.id = o.lemma_id WHERE o.field = ? "
+        f"GROUP BY l.lemma ORDER BY COUNT(DISTINCT o.book_id) DESC, COUNT(*) DESC LIMIT ?",
+        (*params, field, limit))}
+
+
+if __name__ == "__main__":
+    # python -m utils.vocabulary_store [--refresh] — заполняет словарь по всем книгам из config.yaml одним процессом
+    import sys
+
+    with open("config.yaml", "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    from dotenv import load_dotenv
+    load_dotenv()
+    added = sync(
+        source_lang=config["source_lang"],
+        languages=[lang.strip() for lang in config["target_lang"].split(",")],
+        fields=["text_by_chapters_sentence_translation_words",
+                "text_by_chapters_simplified_sentence_translation_words"],
+        refresh="--refresh" in sys.argv
+    )
+    print(f"✅ Словарь корпуса: загружено {added} (книга, язык, поле)")
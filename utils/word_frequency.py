@@ -0,0 +1,166 @@
+import math
+import threading
+from collections import Counter
+
+import yaml
+
+from utils import vocabulary_store
+
+# Индекс частот лемм по всем книгам одного исходного языка (из словаря корпуса utils/vocabulary_store).
+# Нужен заданиям how to translate: слова абзаца заранее ранжируются по редкости и «специфичности» для абзаца,
+# и в GPT уходят только лучшие кандидаты — или задание собирается локально, без запроса.
+
+DEFAULT_MODE = "llm"           # llm | ranked | local
+DEFAULT_TOP_K = 8
+DEFAULT_STOP_RANK = 100
+MAX_WORD_LEN = 22
+
+_settings = None
+_indexes = {}
+_lock = threading.Lock()
+
+
+def settings() -> dict:
+    global _settings
+    if _settings is None:
+        try:
+            with open("config.yaml", "r", encoding="utf-8") as f:
+                _settings = (yaml.safe_load(f) or {}).get("word_frequency", {}) or {}
+        except FileNotFoundError:
+            _settings = {}
+    return _settings
+
+
+def candidate_mode() -> str:
+    mode = settings().get("candidate_mode", DEFAULT_MODE)
+    if mode not in ("llm", "ranked", "local"):
+        raise ValueError(f"❌ Неизвестный режим кандидатов '{mode}' (llm | ranked | local)")
+    return mode
+
+
+def _paragraph_lemmas(paragraph: dict) -> list[str]:
+    return [key for sentence in paragraph["sentences"]
+            for key in (vocabulary_store.lemma_key(word) for word in sentence.get("words", [])) if key]
+
+
+class FrequencyIndex:
+    def __init__(self, data: dict = None):
+        data = data or {}
+        self.books = set(data.get("books", []))
+        self.paragraphs = data.get("paragraphs", 0)
+        self.count = Counter(data.get("count", {}))
+        self.df = Counter(data.get("df", {}))
+        self._stop = None
+
+    def add_book(self, book_id: int, words_data: dict):
+        if book_id in self.books:
+            return
+        for chapter in words_data["chapters"]:
+            for paragraph in chapter["paragraphs"]:
+                lemmas = _paragraph_lemmas(paragraph)
+                self.count.update(lemmas)
+                self.df.update(set(lemmas))
+                self.paragraphs += 1
+        self.books.add(book_id)
+        self._stop = None
+
+    def idf(self, lemma: str) -> float:
+        return math.log((self.paragraphs + 1) / (self.df.get(lemma, 0) + 1)) + 1
+
+    def is_stopword(self, lemma: str) -> bool:
+        """
+        Самые частые леммы корпуса (артикли, предлоги, служебные глаголы) ответом не бывают.
+        """
+        if self._stop is None:
+            stop_rank = settings().get("stop_rank", DEFAULT_STOP_RANK)
+            self._stop = {lemma for lemma, _ in self.count.most_common(stop_rank)}
+        return lemma in self._stop
+
+
+def index_for(source_lang: str, words_field: str, target_lang: str, book_id: int, words_data: dict) -> FrequencyIndex:
+    """
+    Индекс с текущей книгой. Частоты берутся из словаря корпуса (utils/vocabulary_store).
+    Весь корпус здесь не загружается: воркеры пула делали бы это одновременно. Словарь заполняется явно —
+    шагом vocabulary или `python -m utils.vocabulary_store`; пока он пуст, частоты считаются по текущей книге.
+    """
+    key = (source_lang, words_field)
+    with _lock:
+        conn = vocabulary_store.connect()
+        try:
+            if not vocabulary_store.is_ingested(conn, book_id, target_lang, words_field):
+                if not vocabulary_store.frequency_table(conn, source_lang, words_field)["books"]:
+                    print(f"⚠️ Словарь корпуса ({source_lang}, {words_field}) пуст — частоты только по текущей книге. "
+                          f"Заполнить: python -m utils.vocabulary_store")
+                vocabulary_store.ingest_book(conn, book_id, target_lang, words_field, words_data, source_lang)
+            index = _indexes.get(key)
+            if index is None:
+                index = FrequencyIndex(vocabulary_store.frequency_table(conn, source_lang, words_field))
+                _indexes[key] = index
+        finally:
+            conn.close()
+        index.add_book(book_id, words_data)
+        return index
+
+
+def rank_words(index: FrequencyIndex, chapter_number: int, paragraph: dict) -> list[dict]:
+    """
+    Слова абзаца по убыванию tf·idf (чем реже в корпусе и чаще в абзаце, тем выше).
+    ID те же, что у tasks.how_to_translate_words.
+    """
+    paragraph_counts = Counter(_paragraph_lemmas(paragraph))
+    ranked = []
+    seen = set()
+
+    for sentence in paragraph["sentences"]:
+        sid = sentence["sentence_number"]
+        for wid, word in enumerate(sentence.get("words", [])):
+            o = word["o"].strip()
+            o_t = word["o_t"].strip()
+            lemma = vocabulary_store.lemma_key(word)
+            if not lemma or len(o) > MAX_WORD_LEN or len(o_t) > MAX_WORD_LEN or lemma in seen:
+                continue
+            # имена собственные в середине предложения и числа — не лексика для проверки
+            if (wid > 0 and o[:1].isupper()) or any(ch.isdigit() for ch in o):
+                continue
+            if index.is_stopword(lemma):
+                continue
+            seen.add(lemma)
+            ranked.append({
+                "id": f"{chapter_number}_{paragraph['paragraph_number']}_{sid}_{wid + 1}",
+                "o": word["o"],
+                "o_t": word["o_t"],
+                "score": paragraph_counts[lemma] * index.idf(lemma),
+                "idf": index.idf(lemma),
+                "phrase": len(o.split()) > 1,
+            })
+
+    ranked.sort(key=lambda item: -item["score"])
+    return ranked
+
+
+def top_candidates(ranked: list[dict], top_k: int = None) -> list[dict]:
+    """
+    Первые top_k слов в формате промпта how to translate.
+    """
+    top_k = top_k or settings().get("top_k", DEFAULT_TOP_K)
+    return [{"id": item["id"], "o": item["o"], "o_t": item["o_t"]} for item in ranked[:top_k]]
+
+
+def pick_local(ranked: list[dict]) -> dict | None:
+    """
+    Задание без GPT: самое специфичное слово и два отвлекающих того же вида (слово/фраза)
+    с близкой частотой и другим переводом.
+    """
+    if len(ranked) < 3:
+        return None
+    correct = ranked[0]
+    others = [item for item in ranked[1:]
+              if item["o_t"].strip().lower() != correct["o_t"].strip().lower()]
+    others.sort(key=lambda item: (item["phrase"] != correct["phrase"], abs(item["idf"] - correct["idf"])))
+    distractors = []
+    for item in others:
+        if all(item["o_t"].strip().lower() != d["o_t"].strip().lower() for d in distractors):
+            distractors.append(item)
+        if len(distractors) == 2:
+            return {"c": correct["id"], "i1": distractors[0]["id"], "i2": distractors[1]["id"]}
+    return None